@@ -0,0 +1,343 @@
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Iterable, Iterator
+
+from ..models.user import User
+
+# Header: magic, record size, hash table slots, records used, deleted hash
+# slots, highest user id ever stored
+HEADER = struct.Struct('<8sIIQQQ')
+HEADER_SIZE = 64
+MAGIC = b'ECACCT02'
+# Record: live flag, username, email, password hash (UTF-8, NUL padded),
+# balance in kobo, user id
+RECORD = struct.Struct('<B64s128s192sqq7x')
+# Files written before accounts had user ids, which are upgraded when opened
+LEGACY_MAGIC = b'ECACCT01'
+LEGACY_RECORD = struct.Struct('<B64s128s192sq7x')
+RECORD_SIZE = RECORD.size
+BALANCE_OFFSET = 1 + 64 + 128 + 192
+SLOT = struct.Struct('<I')
+EMPTY = 0
+DELETED = 0xFFFFFFFF
+# Hash tables have at least this many slots, and are rebuilt larger when over half full
+INITIAL_SLOTS = 1024
+# Records are added in blocks of this many, to avoid resizing the file on every sign-up
+GROWTH_RECORDS = 4096
+
+
+class AccountFile:
+    """
+    Accounts in a binary file of fixed-width records, accessed through mmap.
+
+    Two open-addressing hash tables at the start of the file map the
+    lowercased username and email to a record number, so opening the file
+    only maps it, and finding an account decodes just that record. Changing
+    an account rewrites its record in place; a balance change rewrites only
+    the balance field.
+
+    Writes go to the page cache; call flush() to force them to disk. Deleted
+    records are skipped and dropped when the hash tables are rebuilt. The
+    header keeps the highest user id ever stored, so ids of deleted accounts
+    are not handed out again (see last_user_id).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._file = None
+        self._map: mmap.mmap | None = None
+        self.slots = 0
+        self.record_count = 0
+        self.tombstones = 0
+        self.last_user_id = 0
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            self._create(path, INITIAL_SLOTS, [], 0)
+        self._open()
+
+    # Layout
+
+    def _tables_size(self, slots: int) -> int:
+        return 2 * slots * SLOT.size
+
+    def _records_offset(self) -> int:
+        return HEADER_SIZE + self._tables_size(self.slots)
+
+    def _record_offset(self, number: int) -> int:
+        return self._records_offset() + number * RECORD_SIZE
+
+    def _capacity(self) -> int:
+        return (len(self._map) - self._records_offset()) // RECORD_SIZE
+
+    def _create(self, path: str, slots: int, records: list, last_user_id: int) -> None:
+        """Write a new file at `path` holding `records` (packed), with `slots` hash slots per table."""
+        tmp_path = f"{path}.tmp"
+        capacity = max(len(records), GROWTH_RECORDS)
+        with open(tmp_path, 'wb') as f:
+            f.truncate(HEADER_SIZE + 2 * slots * SLOT.size + capacity * RECORD_SIZE)
+            f.write(HEADER.pack(MAGIC, RECORD_SIZE, slots, len(records), 0, last_user_id))
+        with open(tmp_path, 'r+b') as f:
+            with mmap.mmap(f.fileno(), 0) as data:
+                records_offset = HEADER_SIZE + 2 * slots * SLOT.size
+                for number, record in enumerate(records):
+                    data[records_offset + number * RECORD_SIZE:records_offset + (number + 1) * RECORD_SIZE] = record
+                    _, username, email, _, _, _ = RECORD.unpack(record)
+                    self._insert_slot(data, slots, 0, _text(username).lower(), number)
+                    self._insert_slot(data, slots, 1, _text(email).lower(), number)
+                data.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _open(self) -> None:
+        self._file = open(self.path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, record_size, self.slots, self.record_count, self.tombstones, self.last_user_id = \
+            HEADER.unpack_from(self._map, 0)
+        if magic == LEGACY_MAGIC and record_size == LEGACY_RECORD.size:
+            self._upgrade()
+        elif magic != MAGIC or record_size != RECORD_SIZE:
+            raise ValueError(f"{self.path} is not an accounts file")
+
+    def _upgrade(self) -> None:
+        """Rewrite a file from before user ids, numbering its accounts 1, 2, 3, ... in the order they were added."""
+        records_offset = HEADER_SIZE + 2 * self.slots * SLOT.size
+        records = []
+        for number in range(self.record_count):
+            live, username, email, password_hash, balance = LEGACY_RECORD.unpack_from(
+                self._map, records_offset + number * LEGACY_RECORD.size)
+            if live:
+                records.append(RECORD.pack(1, username, email, password_hash, balance, len(records) + 1))
+        slots = INITIAL_SLOTS
+        while len(records) * 4 > slots:
+            slots *= 2
+        self.close()
+        self._create(self.path, slots, records, len(records))
+        self._open()
+
+    def _write_header(self) -> None:
+        HEADER.pack_into(self._map, 0, MAGIC, RECORD_SIZE, self.slots, self.record_count, self.tombstones,
+                         self.last_user_id)
+
+    # Hash tables (table 0: username, table 1: email)
+
+    @staticmethod
+    def _insert_slot(data, slots: int, table: int, key: str, number: int) -> bool:
+        """Point a free slot for `key` at record `number`; return True if it was a deleted slot."""
+        base = HEADER_SIZE + table * slots * SLOT.size
+        slot = zlib.crc32(key.encode()) & (slots - 1)
+        while True:
+            offset = base + slot * SLOT.size
+            entry = SLOT.unpack_from(data, offset)[0]
+            if entry in (EMPTY, DELETED):
+                SLOT.pack_into(data, offset, number + 1)
+                return entry == DELETED
+            slot = (slot + 1) & (slots - 1)
+
+    def _link(self, table: int, key: str, number: int) -> None:
+        if self._insert_slot(self._map, self.slots, table, key, number):
+            self.tombstones -= 1
+
+    def _find_slot(self, table: int, key: str) -> int:
+        """Return the byte offset of the hash slot pointing at `key`'s record, or -1."""
+        base = HEADER_SIZE + table * self.slots * SLOT.size
+        slot = zlib.crc32(key.encode()) & (self.slots - 1)
+        field = 1 + table
+        while True:
+            offset = base + slot * SLOT.size
+            entry = SLOT.unpack_from(self._map, offset)[0]
+            if entry == EMPTY:
+                return -1
+            if entry != DELETED and _text(RECORD.unpack_from(self._map, self._record_offset(entry - 1))[field]).lower() == key:
+                return offset
+            slot = (slot + 1) & (self.slots - 1)
+
+    def _lookup(self, table: int, key: str) -> int:
+        offset = self._find_slot(table, key)
+        return -1 if offset < 0 else SLOT.unpack_from(self._map, offset)[0] - 1
+
+    def _unlink(self, table: int, key: str) -> None:
+        offset = self._find_slot(table, key)
+        if offset >= 0:
+            SLOT.pack_into(self._map, offset, DELETED)
+            self.tombstones += 1
+
+    def _make_room(self) -> None:
+        # Keep every table at most half full counting deleted slots, so probes
+        # always reach an empty slot
+        if (self.record_count + self.tombstones + 2) * 2 > self.slots:
+            self._rebuild()
+
+    # Public API
+
+    def find(self, identity: str) -> User | None:
+        """Decode the account whose username or email is `identity` (case-insensitive), or None."""
+        key = identity.strip().lower()
+        with self._lock:
+            number = self._lookup(0, key)
+            if number < 0:
+                number = self._lookup(1, key)
+            return self._decode(number) if number >= 0 else None
+
+    def has_username(self, username: str) -> bool:
+        with self._lock:
+            return self._lookup(0, username.strip().lower()) >= 0
+
+    def has_email(self, email: str) -> bool:
+        with self._lock:
+            return self._lookup(1, email.strip().lower()) >= 0
+
+    def put(self, user: User, previous_username: str | None = None) -> None:
+        """
+        Write `user` to its record, adding one if the account is new.
+
+        A user without an id (as journaled before accounts had ids) keeps
+        the id of its record, or gets the next free one if it is new.
+
+        :param user: The new or changed User
+        :param previous_username: The username before a rename, if it changed
+        :raises ValueError: If a field does not fit its record field
+        """
+        fields = (*_fields(user), user.balance)
+        with self._lock:
+            self._make_room()
+            number = self._lookup(0, (previous_username or user.username).lower())
+            if number < 0:
+                self._append(RECORD.pack(1, *fields, user.user_id or self.last_user_id + 1), user)
+                return
+            offset = self._record_offset(number)
+            _, old_username, old_email, old_hash, _, old_user_id = RECORD.unpack_from(self._map, offset)
+            record = RECORD.pack(1, *fields, user.user_id or old_user_id)
+            if RECORD.pack(1, old_username, old_email, old_hash, user.balance, old_user_id) == record:
+                struct.pack_into('<q', self._map, offset + BALANCE_OFFSET, user.balance)
+                return
+            # Old keys are unlinked while the record still holds them, as that
+            # is what _find_slot compares against
+            old_username, old_email = _text(old_username).lower(), _text(old_email).lower()
+            renamed = old_username != user.username.lower()
+            new_email = old_email != user.email.lower()
+            if renamed:
+                self._unlink(0, old_username)
+            if new_email:
+                self._unlink(1, old_email)
+            self._map[offset:offset + RECORD_SIZE] = record
+            if renamed:
+                self._link(0, user.username.lower(), number)
+            if new_email:
+                self._link(1, user.email.lower(), number)
+            self._write_header()
+
+    def _append(self, record: bytes, user: User) -> None:
+        if self.record_count >= self._capacity():
+            self._map.close()
+            self._file.truncate(self._record_offset(self.record_count + GROWTH_RECORDS))
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        number = self.record_count
+        offset = self._record_offset(number)
+        self._map[offset:offset + RECORD_SIZE] = record
+        self._link(0, user.username.lower(), number)
+        self._link(1, user.email.lower(), number)
+        self.record_count += 1
+        self.last_user_id = max(self.last_user_id, RECORD.unpack(record)[5])
+        self._write_header()
+
+    def replace_all(self, users: Iterable[User]) -> None:
+        """Atomically replace the file's contents with `users`, e.g. to import them in bulk."""
+        records = [RECORD.pack(1, *_fields(user), user.balance, user.user_id) for user in users]
+        slots = INITIAL_SLOTS
+        while len(records) * 4 > slots:
+            slots *= 2
+        with self._lock:
+            last_user_id = max([self.last_user_id] + [RECORD.unpack(record)[5] for record in records])
+            self.close()
+            self._create(self.path, slots, records, last_user_id)
+            self._open()
+
+    def delete(self, username: str) -> None:
+        """Delete the account with this username, if there is one."""
+        key = username.strip().lower()
+        with self._lock:
+            number = self._lookup(0, key)
+            if number < 0:
+                return
+            offset = self._record_offset(number)
+            email = _text(RECORD.unpack_from(self._map, offset)[2]).lower()
+            self._unlink(0, key)
+            self._unlink(1, email)
+            self._map[offset] = 0
+            self._write_header()
+
+    def _decode(self, number: int) -> User:
+        live, username, email, password_hash, balance, user_id = RECORD.unpack_from(
+            self._map, self._record_offset(number))
+        return User(_text(username), _text(email), _text(password_hash), balance, user_id)
+
+    def _live_records(self) -> Iterator[bytes]:
+        for number in range(self.record_count):
+            offset = self._record_offset(number)
+            if self._map[offset]:
+                yield bytes(self._map[offset:offset + RECORD_SIZE])
+
+    def _rebuild(self) -> None:
+        """Rewrite the file without deleted records, with tables at most a quarter full."""
+        records = list(self._live_records())
+        slots = INITIAL_SLOTS
+        while len(records) * 4 > slots:
+            slots *= 2
+        self.close()
+        self._create(self.path, slots, records, self.last_user_id)
+        self._open()
+
+    def __iter__(self) -> Iterator[User]:
+        """Decode every live account, in the order they were added."""
+        with self._lock:
+            numbers = [n for n in range(self.record_count) if self._map[self._record_offset(n)]]
+        for number in numbers:
+            with self._lock:
+                user = self._decode(number)
+            yield user
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(1 for n in range(self.record_count) if self._map[self._record_offset(n)])
+
+    def flush(self) -> None:
+        """Force every change to disk."""
+        with self._lock:
+            self._map.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._map is not None:
+                self._map.flush()
+                self._map.close()
+                self._map = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def check_fields(user: User) -> None:
+    """
+    Check that the user's username, email and password hash fit a record.
+
+    :raises ValueError: If one of them is too long
+    """
+    _fields(user)
+
+
+def _fields(user: User) -> tuple:
+    return _field(user.username, 64), _field(user.email, 128), _field(user.password_hash, 192)
+
+
+def _field(value: str, size: int) -> bytes:
+    data = value.encode()
+    if len(data) > size:
+        raise ValueError(f"{value[:20]!r}... is longer than {size} bytes")
+    return data
+
+
+def _text(field: bytes) -> str:
+    return field.rstrip(b'\0').decode()
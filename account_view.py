@@ -1,7 +1,10 @@
-from ..models.user import users, current_user, cart
+from ..services.session import Session
 from ..utils.auth import verify_current_password
-from ..utils.validators import validate_email, validate_password
-from ..services.user_service import save_users
+from ..utils.credentials import hash_password, verify_password
+from ..utils.money import format_kobo, to_kobo
+from ..utils.validators import validate_email, validate_password, validate_username_length, MAX_USERNAME_BYTES
+from ..services.user_service import save_user, save_user_deletion, username_taken, email_taken, rename_user, \
+    change_user_email, remove_user
 
 
 def display_account_menu():
@@ -16,15 +19,17 @@ def display_account_menu():
     print("7. Back to Store Menu")
 
 
-def change_username() -> None:
+def change_username(session: Session) -> None:
     """
     Change the current user's username after password verification.
 
     Requires current password confirmation and ensures new username
     is not empty and unique across all users.
     """
+    current_user = session.user
+
     while True:
-        if not verify_current_password():
+        if not verify_current_password(session):
             print("Incorrect password ❌")
             return
         new_username: str = input("Enter new username: ").strip()
@@ -37,30 +42,35 @@ def change_username() -> None:
         if not new_username.isalnum():
             print("Username must contain only letters and numbers")
             continue
-        for user in users:
-            if user['username'] == new_username:
-                print("Username already taken! ❌")
-                continue
+        if not validate_username_length(new_username):
+            print(f"Username must be at most {MAX_USERNAME_BYTES} characters")
+            continue
+        if username_taken(new_username) and new_username.lower() != current_user.username.lower():
+            print("Username already taken! ❌")
+            continue
         break
 
     try:
-        current_user['username'] = new_username
-        save_users()
+        previous_username: str = current_user.username
+        if not rename_user(current_user, new_username):
+            print("Username already taken! ❌")
+            return
+        save_user(current_user, previous_username)
         print("\nUsername updated successfully ✅")
     except Exception as e:
         print(f"Error saving username: {e}")
 
 
-def change_email() -> None:
+def change_email(session: Session) -> None:
     """
     Change the current user's email address after password verification.
 
     Requires current password confirmation and ensures new email
     has valid format and is unique across all users.
     """
-    global current_user
+    current_user = session.user
 
-    if not verify_current_password():
+    if not verify_current_password(session):
         print("Incorrect password")
         return
 
@@ -70,24 +80,21 @@ def change_email() -> None:
             print("Email is not correct! 😒")
             continue
 
-        email_exists = False
-        for user in users:
-            if user['email'] == new_email:
-                print("Email already exist! ❌")
-                email_exists = True
-                break
-        if not email_exists:
-            break
+        if email_taken(new_email) and new_email != current_user.email.lower():
+            print("Email already exist! ❌")
+            continue
         break
     try:
-        current_user['email'] = new_email
-        save_users()
+        if not change_user_email(current_user, new_email):
+            print("Email already exist! ❌")
+            return
+        save_user(current_user)
         print("\nEmail updated successfully! 📧")
     except Exception as e:
         print(f"Error saving email: {e}")
 
 
-def change_password() -> None:
+def change_password(session: Session) -> None:
     """
     Change the current user's password after verification.
 
@@ -95,9 +102,9 @@ def change_password() -> None:
     meets security requirements (16+ chars, uppercase, lowercase,
     number, special character). Final confirmation before applying changes.
     """
-    global current_user
+    current_user = session.user
 
-    if not verify_current_password():
+    if not verify_current_password(session):
         print("Incorrect password")
         return
 
@@ -117,7 +124,7 @@ def change_password() -> None:
         if new_password != confirm_password:
             print("Passwords do not match")
             continue
-        if hash_password(new_password) == current_user['password_hash']:
+        if verify_password(new_password, current_user.password_hash):
             print("New password cannot be the same as current password")
             continue
         break
@@ -126,7 +133,8 @@ def change_password() -> None:
     if confirm == 'y':
 
         try:
-            save_users()
+            current_user.password_hash = hash_password(new_password)
+            save_user(current_user)
             print("\nPassword changed successfully ✅")
         except Exception as e:
             print(f"Error saving password: {e}")
@@ -134,50 +142,52 @@ def change_password() -> None:
         print("\nPassword change cancelled")
 
 
-def view_account_details() -> None:
+def view_account_details(session: Session) -> None:
     """
     Display the current user's account information after password verification.
 
     Shows username, email, and current wallet balance.
     Requires password confirmation for security.
     """
-    if not verify_current_password():
+    current_user = session.user
+
+    if not verify_current_password(session):
         print("Incorrect password")
         return
 
     print("\n" + "=" * 30)
     print("      ACCOUNT DETAILS")
     print("=" * 30)
-    print(f"Username:  {current_user['username']}")
-    print(f"Email:     {current_user['email']}")
-    print(f"Balance:   NGN {current_user['balance']:,.2f}")
+    print(f"Username:  {current_user.username}")
+    print(f"Email:     {current_user.email}")
+    print(f"Balance:   NGN {format_kobo(current_user.balance)}")
     print("\n" + "=" * 30)
 
 
-def reset_balance() -> None:
+def reset_balance(session: Session) -> None:
     """
     Reset the current user's wallet balance to zero.
 
     Requires password verification and user confirmation before proceeding.
     This action is irreversible and will permanently remove all funds.
     """
-    global current_user
+    current_user = session.user
 
-    if not verify_current_password():
+    if not verify_current_password(session):
         print("Incorrect password")
         return
-    print(f"\nCurrent balance: NGN {current_user['balance']:,.2f}")
+    print(f"\nCurrent balance: NGN {format_kobo(current_user.balance)}")
     confirm: str = input("Are you sure you want to reset your balance to zero? (y/n): ").strip().lower()
     if confirm == 'y':
-        if current_user['balance'] > 50000:  # For large amounts
+        if current_user.balance > to_kobo(50000):  # For large amounts
             print("⚠️  WARNING: You have a significant balance!")
             confirm_again: str = input("Type 'RESET' to confirm: ").strip()
             if confirm_again != 'RESET':
                 print("\nBalance reset cancelled")
                 return
-        current_user['balance'] = 0.0
+        current_user.balance = 0
         try:
-            save_users()
+            save_user(current_user)
             print("\nBalance reset to zero ✅")
         except Exception as e:
             print(f"Error saving balance reset: {e}")
@@ -185,50 +195,48 @@ def reset_balance() -> None:
         print("\nBalance reset cancelled")
 
 
-def delete_account() -> bool:
-    def delete_account() -> bool:
-        """
-        Delete the current user's account after verification and confirmation.
+def delete_account(session: Session) -> bool:
+    """
+    Delete the current user's account after verification and confirmation.
 
-        Requires password verification and explicit user confirmation.
-        Removes user from system, clears current session, and returns to main menu.
+    Requires password verification and explicit user confirmation.
+    Removes user from system, signs the session out, and returns to main menu.
 
-        Returns:
-            bool: True if account was deleted, False if cancelled or failed
-        """
-        global current_user, users, cart
+    Returns:
+        bool: True if account was deleted, False if cancelled or failed
+    """
+    current_user = session.user
 
-        if not verify_current_password():
-            print("Incorrect password")
-            return False
+    if not verify_current_password(session):
+        print("Incorrect password")
+        return False
 
-        if current_user['balance'] > 0:
-            print(f"⚠️  WARNING: You have NGN {current_user['balance']:,.2f} in your wallet!")
-            print("This balance will be permanently lost if you delete your account.")
-
-        confirm = input("ARE YOU SURE YOU WANT TO DELETE YOUR ACCOUNT? THIS CANNOT BE UNDONE! (y/n): ").strip().lower()
-        if confirm == 'y':
-            confirm2 = input("Type 'DELETE' to confirm deletion: ").strip()
-            if confirm2 != 'DELETE':
-                print("\nAccount deletion cancelled")
-                return False
-            users.remove(current_user)
-            try:
-                save_users()
-                current_user = None
-                cart = []
-                print("\nAccount deleted successfully. Returning to main menu. 🗑️")
-                return True
-            except Exception as e:
-                print(f"Error deleting account: {e}")
-                # Could potentially restore user to list
-                return False
-        else:
+    if current_user.balance > 0:
+        print(f"⚠️  WARNING: You have NGN {format_kobo(current_user.balance)} in your wallet!")
+        print("This balance will be permanently lost if you delete your account.")
+
+    confirm = input("ARE YOU SURE YOU WANT TO DELETE YOUR ACCOUNT? THIS CANNOT BE UNDONE! (y/n): ").strip().lower()
+    if confirm == 'y':
+        confirm2 = input("Type 'DELETE' to confirm deletion: ").strip()
+        if confirm2 != 'DELETE':
             print("\nAccount deletion cancelled")
             return False
+        remove_user(current_user)
+        try:
+            save_user_deletion(current_user.username)
+            session.sign_out()
+            print("\nAccount deleted successfully. Returning to main menu. 🗑️")
+            return True
+        except Exception as e:
+            print(f"Error deleting account: {e}")
+            # Could potentially restore user to list
+            return False
+    else:
+        print("\nAccount deletion cancelled")
+        return False
 
 
-def account_menu() -> None:
+def account_menu(session: Session) -> None:
     """
     Handle account management menu operations.
 
@@ -240,17 +248,17 @@ def account_menu() -> None:
         display_account_menu()
         user_choice: str = input("Enter choice (1-7): ").strip()
         if user_choice == '1':
-            change_username()
+            change_username(session)
         elif user_choice == '2':
-            change_email()
+            change_email(session)
         elif user_choice == '3':
-            change_password()
+            change_password(session)
         elif user_choice == '4':
-            view_account_details()
+            view_account_details(session)
         elif user_choice == "5":
-            reset_balance()
+            reset_balance(session)
         elif user_choice == "6":
-            if delete_account():
+            if delete_account(session):
                 return  # Return to main menu if account deleted
         elif user_choice == "7":
             break
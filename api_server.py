@@ -0,0 +1,298 @@
+import asyncio
+import json
+import traceback
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .models.cart import Cart
+from .models.user import User
+from .services import metrics
+from .services.cart_service import add_to_cart, update_cart_item, remove_from_cart, clear_cart, checkout_cart
+from .services.catalog import get_product
+from .services.inventory import start_reaper
+from .services.orders import user_orders
+from .services.rate_limit import sign_in_wait, record_sign_in
+from .services.session import Session, sessions
+from .services.startup import load_store, start_catalog_watcher, install_reload_signal
+from .services.search import search
+from .services.storage import configure_from_env
+from .services.user_service import authenticate
+from .utils.money import kobo_to_str
+
+HOST = '127.0.0.1'
+PORT = 8080
+# Requests with a larger body are rejected
+MAX_BODY_SIZE = 64 * 1024
+# Paths whose handlers wait on disk, on password hashing, on the index lock a
+# catalog reload or sync holds while it rebuilds (searches) or on the session
+# lock a checkout holds (sign-out). They run on worker threads so that the
+# event loop keeps serving, and concurrent checkouts can share a group commit.
+BLOCKING_PATHS = {'/checkout', '/signin', '/products/search', '/signout', '/orders'}
+# Cart routes take the session lock, which a checkout holds until its order is
+# durable, so they run on worker threads too.
+CART_PATH = '/cart'
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large', 429: 'Too Many Requests',
+           500: 'Internal Server Error'}
+
+
+def _product_json(product) -> Dict:
+    return {'id': product.id, 'name': product.name, 'price': kobo_to_str(product.price), 'stock': product.stock}
+
+
+def _cart_json(cart: Cart) -> Dict:
+    return {
+        'items': [{'product_id': item.product_id, 'name': item.name, 'quantity': item.quantity,
+                   'price': kobo_to_str(item.price)} for item in cart],
+        'total': kobo_to_str(cart.total)
+    }
+
+
+def _session(headers: Dict[str, str]) -> Session:
+    token = headers.get('authorization', '').removeprefix('Bearer ').strip()
+    session = sessions.get(token)
+    if session is None or session.user is None:
+        raise HTTPError(401, "Sign in first")
+    return session
+
+
+def _order_json(order: Dict) -> Dict:
+    return {
+        'transaction_id': order['transaction_id'], 'created_at': order['created_at'],
+        'total': kobo_to_str(order['total']),
+        'items': [{'product_id': item['product_id'], 'name': item['name'], 'quantity': item['quantity'],
+                   'price': kobo_to_str(item['price'])} for item in order['items']]
+    }
+
+
+def _page_params(query: Dict) -> Tuple[int, int]:
+    try:
+        page = int(query.get('page', ['1'])[0])
+        page_size = min(int(query.get('page_size', ['20'])[0]), 100)
+    except ValueError:
+        raise HTTPError(400, "'page' and 'page_size' must be integers")
+    if page < 1 or page_size < 1:
+        raise HTTPError(400, "'page' and 'page_size' must be at least 1")
+    return page, page_size
+
+
+def _int_field(body: Dict, key: str, default: int | None = None) -> int:
+    value = body.get(key, default)
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise HTTPError(400, f"'{key}' must be an integer")
+    return value
+
+
+def sign_in(body: Dict, client: str) -> Tuple[int, Dict]:
+    identity = str(body.get('identity', ''))
+    wait = sign_in_wait(identity, client or None)
+    if wait:
+        raise HTTPError(429, f"Too many sign-in attempts, retry in {int(wait) + 1} seconds")
+    user: User | None = authenticate(identity, str(body.get('password', '')))
+    record_sign_in(identity, user is not None)
+    if user is None:
+        raise HTTPError(401, "Invalid credentials")
+    session = sessions.create(user)
+    return 200, {'token': session.token, 'username': user.username, 'balance': kobo_to_str(user.balance)}
+
+
+def sign_out(session: Session) -> Tuple[int, Dict]:
+    sessions.remove(session.token)
+    return 200, {}
+
+
+def _cart_route(method: str, parts: List[str], body: Dict, session: Session) -> Tuple[int, Dict]:
+    cart: Cart = session.cart
+    if parts == ['cart']:
+        if method == 'GET':
+            return 200, _cart_json(cart)
+        if method == 'DELETE':
+            clear_cart(session)
+            return 200, _cart_json(cart)
+
+    if parts == ['cart', 'items'] and method == 'POST':
+        product = get_product(_int_field(body, 'product_id'))
+        if product is None:
+            raise HTTPError(404, "Product not found")
+        if not add_to_cart(session, product, _int_field(body, 'quantity', 1)):
+            raise HTTPError(409, "Not enough stock")
+        return 201, _cart_json(cart)
+
+    if len(parts) == 3 and parts[:2] == ['cart', 'items'] and parts[2].isdigit():
+        index = int(parts[2]) - 1
+        if method == 'PATCH':
+            if not update_cart_item(session, index, _int_field(body, 'quantity')):
+                raise HTTPError(409, "Could not update item")
+            return 200, _cart_json(cart)
+        if method == 'DELETE':
+            if not remove_from_cart(session, index):
+                raise HTTPError(404, "Invalid item number")
+            return 200, _cart_json(cart)
+
+    raise HTTPError(404, "Not found")
+
+
+def route(method: str, path: str, query: Dict, headers: Dict[str, str], body: Dict,
+          client: str = '') -> Tuple[int, Dict]:
+    """
+    Dispatch one API request.
+
+    Routes:
+        POST   /signin              {"identity", "password"} -> {"token", ...}
+        POST   /signout
+        GET    /products/search     ?q=...&page=1&page_size=20&all=1
+        GET    /cart
+        POST   /cart/items          {"product_id", "quantity"}
+        PATCH  /cart/items/<n>      {"quantity"}   (n is the 1-based line number)
+        DELETE /cart/items/<n>
+        DELETE /cart
+        POST   /checkout
+        GET    /orders              ?page=1&page_size=20   (newest first)
+
+    Every route except /signin and /products/search needs an
+    "Authorization: Bearer <token>" header. Sign-in attempts are rate
+    limited per identity and per `client` address (see services.rate_limit).
+    """
+    parts = [part for part in path.split('/') if part]
+
+    if parts == ['signin'] and method == 'POST':
+        return sign_in(body, client)
+
+    if parts == ['products', 'search'] and method == 'GET':
+        page, page_size = _page_params(query)
+        results, total = search(query.get('q', [''])[0], match_all=query.get('all', ['0'])[0] == '1',
+                                page=page, page_size=page_size)
+        return 200, {'total': total, 'page': page, 'results': [_product_json(p) for p in results]}
+
+    session = _session(headers)
+
+    if parts == ['signout'] and method == 'POST':
+        return sign_out(session)
+
+    if parts[:1] == ['cart']:
+        with session.lock:
+            return _cart_route(method, parts, body, session)
+
+    if parts == ['orders'] and method == 'GET':
+        page, page_size = _page_params(query)
+        orders, total = user_orders(session.user.user_id, page=page, page_size=page_size)
+        return 200, {'total': total, 'page': page, 'orders': [_order_json(order) for order in orders]}
+
+    if parts == ['checkout'] and method == 'POST':
+        user: User = session.user
+        try:
+            transaction_id = checkout_cart(session)
+        except ValueError as e:
+            raise HTTPError(409, str(e))
+        return 200, {'transaction_id': transaction_id, 'balance': kobo_to_str(user.balance)}
+
+    raise HTTPError(404, "Not found")
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes] | None:
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, _version = request_line.decode('latin-1').split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', '0') or 0)
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise HTTPError(400, "Content-Length must be a non-negative integer")
+    if length > MAX_BODY_SIZE:
+        raise HTTPError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), target, headers, body
+
+
+def _response(status: int, payload: Dict, keep_alive: bool) -> bytes:
+    body = json.dumps(payload).encode()
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode('latin-1') + body
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Serve HTTP/1.1 requests on one connection until the client closes it."""
+    peer = writer.get_extra_info('peername')
+    client: str = peer[0] if peer else ''
+    try:
+        while True:
+            keep_alive = False
+            try:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, raw_body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                try:
+                    body = json.loads(raw_body) if raw_body else {}
+                except ValueError:
+                    raise HTTPError(400, "Body must be JSON")
+                if not isinstance(body, dict):
+                    raise HTTPError(400, "Body must be a JSON object")
+                url = urlsplit(target)
+                path = url.path.rstrip('/')
+                if path in BLOCKING_PATHS or path == CART_PATH or path.startswith(CART_PATH + '/'):
+                    status, payload = await asyncio.to_thread(route, method, url.path, parse_qs(url.query),
+                                                              headers, body, client)
+                else:
+                    status, payload = route(method, url.path, parse_qs(url.query), headers, body, client)
+            except HTTPError as e:
+                status, payload = e.status, {'error': e.message}
+            except Exception:
+                # The details stay in the server's log; clients only learn that it failed
+                traceback.print_exc()
+                status, payload = 500, {'error': "Internal error"}
+            writer.write(_response(status, payload, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str = HOST, port: int = PORT) -> None:
+    server = await asyncio.start_server(handle_connection, host, port)
+    print(f"API listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    configure_from_env()
+    metrics.configure_from_env()
+    load_store()
+    start_reaper()
+    start_catalog_watcher()
+    install_reload_signal()
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,20 @@
-from ..utils.helpers import hash_password
-from ..models.user import users, current_user
+from ..utils.credentials import verify_password
+from ..services.session import Session
 
-def verify_current_password() -> bool:
+def verify_current_password(session: Session) -> bool:
+    """
+    Ask the signed-in user for their password, unless they entered it recently.
+
+    A correct password counts for the next session.VERIFIED_TTL seconds, so
+    several sensitive actions in a row only prompt (and hash) once.
+    """
+    if session.recently_verified():
+        return True
     password = input("Enter your password to verify: ").strip()
     if not password:
         print("Password cannot be empty")
         return False
-    return hash_password(password) == current_user['password_hash']
\ No newline at end of file
+    if not verify_password(password, session.user.password_hash):
+        return False
+    session.mark_verified()
+    return True
@@ -1,10 +1,12 @@
 import sys
 import time
-from typing import Dict
-
-from ..utils.helpers import generate_password, hash_password
-from ..utils.validators import validate_email, validate_password
-from ..services.user_service import save_users
+from ..models.user import User
+from ..utils.credentials import hash_password
+from ..utils.helpers import generate_password
+from ..utils.validators import validate_email, validate_password, validate_username_length, MAX_USERNAME_BYTES
+from ..services.rate_limit import sign_in_wait, record_sign_in
+from ..services.session import Session
+from ..services.user_service import save_user, authenticate, username_taken, email_taken, register_user
 
 
 def display_start_menu() -> None:
@@ -18,35 +20,39 @@ def display_start_menu() -> None:
     print("3. Exit\n")
 
 
-def sign_in_user() -> bool:
+def sign_in_user(session: Session) -> bool:
     """
     Function for signing in a user with validated credentials.
+    :param session: Session that the user gets signed in to
     Returns: bool: True if signin was successful, False otherwise
     """
     print("\n" + "=" * 8 + "Login to your Account" + "=" * 8 + "\n")
-    global current_user, users
 
     user_log_identity: str = input(f"Enter your Username / Email: ").strip()
     user_log_pass: str = input("Enter your password: ").strip()
 
-    for user in users:
-        if (user['username'] == user_log_identity or user['email'] == user_log_identity) \
-                and user['password'] == user_log_pass:
-            current_user = user
-            print("\nLogin successful! 😄")
-            return True
+    wait = sign_in_wait(user_log_identity)
+    if wait:
+        print(f"\nToo many sign-in attempts. Try again in {int(wait) + 1} seconds. ⏳")
+        return False
+    user = authenticate(user_log_identity, user_log_pass)
+    record_sign_in(user_log_identity, user is not None)
+    if user is not None:
+        session.user = user
+        print("\nLogin successful! 😄")
+        return True
 
     print("\nLogin failed! Invalid credentials. 😡")
     return False
 
 
-def sign_up_user() -> bool:
+def sign_up_user(session: Session) -> bool:
     """
     Function for signing up a new user with validated credentials.
+    :param session: Session that the new user gets signed in to
     Returns: bool: True if signup was successful, False otherwise
     """
     print("\n" + "=" * 8 + "Create an Account" + "=" * 8 + "\n")
-    global current_user, users
 
     # Username handling
     while True:
@@ -60,10 +66,12 @@ def sign_up_user() -> bool:
         if not user_reg_username.isalnum():
             print("Username must contain only letters and numbers")
             continue
-        for user in users:
-            if user['username'] == user_reg_username:
-                print("Username already exist! ❌")
-                continue
+        if not validate_username_length(user_reg_username):
+            print(f"Username must be at most {MAX_USERNAME_BYTES} characters")
+            continue
+        if username_taken(user_reg_username):
+            print("Username already exist! ❌")
+            continue
         break
 
     # Email handling
@@ -77,15 +85,10 @@ def sign_up_user() -> bool:
             print("Email is not correct! 😒")
             continue
 
-        email_exists = False
-        for user in users:
-            if user['email'] == user_reg_email:
-                print("Email already exist! ❌")
-                email_exists = True
-                break
-
-        if not email_exists:
-            break
+        if email_taken(user_reg_email):
+            print("Email already exist! ❌")
+            continue
+        break
 
     # Password handling
 
@@ -113,30 +116,28 @@ def sign_up_user() -> bool:
         else:
             print("Invalid entry. Try again!")
             continue
-    new_user: Dict = {
-        'username': user_reg_username,
-        'email': user_reg_email,
-        'password_hash': hash_password(user_reg_password),
-        'balance': 0
-    }
-
-    users.append(new_user)
-    save_users()
-    current_user = new_user
+    new_user: User = User(user_reg_username, user_reg_email, hash_password(user_reg_password))
+
+    if not register_user(new_user):
+        print("Username or email was taken while signing up. Please try again ❌")
+        return False
+    save_user(new_user)
+    session.user = new_user
     print(f"Account created successfully for {user_reg_username}! ✅")
     return True
 
 
-def handle_user_choice(choice: str) -> bool:
+def handle_user_choice(choice: str, session: Session) -> bool:
     """
     Process user menu selection
     :param choice:str
+    :param session: Session of the user at the prompt
     :return: bool
     """
     if choice == '1':
-        return sign_in_user()
+        return sign_in_user(session)
     elif choice == '2':
-        return sign_up_user()
+        return sign_up_user(session)
     elif choice in ('3', 'exit', 'quit'):
         print("Thank you for using the app!\nShutting down...")
         time.sleep(1)
@@ -0,0 +1,49 @@
+from typing import Dict
+
+
+class SlottedModel:
+    """
+    Base class for the __slots__ models.
+
+    Besides normal attribute access it supports the dict-style access the
+    services and views used when records were plain dictionaries
+    (model['name'], model['stock'] -= 1, model.get('email')).
+    Subclasses may add '__weakref__' to their slots; it is not a field.
+    """
+
+    __slots__ = ()
+    _fields: tuple = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = tuple(name for name in cls.__slots__ if name != '__weakref__')
+
+    def __getitem__(self, key: str):
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value) -> None:
+        if key not in self._fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._fields
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f"{key}={getattr(self, key)!r}" for key in self._fields)
+        return f"{type(self).__name__}({fields})"
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in self._fields else default
+
+    def keys(self):
+        return self._fields
+
+    def to_dict(self) -> Dict:
+        return {key: getattr(self, key) for key in self._fields}
+
+    @classmethod
+    def from_dict(cls, data: Dict):
+        return cls(**{key: data[key] for key in cls._fields if key in data})
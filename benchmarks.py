@@ -0,0 +1,343 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+from typing import Callable, Dict, List
+
+from .models.cart import CartItem
+from .models.product import Product
+from .models.user import User
+from .services import catalog, inventory, user_service
+from .services.cart_service import add_to_cart, clear_cart, checkout_cart
+from .services.checkout_service import recover_orders
+from .services.orders import order_log
+from .services.product_service import load_products
+from .services.search import search
+from .services.session import Session
+from .services.warehouse_state import stock_ledger, CATALOG_SNAPSHOT_PATH, WAREHOUSE_STATE_PATH
+from .utils.credentials import hash_password
+from .utils.money import kobo_to_str
+
+# Named sizes of the synthetic data sets used by the service layer suite
+SCALES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+# Number of warehouse files the generated products are spread over
+WAREHOUSE_FILES = 4
+# Operations timed by the per-request benchmarks (search, cart, checkout)
+SEARCH_QUERIES = 100
+CART_ROUNDS = 1_000
+CHECKOUTS = 200
+# Threads the concurrent checkout benchmark submits from, so checkouts share group commits
+CHECKOUT_THREADS = 16
+# Slowdown against the baseline, as a fraction, beyond which a benchmark counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+ADJECTIVES = ('red', 'blue', 'green', 'black', 'white', 'large', 'small', 'classic', 'slim', 'wooden',
+              'leather', 'cotton', 'steel', 'vintage', 'organic', 'wireless', 'smart', 'travel', 'kids', 'premium')
+NOUNS = ('shirt', 'shoe', 'hat', 'bag', 'watch', 'lamp', 'chair', 'table', 'phone', 'cable',
+         'jacket', 'bottle', 'kettle', 'speaker', 'wallet', 'belt', 'scarf', 'pillow', 'mug', 'backpack')
+
+
+def _measure_memory(factory, count: int) -> float:
+    """Return the average number of bytes allocated per object built by `factory`."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [factory(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return (after - before) / count
+
+
+def bench_models(count: int = 100_000) -> None:
+    """
+    Compare the slotted models against the plain dicts they replaced.
+
+    Reports memory per object and the time to total a cart of `count` lines,
+    the hot loop in view_cart and checkout.
+    """
+    print(f"\n{'===' * 8} Models ({count:,} objects) {'===' * 8}")
+
+    dict_user = _measure_memory(lambda i: {'username': f"user{i}", 'email': f"user{i}@example.com",
+                                           'password_hash': 'x' * 64, 'balance': 0}, count)
+    slotted_user = _measure_memory(lambda i: User(f"user{i}", f"user{i}@example.com", 'x' * 64, 0), count)
+    print(f"User:     dict {dict_user:,.0f} B   slotted {slotted_user:,.0f} B")
+
+    dict_item = _measure_memory(lambda i: {'product_id': i, 'quantity': 1, 'name': 'Item', 'price': 999}, count)
+    slotted_item = _measure_memory(lambda i: CartItem(i, 1, 'Item', 999), count)
+    print(f"CartItem: dict {dict_item:,.0f} B   slotted {slotted_item:,.0f} B")
+
+    dict_cart = [{'product_id': i, 'quantity': 2, 'name': 'Item', 'price': 999} for i in range(count)]
+    slotted_cart = [CartItem(i, 2, 'Item', 999) for i in range(count)]
+    dict_time = min(timeit.repeat(lambda: sum(item['price'] * item['quantity'] for item in dict_cart),
+                                  number=10, repeat=3))
+    slotted_time = min(timeit.repeat(lambda: sum(item.price * item.quantity for item in slotted_cart),
+                                     number=10, repeat=3))
+    print(f"Cart total: dict {dict_time / 10 * 1000:,.2f} ms   slotted {slotted_time / 10 * 1000:,.2f} ms")
+
+
+def _hammer(reserve, threads: int, attempts: int, product_ids) -> int:
+    """Run `reserve(thread_number, product_id, quantity)` from many threads; return the units reserved."""
+    reserved = [0] * threads
+    start = threading.Barrier(threads)
+
+    def shopper(number: int) -> None:
+        rng = random.Random(number)
+        start.wait()
+        for _ in range(attempts):
+            quantity = rng.randint(1, 3)
+            if reserve(number, rng.choice(product_ids), quantity):
+                reserved[number] += quantity
+
+    workers = [threading.Thread(target=shopper, args=(n,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(reserved)
+
+
+def bench_inventory(threads: int = 32, attempts: int = 5_000, skus: int = 8, stock: int = 10_000) -> None:
+    """
+    Stress reservations from many threads against a small, contended catalog.
+
+    Every thread reserves random quantities until stock runs out. Oversold
+    units are those reserved beyond the stock there was; the striped-lock
+    inventory must always report zero. The same load through the bare,
+    unsynchronized catalog.reserve_stock is shown for comparison (the GIL
+    switch interval is shortened so that races show up at all).
+    """
+    print(f"\n{'===' * 8} Inventory ({threads} threads, {skus} SKUs x {stock:,} units) {'===' * 8}")
+    product_ids = list(range(1, skus + 1))
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        catalog.build_catalog(Product(i, f"Item {i}", 100, stock) for i in product_ids)
+        began = time.perf_counter()
+        reserved = _hammer(lambda n, pid, q: catalog.reserve_stock(pid, q), threads, attempts, product_ids)
+        elapsed = time.perf_counter() - began
+        remaining = sum(catalog.get_product(i).stock for i in product_ids)
+        oversold = reserved + remaining - skus * stock
+        print(f"Unlocked:  {reserved:,} units reserved in {elapsed:.2f}s, oversold {oversold:,}")
+
+        catalog.build_catalog(Product(i, f"Item {i}", 100, stock) for i in product_ids)
+        began = time.perf_counter()
+        reserved = _hammer(lambda n, pid, q: inventory.reserve(f"bench-{n}", pid, q), threads, attempts, product_ids)
+        elapsed = time.perf_counter() - began
+        remaining = sum(catalog.get_product(i).stock for i in product_ids)
+        oversold = reserved + remaining - skus * stock
+        print(f"Inventory: {reserved:,} units reserved in {elapsed:.2f}s, oversold {oversold:,}")
+        assert oversold == 0 and remaining >= 0, "inventory oversold"
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    released = inventory.expire_reservations(time.monotonic() + inventory.RESERVATION_TTL + 1)
+    restored = sum(catalog.get_product(i).stock for i in product_ids)
+    print(f"Expiry:    {released:,} units returned to stock, {restored:,} of {skus * stock:,} on sale")
+    assert restored == skus * stock, "expired reservations were not released"
+
+
+def generate_users(count: int, path: str = user_service.ACCOUNTS_PATH, seed: int = 0) -> None:
+    """
+    Write `count` synthetic accounts to `path` in the data/accounts.txt format.
+
+    Every account gets the same real password hash (of "benchmark"), as
+    hashing a password per account would take hours at the larger scales.
+    """
+    rng = random.Random(seed)
+    password_hash = hash_password('benchmark')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        f.writelines(f"user{i},user{i}@example.com,{password_hash},"
+                     f"{kobo_to_str(rng.randint(10 ** 11, 10 ** 12))},{i + 1}\n" for i in range(count))
+
+
+def generate_warehouses(count: int, directory: str = 'data', files: int = WAREHOUSE_FILES, seed: int = 0) -> None:
+    """
+    Write `count` synthetic products spread over `files` warehouse files in `directory`.
+
+    Names combine two adjectives and a noun plus a number, so searches match
+    realistic numbers of products at every scale.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    per_file = -(-count // files)
+    for number in range(files):
+        first, last = number * per_file, min((number + 1) * per_file, count)
+        with open(os.path.join(directory, f"warehouse{number + 1}.txt"), 'w') as f:
+            f.write(';'.join(f"{rng.choice(ADJECTIVES).title()} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}:"
+                             f"{kobo_to_str(rng.randint(100, 10_000_000))}" for i in range(first, last)))
+
+
+def _time(operation: Callable[[], None], repeat: int, setup: Callable[[], None] | None = None) -> float:
+    """Return the fastest of `repeat` runs of `operation`, in seconds, running `setup` untimed before each."""
+    best = float('inf')
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            began = time.perf_counter()
+            operation()
+            best = min(best, time.perf_counter() - began)
+    return best
+
+
+def _close_files() -> None:
+    """Close the journals and logs the services keep open, so the data directory can change."""
+    user_service.accounts_journal.close()
+    stock_ledger.journal.close()
+    order_log.close()
+
+
+def _remove(*paths: str) -> None:
+    for path in paths:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def bench_service(scale: str, repeat: int = 3, seed: int = 0) -> Dict[str, Dict]:
+    """
+    Time the service layer against synthetic data of one of the SCALES.
+
+    Runs in a temporary directory with the text file storage, so no real
+    data is touched. Each benchmark reports the fastest of `repeat` runs.
+    load_products is timed both from the text files alone (cold) and with
+    the catalog snapshot of the previous load (warm), and checkouts both one
+    at a time and from CHECKOUT_THREADS threads (which share group commits).
+
+    :return: Benchmark name -> {'scale', 'ops', 'seconds', 'us_per_op'}
+    """
+    count = SCALES[scale]
+    print(f"\n{'===' * 8} Service layer ({scale}: {count:,} users and products) {'===' * 8}")
+    rng = random.Random(seed)
+    results: Dict[str, Dict] = {}
+
+    def record(name: str, ops: int, seconds: float) -> None:
+        results[f"{name}[{scale}]"] = {'scale': count, 'ops': ops, 'seconds': seconds,
+                                       'us_per_op': seconds / ops * 1e6}
+        print(f"{name:<24} {seconds * 1000:>12,.2f} ms {seconds / ops * 1e6:>12,.2f} us/op")
+
+    previous_directory = os.getcwd()
+    _close_files()
+    with tempfile.TemporaryDirectory(prefix='ecommerce-bench-') as directory:
+        os.chdir(directory)
+        try:
+            generate_users(count, seed=seed)
+            generate_warehouses(count, seed=seed)
+
+            record('load_users', count, _time(user_service.load_users, repeat))
+            record('save_users', count, _time(user_service.save_users, repeat))
+            recover_orders()
+            record('load_products', count, _time(
+                load_products, repeat, setup=lambda: _remove(CATALOG_SNAPSHOT_PATH, WAREHOUSE_STATE_PATH)))
+            record('load_products_warm', count, _time(load_products, repeat))
+
+            queries = [' '.join(rng.sample(ADJECTIVES + NOUNS, rng.randint(1, 2))) for _ in range(SEARCH_QUERIES)]
+            queries = [query[:-2] if rng.random() < 0.3 else query for query in queries]
+            record('search', len(queries), _time(lambda: [search(query) for query in queries], repeat))
+
+            product_ids = [product.id for product in catalog.all_products()]
+            session = Session('bench-cart', user_service.users[0])
+            picks = [rng.sample(product_ids, 5) for _ in range(CART_ROUNDS)]
+
+            def fill_and_clear() -> None:
+                for round_ids in picks:
+                    for product_id in round_ids:
+                        add_to_cart(session, catalog.get_product(product_id))
+                    clear_cart(session)
+
+            record('add_to_cart/clear_cart', CART_ROUNDS * 6, _time(fill_and_clear, repeat))
+
+            buyers = [Session(f"bench-buyer-{i}", user)
+                      for i, user in enumerate(user_service.users[:min(CHECKOUTS, count)])]
+            purchases = [(buyers[i % len(buyers)], rng.choice(product_ids)) for i in range(CHECKOUTS)]
+
+            def checkout_all(batch: List) -> None:
+                for buyer, product_id in batch:
+                    if add_to_cart(buyer, catalog.get_product(product_id)):
+                        checkout_cart(buyer)
+
+            def checkout_concurrently() -> None:
+                threads = [threading.Thread(target=checkout_all, args=(purchases[offset::CHECKOUT_THREADS],))
+                           for offset in range(CHECKOUT_THREADS)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            record('checkout', CHECKOUTS, _time(lambda: checkout_all(purchases), repeat))
+            record('checkout_concurrent', CHECKOUTS, _time(checkout_concurrently, repeat))
+        finally:
+            _close_files()
+            os.chdir(previous_directory)
+    return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """
+    Compare results with a baseline saved earlier.
+
+    Benchmarks missing from either side are skipped.
+
+    :return: Names of the benchmarks more than `tolerance` (a fraction) slower per operation than the baseline
+    """
+    print(f"\n{'===' * 8} Against baseline (tolerance {tolerance:.0%}) {'===' * 8}")
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        change = result['us_per_op'] / baseline[name]['us_per_op'] - 1
+        regressed = change > tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<32} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the models, the inventory and the service layer.")
+    parser.add_argument('--service', action='store_true',
+                        help="run the service layer suite instead of the model and inventory benchmarks")
+    parser.add_argument('--scale', action='append', choices=SCALES,
+                        help="data set size for the service layer suite; may be repeated (default: 1k)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per benchmark; the fastest counts (default: 3)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic data (default: 0)")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', help="compare with results written earlier by --output and "
+                                           "exit with status 1 on a regression")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f"slowdown tolerated before a benchmark regresses, as a fraction "
+                             f"(default: {DEFAULT_TOLERANCE})")
+    args = parser.parse_args(argv)
+
+    if not args.service:
+        bench_models()
+        bench_inventory()
+        return 0
+
+    results: Dict[str, Dict] = {}
+    for scale in args.scale or ['1k']:
+        results.update(bench_service(scale, args.repeat, args.seed))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                       'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                       'repeat': args.repeat, 'seed': args.seed, 'results': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,88 @@
-cart = []
+from typing import Dict, Iterator
+
+from .base import SlottedModel
+from ..utils.money import sum_line_totals
+
+
+class CartItem(SlottedModel):
+    """A cart line; `price` is the unit price in kobo."""
+
+    __slots__ = ('product_id', 'quantity', 'name', 'price')
 
-class CartItem:
     def __init__(self, product_id, quantity, name, price):
         self.product_id = product_id
         self.quantity = quantity
         self.name = name
-        self.price = price
\ No newline at end of file
+        self.price = price
+
+
+class Cart:
+    """
+    Shopping cart lines with a running subtotal.
+
+    The subtotal is kept in kobo and adjusted on every change, so reading the
+    total never walks the lines. Lines must therefore only be changed through
+    the methods below, not by assigning to CartItem.quantity directly.
+    Supports len(), iteration, indexing and truthiness like the list it replaces.
+    """
+
+    __slots__ = ('_items', '_by_product', 'total')
+
+    def __init__(self):
+        self._items: list = []
+        self._by_product: Dict[int, CartItem] = {}
+        # Cart total in kobo
+        self.total: int = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[CartItem]:
+        return iter(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __bool__(self) -> bool:
+        return bool(self._items)
+
+    def find(self, product_id: int) -> CartItem | None:
+        return self._by_product.get(product_id)
+
+    def add(self, product_id: int, name: str, price: int, quantity: int = 1) -> CartItem:
+        """Add `quantity` units of a product (unit `price` in kobo), merging with its existing line if any."""
+        item = self._by_product.get(product_id)
+        if item is None:
+            item = CartItem(product_id, quantity, name, price)
+            self._items.append(item)
+            self._by_product[product_id] = item
+        else:
+            item.quantity += quantity
+        self.total += price * quantity
+        return item
+
+    def set_quantity(self, index: int, quantity: int) -> CartItem:
+        """Set the quantity of the line at `index`."""
+        item = self._items[index]
+        self.total += item.price * (quantity - item.quantity)
+        item.quantity = quantity
+        return item
+
+    def remove(self, index: int) -> CartItem:
+        """Remove and return the line at `index`."""
+        item = self._items.pop(index)
+        del self._by_product[item.product_id]
+        self.total -= item.price * item.quantity
+        return item
+
+    def clear(self) -> None:
+        self._items.clear()
+        self._by_product.clear()
+        self.total = 0
+
+    def recompute_total(self) -> int:
+        """Recompute the total from the lines, e.g. to double-check it before charging."""
+        self.total = sum_line_totals([item.price for item in self._items],
+                                     [item.quantity for item in self._items])
+        return self.total
+
@@ -1,68 +1,68 @@
-from typing import Dict
+from ..models.product import Product
+from ..services import metrics
+from ..services.catalog import get_product
+from ..services.checkout_service import checkout_engine
+from ..services.session import Session
+from ..utils.money import format_kobo
 
-def add_to_cart(product):
+# Number of cart lines view_cart shows per page when paginating
+CART_PAGE_SIZE = 20
+
+_out_of_stock = metrics.counter('ecommerce_cart_out_of_stock_total', "Cart additions refused for lack of stock")
+_failed_checkouts = metrics.counter('ecommerce_failed_checkouts_total', "Checkouts refused, e.g. for insufficient funds")
+
+
+@metrics.timed('ecommerce_add_to_cart_seconds', "Time to reserve stock and add it to a cart")
+def add_to_cart(session: Session, product, quantity: int = 1) -> bool:
     """
     Add a product to the shopping cart and update inventory.
 
-    If the product already exists in the cart, increments its quantity by 1.
-    If it's a new product, adds it to the cart with quantity 1.
+    If the product already exists in the cart, increments its quantity.
+    If it's a new product, adds it to the cart with the given quantity.
     Updates the product's stock count in the inventory.
 
     Args:
-        product (Dict): Product dictionary containing at minimum:
-                       - 'id': Unique product identifier
-                       - 'name': Product name for display
-                       - 'price': Product price
+        session (Session): Session whose cart gets the product
+        product (Product): Product (or catalog ProductRow) with at minimum:
+                       - id: Unique product identifier
+                       - name: Product name for display
+                       - price: Product price in kobo
+        quantity (int): Number of units to add (default 1)
 
     Returns:
-        None: Function performs side effects on global cart and products lists
-
-    Global Variables:
-        cart (list): Global shopping cart list that gets modified
-        products (list): Global products inventory list that gets modified
+        bool: True if the product was added, False if it is unknown or out of stock
 
     Note:
         - Assumes product stock validation is handled by calling function
-        - Modifies global state (cart and products lists)
+        - Modifies the session's cart and reserves catalog stock for it
         - Prints confirmation message to console
     """
-    global cart, products
-
-    product_in_inventory: Dict | None = None
-    for p in products:
-        if p['id'] == product['id']:
-            product_in_inventory = p
-            break
-
-    if not product_in_inventory:
-        print(f"❌ Product '{product['name']}' not found in inventory")
-        return
-
-    if product_in_inventory['stock'] <= 0:
-        print(f"❌ '{product['name']}' is out of stock")
-        return
-
-    # Find existing cart item and update quantity or add as a new item
-    for item in cart:
-        if item['product_id'] == product['id']:
-            item['quantity'] += 1
-            break
-    else:
-        cart.append({
-            'product_id': product['id'],
-            'quantity': 1,
-            'name': product['name'],
-            'price': product['price']
-        })
-
-    # Update inventory (we already found the product above through the validation, this is why we did the validation again)
-    product_in_inventory['stock'] -= 1
-
-    print(f"✅ Added {product['name']} to cart")
-    print(f"📦 Remaining stock: {product_in_inventory['stock']}")
-
-
-def update_cart_item(item_id: int, quantity: int) -> bool:
+    with session.lock:
+        product_in_inventory: Product | None = get_product(product.id)
+
+        if not product_in_inventory:
+            print(f"❌ Product '{product.name}' not found in inventory")
+            return False
+
+        if quantity <= 0:
+            print("Quantity must be positive")
+            return False
+
+        if not session.reserve(product.id, quantity):
+            _out_of_stock.inc()
+            print(f"❌ '{product.name}' is out of stock")
+            return False
+
+        # Update the existing cart item's quantity or add it as a new item
+        session.cart.add(product.id, product.name, product.price, quantity)
+
+        print(f"✅ Added {product.name} to cart")
+        print(f"📦 Remaining stock: {product_in_inventory.stock}")
+        return True
+
+
+@metrics.timed('ecommerce_update_cart_item_seconds', "Time to change the quantity of a cart line")
+def update_cart_item(session: Session, item_id: int, quantity: int) -> bool:
     """
       Update the quantity of an item in the shopping cart.
 
@@ -70,128 +70,117 @@ def update_cart_item(item_id: int, quantity: int) -> bool:
       Handles stock validation to ensure sufficient inventory is available.
 
       Args:
+    	  session (Session): Session whose cart gets updated
     	  item_id (int): Index of the item in the cart (0-based)
     	  quantity (int): New quantity to set for the item
 
       Returns:
     	  bool: True if update was successful, False otherwise
 
-      Global Variables:
-    	  cart (list): Global shopping cart list that gets modified
-    	  products (list): Global products inventory list that gets modified
-
       Note:
     	  - Validates item_id bounds and quantity positivity
     	  - Adjusts product stock based on quantity difference
     	  - Prints appropriate error messages for validation failures
       """
-    global cart, products
-
-    if item_id < 0 or item_id >= len(cart):
-        print("❌ Invalid item number")
-        return False
-
-    if quantity <= 0:
-        print("Quantity must be positive")
-        return False
+    with session.lock:
+        cart = session.cart
+        if item_id < 0 or item_id >= len(cart):
+            print("❌ Invalid item number")
+            return False
 
-    product_id = cart[item_id]['product_id']
-    current_quantity = cart[item_id]['quantity']
+        if quantity <= 0:
+            print("Quantity must be positive")
+            return False
 
-    product: Dict | None = None
-    for p in products:
-        if p['id'] == product_id:
-            product = p
-            break
+        product_id = cart[item_id].product_id
+        current_quantity = cart[item_id].quantity
 
-    if not product:
-        print("Product not found in inventory")
-        return False
+        product: Product | None = get_product(product_id)
 
-    # Calculate the difference in quantity
-    # This is very important as it keeps the products stock value uptodate or correct.
-    # That is to say; we updated the product stock when we added to cart.
-    quantity_diff = quantity - current_quantity
+        if not product:
+            print("Product not found in inventory")
+            return False
 
-    # Check if we have enough stock for the increase
-    if quantity_diff > 0 and product['stock'] < quantity_diff:
-        print(f"Only {product['stock']} additional items available in inventory")
-        return False
+        # Calculate the difference in quantity
+        # This is very important as it keeps the products stock value uptodate or correct.
+        # That is to say; we updated the product stock when we added to cart.
+        quantity_diff = quantity - current_quantity
 
-    # Update cart quantity
-    cart[item_id]['quantity'] = quantity
+        # Check if we have enough stock for the increase
+        if quantity_diff > 0 and not session.reserve(product_id, quantity_diff):
+            _out_of_stock.inc()
+            print(f"Only {product.stock} additional items available in inventory")
+            return False
+        if quantity_diff < 0:
+            session.release(product_id, -quantity_diff)
 
-    # Update inventory stock (subtract the difference)
-    product['stock'] -= quantity_diff
+        # Update cart quantity (and with it the cart subtotal)
+        cart.set_quantity(item_id, quantity)
 
-    print(f"✅ Updated {cart[item_id]['name']} quantity to {quantity}")
-    print(f"📦 Remaining stock: {product['stock']}")
+        print(f"✅ Updated {cart[item_id].name} quantity to {quantity}")
+        print(f"📦 Remaining stock: {product.stock}")
 
-    return True
+        return True
 
 
-def remove_from_cart(item_index: int) -> bool:
+@metrics.timed('ecommerce_remove_from_cart_seconds', "Time to remove a cart line")
+def remove_from_cart(session: Session, item_index: int) -> bool:
     """
     Remove an item from the shopping cart and restore its quantity to product stock.
 
+    :param session: Session whose cart gets updated
     :param item_index: Index of the item to remove from the cart (0-based)
     :return: True if item was successfully removed, False if invalid index
     """
-    global cart, products
+    with session.lock:
+        cart = session.cart
+        if item_index < 0 or item_index >= len(cart):
+            print("❌ Invalid item number")
+            return False
 
-    if item_index < 0 or item_index >= len(cart):
-        print("❌ Invalid item number")
-        return False
+        item = cart.remove(item_index)
+        session.release(item.product_id, item.quantity)
+        return True
 
-    product_id: int = cart[item_index]['product_id']
 
-    for p in products:
-        if p['id'] == product_id:
-            p['stock'] += cart[item_index]['quantity']
-            break
-
-    del cart[item_index]
-    return True
-
-
-def clear_cart() -> None:
+@metrics.timed('ecommerce_clear_cart_seconds', "Time to empty a cart and release its stock")
+def clear_cart(session: Session) -> None:
     """
     Clear all items from the cart and restore their quantities to product stock.
 
     Prints a confirmation message when completed.
-    """
-    global cart, products
 
-    if not cart:
-        print("Cart is already empty 🛒")
-        return
-
-    for item in cart:
-        for p in products:
-            if p['id'] == item['product_id']:
-                p['stock'] += item['quantity']
-                break
+    :param session: Session whose cart gets cleared
+    """
+    with session.lock:
+        if not session.cart:
+            print("Cart is already empty 🛒")
+            return
 
-    cart.clear()
-    print("Cart cleared successfully! 🛒")
+        session.release_all()
+        session.cart.clear()
+        print("Cart cleared successfully! 🛒")
 
 
-def view_cart() -> float:
+def view_cart(session: Session, page: int | None = None, page_size: int = CART_PAGE_SIZE) -> int:
     """
-    Display the contents of the shopping cart and calculate total cost.
+    Display the contents of the shopping cart and return its total cost.
 
-    Shows each cart item with quantity, individual cost, and running total.
+    Shows each cart item with quantity and individual cost, followed by the total.
+    The total is the cart's running subtotal, so it is not recomputed here.
     Handles empty cart case gracefully with appropriate message.
 
+    :param session: Session whose cart gets displayed
+    :param page: 1-based page of lines to show, or None to show every line
+    :param page_size: Number of lines per page
     :returns:
-        float: Total cost of all items in the cart (0.0 if cart is empty)
+        int: Total cost of all items in the cart in kobo (0 if cart is empty)
 
-    Global Variables:
-        cart (List[Dict]): Global shopping cart list containing items with:
-                          - 'name': Product name
-                          - 'quantity': Number of items
-                          - 'price': Price per unit
-                          - 'product_id': Unique product identifier
+    Cart items have:
+        - name: Product name
+        - quantity: Number of items
+        - price: Price per unit in kobo
+        - product_id: Unique product identifier
 
     Display Format:
         - Empty cart: Shows empty cart message with emoji
@@ -200,23 +189,53 @@ def view_cart() -> float:
 
     Note:
         - Uses Nigerian Naira (NGN) currency formatting
-        - Handles floating-point arithmetic for price calculations
-        - Returns 0.0 for empty cart to enable chaining with other functions
+        - Returns 0 for empty cart to enable chaining with other functions
     """
-    if not cart:
-        print("\nYour cart is empty 🛒")
-        return 0.0
+    with session.lock:
+        cart = session.cart
+        if not cart:
+            print("\nYour cart is empty 🛒")
+            return 0
+
+        first: int = 0
+        last: int = len(cart)
+        if page is not None:
+            first = min(max(page - 1, 0) * page_size, (len(cart) - 1) // page_size * page_size)
+            last = min(first + page_size, len(cart))
 
-    cart_total: float = 0.0
-    print(f"\n{'===' * 8} Your Cart {'===' * 8}")
+        print(f"\n{'===' * 8} Your Cart {'===' * 8}")
 
-    for i, item in enumerate(cart, 1):
-        product_cost: float = item['price'] * item['quantity']
-        cart_total += product_cost
-        print(f"{i}. {item['name']} x{item['quantity']} - NGN {product_cost:,.2f}")
+        for i in range(first, last):
+            item = cart[i]
+            product_cost: int = item.price * item.quantity
+            print(f"{i + 1}. {item.name} x{item.quantity} - NGN {format_kobo(product_cost)}")
 
-    print(f"{'=' * 32}")
-    print(f"Cart Total: NGN {cart_total:,.2f}")
-    print(f"{'=' * 32}")
+        if page is not None and len(cart) > page_size:
+            print(f"(Showing items {first + 1}-{last} of {len(cart)})")
+        print(f"{'=' * 32}")
+        print(f"Cart Total: NGN {format_kobo(cart.total)}")
+        print(f"{'=' * 32}")
 
-    return cart_total
+        return cart.total
+
+
+@metrics.timed('ecommerce_checkout_seconds', "Time for a checkout to become durable")
+def checkout_cart(session: Session) -> str:
+    """
+    Pay for everything in the session's cart from the user's wallet.
+
+    Deducts the cart total from the user's balance, takes the stock and
+    records the order as one durable transaction (see
+    services.checkout_service), then empties the cart. Lines whose
+    reservation expired are taken from stock again.
+
+    :param session: Session of the paying user
+    :return: The transaction id
+    :raises ValueError: If no user is signed in, the cart is empty, the balance
+                        is insufficient or an expired line is no longer in stock
+    """
+    try:
+        return checkout_engine.submit(session)
+    except ValueError:
+        _failed_checkouts.inc()
+        raise
@@ -0,0 +1,359 @@
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, List
+
+from ..models.product import products, Product
+
+# id -> Product. The objects are shared with the `products` list, so a
+# stock change made through either view is visible in both.
+products_by_id: Dict[int, Product] = {}
+
+# A ColumnarCatalog maps ids to rows with a table indexed by id while the
+# largest id is at most this many times the number of rows (plus
+# SPARSE_ID_SLACK), and with a dict beyond that
+SPARSE_ID_RATIO = 2
+SPARSE_ID_SLACK = 1024
+
+# When enabled, build_catalog keeps products in a ColumnarCatalog instead of
+# one Product object each, and the `products` list stays empty.
+columnar: bool = False
+
+
+class ColumnarCatalog:
+    """
+    Products stored column by column in typed arrays.
+
+    Names are interned, and ids, prices (in kobo) and stock are 64-bit
+    integers, which takes a fraction of the memory of one object per product.
+    Rows are handed out as ProductRow views, created on access.
+
+    Removing a product only unmaps its id; the row stays in the arrays, so
+    the positions of the other rows never change.
+    """
+
+    __slots__ = ('ids', 'names', 'prices', 'stock', '_positions', 'removed')
+
+    def __init__(self):
+        self.ids = array('q')
+        self.names: list = []
+        self.prices = array('q')
+        self.stock = array('q')
+        # id -> row position. Left as None while ids are 1, 2, 3, ... so that
+        # position is simply id - 1 and no per-product index is needed. After
+        # that an array indexed by id (-1 for ids not stored) while ids are
+        # dense, as the registry keeps them, or a dict if they are not.
+        self._positions: array | Dict[int, int] | None = None
+        # Number of rows whose product was removed
+        self.removed = 0
+
+    def append(self, product) -> None:
+        # The row only becomes visible to position() once every column holds
+        # it, so products can be looked up while others are being appended
+        position = len(self.ids)
+        product_id = product.id
+        self.names.append(sys.intern(product.name))
+        self.prices.append(product.price)
+        self.stock.append(product.stock)
+        if self._positions is None and product_id != position + 1:
+            self._positions = array('q', range(-1, position))
+        self.ids.append(product_id)
+        if self._positions is not None:
+            self._map(product_id, position)
+
+    def _map(self, product_id: int, position: int) -> None:
+        positions = self._positions
+        if isinstance(positions, dict):
+            positions[product_id] = position
+        elif 0 < product_id < len(positions):
+            positions[product_id] = position
+        elif 0 < product_id <= SPARSE_ID_RATIO * len(self.ids) + SPARSE_ID_SLACK:
+            positions.extend(array('q', [-1]) * (product_id + 1 - len(positions)))
+            positions[product_id] = position
+        else:
+            table = {product_id_: position_ for product_id_, position_ in enumerate(positions) if position_ >= 0}
+            table[product_id] = position
+            self._positions = table
+
+    def remove(self, product_id: int) -> bool:
+        """Remove a product; return False if it is not stored."""
+        if self.position(product_id) < 0:
+            return False
+        if self._positions is None:
+            self._positions = array('q', range(-1, len(self.ids)))
+        if isinstance(self._positions, dict):
+            del self._positions[product_id]
+        else:
+            self._positions[product_id] = -1
+        self.removed += 1
+        return True
+
+    def live_positions(self) -> Iterable[int]:
+        """Return the positions of the rows not removed, in increasing order."""
+        if not self.removed:
+            return range(len(self.ids))
+        position = self.position
+        return [i for i, product_id in enumerate(self.ids) if position(product_id) == i]
+
+    def position(self, product_id: int) -> int:
+        """Return the row position of a product id, or -1 if it is not stored."""
+        positions = self._positions
+        if positions is None:
+            return product_id - 1 if 0 < product_id <= len(self.ids) else -1
+        if isinstance(positions, dict):
+            return positions.get(product_id, -1)
+        return positions[product_id] if 0 < product_id < len(positions) else -1
+
+    def get(self, product_id: int) -> 'ProductRow | None':
+        position = self.position(product_id)
+        return ProductRow(self, position) if position >= 0 else None
+
+    def __len__(self) -> int:
+        return len(self.ids) - self.removed
+
+    def __iter__(self) -> Iterator['ProductRow']:
+        for position in self.live_positions():
+            yield ProductRow(self, position)
+
+
+class ProductRow:
+    """
+    View of one product in a ColumnarCatalog.
+
+    Supports the same attribute and dict-style access as models.product.Product,
+    including assignment to 'price' and 'stock'.
+    """
+
+    __slots__ = ('_store', '_position')
+
+    FIELDS = ('id', 'name', 'price', 'stock')
+
+    def __init__(self, store: ColumnarCatalog, position: int):
+        self._store = store
+        self._position = position
+
+    @property
+    def id(self) -> int:
+        return self._store.ids[self._position]
+
+    @property
+    def name(self) -> str:
+        return self._store.names[self._position]
+
+    @property
+    def price(self) -> int:
+        return self._store.prices[self._position]
+
+    @price.setter
+    def price(self, value: int) -> None:
+        self._store.prices[self._position] = value
+
+    @property
+    def stock(self) -> int:
+        return self._store.stock[self._position]
+
+    @stock.setter
+    def stock(self, value: int) -> None:
+        self._store.stock[self._position] = value
+
+    def __getitem__(self, key: str):
+        if key == 'id':
+            return self._store.ids[self._position]
+        if key == 'name':
+            return self._store.names[self._position]
+        if key == 'price':
+            return self._store.prices[self._position]
+        if key == 'stock':
+            return self._store.stock[self._position]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value) -> None:
+        if key == 'price':
+            self._store.prices[self._position] = value
+        elif key == 'stock':
+            self._store.stock[self._position] = value
+        else:
+            raise KeyError(f"'{key}' cannot be changed")
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.FIELDS
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ProductRow):
+            return self._store is other._store and self._position == other._position
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ProductRow({self.to_dict()})"
+
+    def get(self, key: str, default=None):
+        return self[key] if key in self.FIELDS else default
+
+    def keys(self):
+        return self.FIELDS
+
+    def to_dict(self) -> Dict:
+        return {key: self[key] for key in self.FIELDS}
+
+
+_store: ColumnarCatalog | None = None
+
+
+class CatalogContents:
+    """A complete set of products built off to the side, to be swapped in by install_catalog."""
+
+    __slots__ = ('products', 'by_id', 'store')
+
+    def __init__(self):
+        self.products: list = []
+        self.by_id: Dict[int, Product] = {}
+        self.store = ColumnarCatalog() if columnar else None
+
+    def add(self, product) -> None:
+        if self.store is not None:
+            self.store.append(product)
+        else:
+            self.products.append(product)
+            self.by_id[product.id] = product
+
+    def get(self, product_id: int):
+        return self.store.get(product_id) if self.store is not None else self.by_id.get(product_id)
+
+    def __iter__(self) -> Iterator:
+        return iter(self.store if self.store is not None else self.products)
+
+
+def prepare_catalog(items: Iterable) -> CatalogContents:
+    """Build a new catalog from the given products without touching the live one."""
+    contents = CatalogContents()
+    for product in items:
+        contents.add(product)
+    return contents
+
+
+def install_catalog(contents: CatalogContents) -> None:
+    """Make prepared contents the live catalog, replacing the old one in a single step for readers."""
+    global _store, products_by_id
+    products_by_id = contents.by_id
+    _store = contents.store
+    products[:] = contents.products
+
+
+def build_catalog(items: Iterable) -> None:
+    """
+    Replace the catalog contents with the given products and rebuild the id index.
+
+    The live catalog is only replaced once the new one is complete.
+
+    :param items: Product objects
+    :return: None
+    """
+    install_catalog(prepare_catalog(items))
+
+
+def add_product(product) -> None:
+    """
+    Add a single product to the catalog and index it by id.
+
+    :param product: Product with a unique 'id'
+    :return: None
+    """
+    if _store is not None:
+        _store.append(product)
+        return
+    products.append(product)
+    products_by_id[product.id] = product
+
+
+def remove_products(product_ids: Iterable[int]) -> List:
+    """
+    Remove products from the catalog.
+
+    :param product_ids: Ids of the products to remove; unknown ids are ignored
+    :return: The removed products
+    """
+    removed = []
+    if _store is not None:
+        for product_id in product_ids:
+            product = _store.get(product_id)
+            if product is not None and _store.remove(product_id):
+                removed.append(product)
+        return removed
+    for product_id in product_ids:
+        product = products_by_id.pop(product_id, None)
+        if product is not None:
+            removed.append(product)
+    if removed:
+        products[:] = [product for product in products if product.id in products_by_id]
+    return removed
+
+
+def columnar_store() -> ColumnarCatalog | None:
+    """Return the ColumnarCatalog in columnar mode, None otherwise."""
+    return _store
+
+
+def all_products() -> Iterable:
+    """
+    Return every product in the catalog, in load order.
+
+    :return: The `products` list, or the ColumnarCatalog rows in columnar mode
+    """
+    return _store if _store is not None else products
+
+
+def product_count() -> int:
+    return len(_store) if _store is not None else len(products)
+
+
+def get_product(product_id: int):
+    """
+    Look up a product by id in constant time.
+
+    :param product_id: Unique product identifier
+    :return: The Product (a ProductRow in columnar mode), or None
+             if it is not in the catalog
+    """
+    if _store is not None:
+        return _store.get(product_id)
+    return products_by_id.get(product_id)
+
+
+def reserve_stock(product_id: int, quantity: int) -> bool:
+    """
+    Take `quantity` units of a product out of stock.
+
+    :param product_id: Unique product identifier
+    :param quantity: Number of units to take (must be positive)
+    :return: True if the product exists and had enough stock, False otherwise
+    """
+    if _store is not None:
+        position = _store.position(product_id)
+        if position < 0 or _store.stock[position] < quantity:
+            return False
+        _store.stock[position] -= quantity
+        return True
+    product = products_by_id.get(product_id)
+    if product is None or product.stock < quantity:
+        return False
+    product.stock -= quantity
+    return True
+
+
+def release_stock(product_id: int, quantity: int) -> None:
+    """
+    Return `quantity` units of a product to stock.
+
+    Products that are no longer in the catalog are ignored.
+
+    :param product_id: Unique product identifier
+    :param quantity: Number of units to return
+    :return: None
+    """
+    if _store is not None:
+        position = _store.position(product_id)
+        if position >= 0:
+            _store.stock[position] += quantity
+        return
+    product = products_by_id.get(product_id)
+    if product is not None:
+        product.stock += quantity
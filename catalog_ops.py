@@ -0,0 +1,196 @@
+import csv
+import fnmatch
+import re
+from array import array
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the operations fall back to pure Python loops
+    np = None
+
+from ..services.catalog import all_products, columnar_store, get_product, ProductRow
+from ..services.inventory import all_stripes_locked
+from ..services.product_service import sync_lock
+from ..services.storage import get_backend
+from ..services.warehouse_state import stock_ledger
+
+# Percentages are applied in hundredths of a percent, so repricing is exact
+# integer arithmetic in both NumPy and pure Python
+_BASIS = 10_000
+_INT64_MAX = 2 ** 63 - 1
+
+
+def _basis_points(percent) -> int:
+    try:
+        value = Decimal(str(percent).strip()) * 100
+    except InvalidOperation:
+        raise ValueError(f"Invalid percentage: {percent!r}") from None
+    if not value.is_finite() or value != value.to_integral_value():
+        raise ValueError(f"Invalid percentage: {percent!r} (at most two decimal places)")
+    if value < -_BASIS:
+        raise ValueError("Prices cannot be reduced by more than 100%")
+    return int(value)
+
+
+def _save_prices(changed: Iterable) -> None:
+    backend = get_backend()
+    if backend is not None:
+        backend.save_prices((product.id, product.price) for product in changed)
+
+
+def _live_mask(store, count: int):
+    """Return a boolean array marking which of the first `count` rows hold a product that was not removed."""
+    if not store.removed:
+        return np.ones(count, dtype=bool)
+    live = np.zeros(count, dtype=bool)
+    positions = np.fromiter(store.live_positions(), dtype=np.int64)
+    live[positions[positions < count]] = True
+    return live
+
+
+def reprice(pattern: str, percent) -> int:
+    """
+    Change the price of every product whose name matches a pattern by a percentage.
+
+    In columnar mode with NumPy installed the prices are updated as one
+    vectorized operation over the price column; otherwise product by
+    product. New prices are rounded half up to the kobo. With a storage
+    backend the new prices are saved to it; with the warehouse files
+    the change lasts until the catalog is reloaded.
+
+    :param pattern: Case-insensitive glob matched against the whole name, e.g. "*shirt*" ("*" for all)
+    :param percent: Change in percent, e.g. 10 or "-12.5", with at most two decimal places
+    :return: Number of products repriced
+    :raises ValueError: If the percentage is invalid or a new price would not fit in 64 bits
+    """
+    factor = _BASIS + _basis_points(percent)
+    match = re.compile(fnmatch.translate(pattern), re.IGNORECASE).match
+    # A sync or reload writing prices between the read and the write-back
+    # below would be overwritten
+    with sync_lock:
+        store = columnar_store()
+
+        if store is None or np is None:
+            changed = [product for product in all_products() if match(product.name)]
+            if any(product.price > (_INT64_MAX - _BASIS) // max(factor, 1) for product in changed):
+                raise ValueError("New prices would be too large")
+            for product in changed:
+                product.price = (product.price * factor + _BASIS // 2) // _BASIS
+            _save_prices(changed)
+            return len(changed)
+
+        # Rows appended after this (e.g. by a progressive load) are left alone
+        count = len(store.ids)
+        positions = np.flatnonzero(np.fromiter((match(name) is not None for name in store.names[:count]),
+                                               dtype=bool, count=count) & _live_mask(store, count))
+        prices = np.frombuffer(store.prices[:count], dtype=np.int64).copy()
+        selected = prices[positions]
+        if selected.size and int(selected.max()) > (_INT64_MAX - _BASIS) // max(factor, 1):
+            raise ValueError("New prices would be too large")
+        prices[positions] = (selected * factor + _BASIS // 2) // _BASIS
+        store.prices[:count] = array('q', prices.tobytes())
+        if get_backend() is not None:
+            _save_prices([ProductRow(store, position) for position in positions.tolist()])
+        return len(positions)
+
+
+def restock(quantities: Dict[int, int]) -> int:
+    """
+    Add units to the stock of many products at once.
+
+    Negative quantities remove units; stock never goes below 0. Every
+    inventory stripe is locked meanwhile, so no reservation runs in between.
+    In columnar mode with NumPy installed this is one vectorized update of
+    the stock column. With a storage backend the units actually added are
+    applied to its stock, otherwise they are recorded in the stock ledger
+    (see services.warehouse_state), so they survive a restart.
+
+    :param quantities: Product id -> units to add
+    :return: Number of products restocked (unknown ids are skipped)
+    """
+    store = columnar_store()
+    with all_stripes_locked():
+        if store is None or np is None:
+            received: Dict[int, int] = {}
+            for product_id, quantity in quantities.items():
+                product = get_product(product_id)
+                if product is not None:
+                    stock = max(product.stock + quantity, 0)
+                    received[product_id] = stock - product.stock
+                    product.stock = stock
+            _persist_stock(received)
+            return len(received)
+
+        count = len(store.ids)
+        product_ids = np.fromiter(quantities, dtype=np.int64, count=len(quantities))
+        positions = np.fromiter((store.position(product_id) for product_id in quantities),
+                                dtype=np.int64, count=len(quantities))
+        deltas = np.fromiter(quantities.values(), dtype=np.int64, count=len(quantities))
+        known = (positions >= 0) & (positions < count)
+        product_ids, positions, deltas = product_ids[known], positions[known], deltas[known]
+        stock = np.frombuffer(store.stock[:count], dtype=np.int64).copy()
+        before = stock[positions]
+        after = np.maximum(before + deltas, 0)
+        stock[positions] = after
+        store.stock[:count] = array('q', stock.tobytes())
+        _persist_stock(dict(zip(product_ids.tolist(), (after - before).tolist())))
+        return len(positions)
+
+
+def _persist_stock(received: Dict[int, int]) -> None:
+    # Deltas, not absolute stock: stock in memory has the units held in carts taken off
+    backend = get_backend()
+    if backend is not None:
+        backend.add_stock(received.items())
+    else:
+        stock_ledger.record(received)
+
+
+def restock_from_csv(file_path: str) -> int:
+    """
+    Restock from a CSV file of product_id,quantity lines (see restock).
+
+    A header line, blank lines and malformed lines are skipped. Quantities
+    for the same product are added up.
+
+    :param file_path: Path of the CSV file
+    :return: Number of products restocked
+    :raises OSError: If the file cannot be read
+    """
+    quantities: Dict[int, int] = {}
+    with open(file_path, newline='') as f:
+        for row in csv.reader(f):
+            try:
+                product_id, quantity = int(row[0]), int(row[1])
+            except (IndexError, ValueError):
+                continue
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return restock(quantities)
+
+
+def filter_by_price(min_price: int | None = None, max_price: int | None = None,
+                    page: int = 1, page_size: int = 20) -> Tuple[List, int]:
+    """
+    Return one page of the products priced within a range, in catalog order.
+
+    :param min_price: Lowest price in kobo, inclusive (None: no lower bound)
+    :param max_price: Highest price in kobo, inclusive (None: no upper bound)
+    :param page: 1-based page number
+    :param page_size: Number of products per page
+    :return: (products on the page, total number of products in the range)
+    """
+    low = min_price if min_price is not None else -_INT64_MAX
+    high = max_price if max_price is not None else _INT64_MAX
+    start = max(page - 1, 0) * page_size
+    store = columnar_store()
+
+    if store is None or np is None:
+        matches = [product for product in all_products() if low <= product.price <= high]
+        return matches[start:start + page_size], len(matches)
+
+    count = len(store.ids)
+    prices = np.frombuffer(store.prices[:count], dtype=np.int64)
+    positions = np.flatnonzero((prices >= low) & (prices <= high) & _live_mask(store, count))
+    return [ProductRow(store, position) for position in positions[start:start + page_size].tolist()], len(positions)
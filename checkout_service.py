@@ -0,0 +1,199 @@
+import atexit
+import queue
+import threading
+import time
+from typing import Dict, List
+
+from ..models.user import User
+from ..services import inventory
+from ..services.session import Session
+from ..services.orders import order_log, order_log_ready, next_transaction_id, ORDERS_PATH
+from ..services.storage import get_backend
+from ..services.user_service import accounts_journal, flush_users, save_users, write_account_record, COMPACT_THRESHOLD
+
+# Most checkouts written (and fsync'ed) together in one batch
+MAX_BATCH_SIZE = 256
+# Number of locks user ids are spread over, so one user cannot spend the
+# same balance in two concurrent checkouts. Ids are used as, unlike
+# usernames, they do not change when a user is renamed.
+USER_LOCK_STRIPES = 64
+
+_user_stripes: List[threading.Lock] = [threading.Lock() for _ in range(USER_LOCK_STRIPES)]
+
+
+class PendingCheckout:
+    """A checkout applied in memory and waiting for its batch to be made durable."""
+
+    __slots__ = ('user', 'order', 'done', 'error')
+
+    def __init__(self, user: User, order: Dict):
+        self.user = user
+        self.order = order
+        self.done = threading.Event()
+        self.error: BaseException | None = None
+
+
+class CheckoutEngine:
+    """
+    Commits checkouts as single durable transactions, with group commit.
+
+    A checkout debits the balance and takes the cart's stock in memory, then
+    waits while a writer thread persists it. The writer takes every checkout
+    queued up while the previous batch was being written and commits them
+    together, so concurrent checkouts share one fsync (text files) or one
+    transaction (SQLite backend). If the write fails, every checkout in the
+    batch is rolled back and the error is raised to its caller.
+
+    With the text files, each checkout is one accounts journal record holding
+    the user's new state and the order, which is the commit point. Orders are
+    then copied to the order log (see services.orders) while the journal is
+    still locked, so compaction can never drop a committed order (see
+    recover_orders). Transaction ids are issued by the writer, so they
+    increase in commit order.
+    """
+
+    def __init__(self, max_batch_size: int = MAX_BATCH_SIZE):
+        self.max_batch_size = max_batch_size
+        self._queue: 'queue.Queue[PendingCheckout | None]' = queue.Queue()
+        self._writer: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, session: Session) -> str:
+        """
+        Pay for everything in the session's cart and wait until it is durable.
+
+        :param session: Session of the paying user
+        :return: The transaction id
+        :raises ValueError: If no user is signed in, the cart is empty, the balance
+                            is insufficient or an expired line is no longer in stock
+        """
+        # Orders are appended after the last one in the log, so it must be loaded
+        order_log_ready.wait()
+        # The session lock is held until the cart is cleared, so a line added
+        # meanwhile waits for the next checkout instead of being dropped.
+        with session.lock:
+            user = session.user
+            if user is None:
+                raise ValueError("Sign in to check out")
+            cart = session.cart
+            with _user_stripes[user.user_id % USER_LOCK_STRIPES]:
+                total: int = cart.recompute_total()
+                if total == 0:
+                    raise ValueError("Your cart is empty")
+                if total > user.balance:
+                    raise ValueError("Insufficient funds. Please fund your wallet.")
+                if not session.commit_reservations():
+                    raise ValueError("Some items in your cart are no longer in stock. Please update your cart.")
+                user.balance -= total
+
+            pending = PendingCheckout(user, {
+                'username': user.username,
+                'user_id': user.user_id,
+                'total': total,
+                'items': [{'product_id': item.product_id, 'name': item.name,
+                           'quantity': item.quantity, 'price': item.price} for item in cart]
+            })
+            self._start()
+            self._queue.put(pending)
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            cart.clear()
+            return pending.order['transaction_id']
+
+    def _start(self) -> None:
+        if self._writer is not None:
+            return
+        with self._start_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name='checkout-writer', daemon=True)
+                self._writer.start()
+
+    def _run(self) -> None:
+        while True:
+            pending = self._queue.get()
+            if pending is None:
+                return
+            batch = [pending]
+            while len(batch) < self.max_batch_size:
+                try:
+                    pending = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if pending is None:
+                    self._queue.put(None)  # Stop after this batch
+                    break
+                batch.append(pending)
+            self._commit(batch)
+
+    def _commit(self, batch: List[PendingCheckout]) -> None:
+        for pending in batch:
+            pending.order['transaction_id'] = next_transaction_id()
+            pending.order['created_at'] = time.time()
+        try:
+            backend = get_backend()
+            if backend is not None:
+                flush_users()  # Balances are updated by username, so store pending renames first
+                backend.save_checkouts([(pending.user, pending.order) for pending in batch])
+            else:
+                self._commit_to_journal(batch)
+        except Exception as e:
+            for pending in batch:
+                _roll_back(pending)
+                pending.error = e
+        for pending in batch:
+            pending.done.set()
+        if get_backend() is None and accounts_journal.record_count >= COMPACT_THRESHOLD:
+            save_users()
+
+    @staticmethod
+    def _commit_to_journal(batch: List[PendingCheckout]) -> None:
+        with accounts_journal.lock:
+            # The user is serialized now, not at submit, so the record also
+            # carries any change saved by save_user in between.
+            accounts_journal.append_many([
+                {'op': 'checkout', 'key': pending.user.username,
+                 'user': pending.user.to_dict(), 'order': pending.order}
+                for pending in batch
+            ])
+            for pending in batch:
+                write_account_record(pending.user)
+            # The batch is committed; a failure from here on is repaired by recover_orders
+            try:
+                order_log.append([pending.order for pending in batch])
+            except OSError as e:
+                print(f"Could not write {ORDERS_PATH}: {e}")
+
+    def close(self) -> None:
+        """Commit every queued checkout and stop the writer thread."""
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+        order_log.close()
+
+
+def _roll_back(pending: PendingCheckout) -> None:
+    pending.user.balance += pending.order['total']
+    for item in pending.order['items']:
+        inventory.restock(item['product_id'], item['quantity'])
+
+
+def recover_orders() -> None:
+    """
+    Restore committed checkouts from the text files after load_users and before load_products.
+
+    Loads the order log and appends the orders that reached the accounts
+    journal but not the order log (a crash in between). load_products then
+    takes the quantities sold in every order off the stock loaded from the
+    warehouse files. When a storage backend is configured it already holds
+    the stock and orders, so nothing is done.
+    """
+    if get_backend() is not None:
+        return
+    order_log.load()
+    order_log.recover(record['order'] for record in accounts_journal.replay() if record['op'] == 'checkout')
+
+
+checkout_engine = CheckoutEngine()
+atexit.register(checkout_engine.close)
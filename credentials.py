@@ -0,0 +1,94 @@
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Scheme used for new hashes: 'scrypt', or 'pbkdf2_sha256' where hashlib
+# has no scrypt (OpenSSL before 1.1)
+scheme: str = 'scrypt' if hasattr(hashlib, 'scrypt') else 'pbkdf2_sha256'
+
+# Work factors for new hashes. Raising them makes every older hash "need a
+# rehash", and it is upgraded the next time its user signs in.
+SCRYPT_N = 2 ** 14  # Uses 128 * N * R bytes (16 MiB) of memory per hash
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600_000
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+# Most passwords hashed at once. hashlib releases the GIL while hashing, so
+# this many run in parallel while everything else keeps going; further
+# sign-ins queue instead of adding to the CPU and memory load.
+HASH_WORKERS = os.cpu_count() or 2
+
+_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='password-hash')
+
+
+def _derive(algorithm: str, params: list[int], password: str, salt: bytes) -> bytes:
+    if algorithm == 'scrypt':
+        n, r, p = params
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r + (1 << 20), dklen=KEY_BYTES)
+    if algorithm == 'pbkdf2_sha256':
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, params[0], dklen=KEY_BYTES)
+    raise ValueError(f"Unknown password hash scheme '{algorithm}'")
+
+
+def _current_params() -> list[int]:
+    return [SCRYPT_N, SCRYPT_R, SCRYPT_P] if scheme == 'scrypt' else [PBKDF2_ITERATIONS]
+
+
+def _hash(password: str) -> str:
+    salt = os.urandom(SALT_BYTES)
+    params = _current_params()
+    key = _derive(scheme, params, password, salt)
+    return f"${scheme}${':'.join(map(str, params))}${salt.hex()}${key.hex()}"
+
+
+def _verify(password: str, password_hash: str) -> bool:
+    if not password_hash.startswith('$'):
+        # Unsalted SHA-256 from before salted hashes
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), password_hash)
+    try:
+        _, algorithm, params, salt, key = password_hash.split('$')
+        expected = _derive(algorithm, [int(value) for value in params.split(':')], password, bytes.fromhex(salt))
+        return hmac.compare_digest(expected, bytes.fromhex(key))
+    except ValueError:
+        return False
+
+
+def hash_password(password: str) -> str:
+    """
+    Hash a password with a fresh salt, using the current scheme and work factors.
+
+    The result is self-describing, e.g. "$scrypt$16384:8:1$<salt hex>$<key hex>".
+    Hashing runs in the shared worker pool; this waits for it.
+    """
+    return _pool.submit(_hash, password).result()
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """
+    Check a password against a hash made by hash_password or the older unsalted SHA-256.
+
+    The comparison takes the same time wherever the hashes differ. Runs in
+    the shared worker pool; this waits for it.
+    """
+    return _pool.submit(_verify, password, password_hash).result()
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """Return True if the hash was not made with the current scheme and work factors."""
+    parts = password_hash.split('$')
+    return len(parts) != 5 or parts[1] != scheme or parts[2] != ':'.join(map(str, _current_params()))
+
+
+_dummy_hash: str | None = None
+
+
+def burn_verify_time(password: str) -> None:
+    """Take as long as verify_password would, e.g. for an unknown user, so the response time gives nothing away."""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password('')
+    verify_password(password, _dummy_hash)
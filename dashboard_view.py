@@ -1,33 +1,34 @@
 import time
 
-from ..models.user import current_user
 from ..views.purchase_view import purchase_menu
 from ..views.account_view import account_menu
 
-from ..services.user_service import save_users
+from ..services.session import Session
+from ..services.user_service import save_user
 from ..utils.helpers import clear_screen
+from ..utils.money import format_kobo, to_kobo
 
 
-def display_dashboard_menu() -> None:
+def display_dashboard_menu(session: Session) -> None:
     clear_screen()
-    print(f"\n{"===" * 8} Welcome, {current_user['username']} {"===" * 8}")
+    print(f"\n{'===' * 8} Welcome, {session.user.username} {'===' * 8}")
     print("1. Fund Wallet")
     print("2. Purchase Items")
     print("3. Manage Account")
     print("4. Logout")
 
 
-def fund_wallet() -> None:
+def fund_wallet(session: Session) -> None:
     """
-    Add funds to the current user's wallet balance.
+    Add funds to the signed-in user's wallet balance.
 
     Provides predefined amounts (10k, 20k, 50k, 100k) and custom amount option.
     Updates the user's balance and displays confirmation.
     """
-    global current_user
+    current_user = session.user
 
     print("\n=== Fund Wallet ===")
-    print(f"Current balance: NGN {current_user['balance']:,.2f}")
+    print(f"Current balance: NGN {format_kobo(current_user.balance)}")
 
     options = {
         '1': 10000,
@@ -45,23 +46,23 @@ def fund_wallet() -> None:
         if fund_choice in options:
             if fund_choice == '5':
                 try:
-                    amount: float = float(input("Enter custom amount: "))
+                    amount: int = to_kobo(input("Enter custom amount: "))
                     if amount <= 0:
                         print("Amount must be a positive number 😒")
                         continue
-                    elif amount > 100000000:  # Example limit
+                    elif amount > to_kobo(100000000):  # Example limit
                         print("Maximum funding amount is NGN 100,000,000 at a time 🫤")
                         continue
                 except ValueError:
                     print("Invalid amount ❌")
                     continue
             else:
-                amount = options[fund_choice]
+                amount = to_kobo(options[fund_choice])
 
-            current_user['balance'] += amount
+            current_user.balance += amount
             # save to the doc
-            save_users()
-            print(f"\nProcessing payment of NGN {amount:,.2f}...")
+            save_user(current_user)
+            print(f"\nProcessing payment of NGN {format_kobo(amount)}...")
             time.sleep(1)
             print("Payment successful! ✅")
             break
@@ -70,25 +71,26 @@ def fund_wallet() -> None:
             print("Invalid Entry! 💢")
 
 
-def dashboard():
+def dashboard(session: Session):
     """
     A Function for the dashboard menu
+    :param session: Session of the signed-in user
     :return:
     """
     while True:
-        display_dashboard_menu()
+        display_dashboard_menu(session)
         dashboard_choice: str = input("Enter choice (1-4): ").strip()
 
         if dashboard_choice == "1":
-            fund_wallet()
+            fund_wallet(session)
         elif dashboard_choice == "2":
-            purchase_menu()
+            purchase_menu(session)
         elif dashboard_choice == "3":
-            account_menu()
+            account_menu(session)
+            if session.user is None:  # Account was deleted
+                break
         elif dashboard_choice == "4":
-            global current_user, cart
-            current_user = None
-            cart = []
+            session.sign_out()
             break
         else:
             print("Invalid choice")
@@ -1,7 +1,6 @@
 import os
 import random
 import string
-import hashlib
 
 def ensure_data_directory():
     if not os.path.exists('data'):
@@ -26,7 +25,4 @@ def generate_password() -> str:
     for _ in range(12):
         password.append(random.choice(all_pass_chars))
     random.shuffle(password)
-    return ''.join(password)
-
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
\ No newline at end of file
+    return ''.join(password)
\ No newline at end of file
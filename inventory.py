@@ -0,0 +1,246 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+from ..services.catalog import reserve_stock, release_stock
+
+# Number of locks product ids are spread over. Two shoppers only contend when
+# their products hash to the same stripe.
+LOCK_STRIPES = 64
+# Reserved stock goes back on sale if the reservation is not renewed within
+# this many seconds
+RESERVATION_TTL = 15 * 60
+# How often the background reaper looks for expired reservations, in seconds
+EXPIRY_SWEEP_INTERVAL = 5.0
+
+_stripes: List[threading.Lock] = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+class Hold:
+    """Units of one product reserved by one holder until `expires_at` (time.monotonic)."""
+
+    __slots__ = ('quantity', 'expires_at')
+
+    def __init__(self, quantity: int, expires_at: float):
+        self.quantity = quantity
+        self.expires_at = expires_at
+
+
+# holder -> product id -> Hold. A holder's entry for a product is only read or
+# changed with that product's stripe lock held; _holds_lock guards adding and
+# removing holders.
+_holds: Dict[str, Dict[int, Hold]] = {}
+_holds_lock = threading.Lock()
+
+# (expires_at, sequence, holder, product id), earliest first. Renewing a hold
+# pushes a new entry and leaves the old one to be skipped when it surfaces.
+_expiry_heap: List[Tuple[float, int, str, int]] = []
+_expiry_lock = threading.Lock()
+_sequence = itertools.count()
+
+_reaper: threading.Thread | None = None
+_reaper_stop = threading.Event()
+
+
+def _stripe_index(product_id: int) -> int:
+    return hash(product_id) % LOCK_STRIPES
+
+
+def _stripe(product_id: int) -> threading.Lock:
+    return _stripes[_stripe_index(product_id)]
+
+
+def _holder_holds(holder: str) -> Dict[int, Hold]:
+    holds = _holds.get(holder)
+    if holds is None:
+        with _holds_lock:
+            holds = _holds.setdefault(holder, {})
+    return holds
+
+
+def reserve(holder: str, product_id: int, quantity: int, ttl: float = RESERVATION_TTL) -> bool:
+    """
+    Take `quantity` units of a product out of stock for `holder`.
+
+    Adding to an existing hold renews its expiry for the whole quantity.
+
+    :param holder: Who the stock is held for, e.g. a session token
+    :param product_id: Unique product identifier
+    :param quantity: Number of units to reserve (must be positive)
+    :param ttl: Seconds until the hold expires unless renewed
+    :return: True if the stock was reserved, False if there was not enough
+    """
+    now = time.monotonic()
+    try:
+        due = _expiry_heap[0][0] <= now
+    except IndexError:
+        due = False
+    if due:
+        expire_reservations(now)
+
+    holds = _holder_holds(holder)
+    expires_at = now + ttl
+    with _stripe(product_id):
+        if not reserve_stock(product_id, quantity):
+            return False
+        hold = holds.get(product_id)
+        if hold is None:
+            holds[product_id] = Hold(quantity, expires_at)
+        else:
+            hold.quantity += quantity
+            hold.expires_at = expires_at
+    with _expiry_lock:
+        heapq.heappush(_expiry_heap, (expires_at, next(_sequence), holder, product_id))
+    return True
+
+
+def release(holder: str, product_id: int, quantity: int) -> int:
+    """
+    Return up to `quantity` units held by `holder` to stock.
+
+    :return: The number of units actually released, which is less than
+             `quantity` if part of the hold had already expired
+    """
+    holds = _holds.get(holder)
+    if holds is None:
+        return 0
+    with _stripe(product_id):
+        hold = holds.get(product_id)
+        if hold is None:
+            return 0
+        quantity = min(quantity, hold.quantity)
+        release_stock(product_id, quantity)
+        hold.quantity -= quantity
+        if hold.quantity == 0:
+            del holds[product_id]
+    return quantity
+
+
+def release_all(holder: str) -> None:
+    """Return everything `holder` has reserved to stock and forget the holder."""
+    with _holds_lock:
+        holds = _holds.pop(holder, None)
+    if not holds:
+        return
+    for product_id in list(holds):
+        with _stripe(product_id):
+            hold = holds.pop(product_id, None)
+            if hold is not None:
+                release_stock(product_id, hold.quantity)
+
+
+def restock(product_id: int, quantity: int) -> None:
+    """Put `quantity` units of a product (not held by anyone) back on sale, e.g. when a sale is undone."""
+    with _stripe(product_id):
+        release_stock(product_id, quantity)
+
+
+@contextmanager
+def all_stripes_locked():
+    """Hold every stripe lock, e.g. to change the stock of many products at once."""
+    for lock in _stripes:
+        lock.acquire()
+    try:
+        yield
+    finally:
+        for lock in reversed(_stripes):
+            lock.release()
+
+
+def held(holder: str) -> Dict[int, int]:
+    """Return product id -> units currently reserved by `holder`."""
+    holds = _holds.get(holder, {})
+    return {product_id: hold.quantity for product_id, hold in list(holds.items())}
+
+
+def commit(holder: str, wanted: Dict[int, int]) -> bool:
+    """
+    Turn `holder`'s reservations for `wanted` (product id -> units) into sold stock.
+
+    Units whose hold has expired in the meantime are taken from stock again.
+    Either every product is committed or none is: the stripes of all the
+    products are locked (in stripe order, so concurrent commits cannot
+    deadlock) while they are checked and updated. Anything else the holder
+    had reserved is returned to stock.
+
+    :return: True if all of `wanted` is now sold to the holder, False if some
+             of it is no longer in stock, in which case nothing changes
+    """
+    holds = _holder_holds(holder)
+    stripes = [_stripes[index] for index in sorted(set(map(_stripe_index, wanted)))]
+    for lock in stripes:
+        lock.acquire()
+    try:
+        taken: List[Tuple[int, int]] = []
+        for product_id, quantity in wanted.items():
+            hold = holds.get(product_id)
+            shortfall = quantity - (hold.quantity if hold is not None else 0)
+            if shortfall <= 0:
+                continue
+            if not reserve_stock(product_id, shortfall):
+                for taken_id, taken_quantity in taken:
+                    release_stock(taken_id, taken_quantity)
+                return False
+            taken.append((product_id, shortfall))
+        for product_id, quantity in wanted.items():
+            hold = holds.pop(product_id, None)
+            if hold is not None and hold.quantity > quantity:
+                release_stock(product_id, hold.quantity - quantity)
+    finally:
+        for lock in reversed(stripes):
+            lock.release()
+    release_all(holder)
+    return True
+
+
+def expire_reservations(now: float | None = None) -> int:
+    """
+    Return the stock of every hold that has passed its expiry.
+
+    :param now: time.monotonic() value to expire against (default: now)
+    :return: Number of units returned to stock
+    """
+    now = time.monotonic() if now is None else now
+    released = 0
+    while True:
+        with _expiry_lock:
+            if not _expiry_heap or _expiry_heap[0][0] > now:
+                return released
+            _, _, holder, product_id = heapq.heappop(_expiry_heap)
+        holds = _holds.get(holder)
+        if holds is None:
+            continue
+        with _stripe(product_id):
+            hold = holds.get(product_id)
+            # Skip holds that were renewed, released or committed since
+            if hold is None or hold.expires_at > now:
+                continue
+            release_stock(product_id, hold.quantity)
+            released += hold.quantity
+            del holds[product_id]
+
+
+def _reap(interval: float) -> None:
+    while not _reaper_stop.wait(interval):
+        expire_reservations()
+
+
+def start_reaper(interval: float = EXPIRY_SWEEP_INTERVAL) -> None:
+    """Expire reservations every `interval` seconds on a background thread."""
+    global _reaper
+    if _reaper is not None and _reaper.is_alive():
+        return
+    _reaper_stop.clear()
+    _reaper = threading.Thread(target=_reap, args=(interval,), name='reservation-reaper', daemon=True)
+    _reaper.start()
+
+
+def stop_reaper() -> None:
+    global _reaper
+    _reaper_stop.set()
+    if _reaper is not None:
+        _reaper.join()
+        _reaper = None
@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+from typing import Dict, Iterator, List
+
+from ..utils.helpers import ensure_data_directory
+
+
+class Journal:
+    """
+    Append-only log of JSON records, one per line.
+
+    Records are written and flushed immediately but only fsync'ed in batches:
+    after `batch_size` records, or at most `sync_interval` seconds after the
+    first unsynced record, whichever comes first. A torn final line (from a
+    crash mid-write) is ignored on replay, and cut off before the next record
+    is appended, so records written after a crash are not lost behind it.
+
+    Hold `lock` to make several journal operations atomic with respect to
+    other writers and to reset().
+    """
+
+    def __init__(self, path: str, batch_size: int = 32, sync_interval: float = 0.05):
+        self.path = path
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+        self.record_count = 0
+        self._file = None
+        self._pending = 0
+        self._timer: threading.Timer | None = None
+        # Size of the journal up to the end of its last complete record, or
+        # None until the journal has been read
+        self._good_size: int | None = None
+        self.lock = threading.RLock()
+
+    def _open(self) -> None:
+        """Open the journal for appending, cutting off a torn final record first."""
+        ensure_data_directory()
+        if self._good_size is None:
+            for _ in self.replay():
+                pass
+        self._file = open(self.path, 'ab')
+        if self._file.tell() > self._good_size:
+            self._file.truncate(self._good_size)
+            self._file.seek(0, os.SEEK_END)
+
+    def append(self, record: Dict) -> None:
+        """Write a record to the end of the journal."""
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+        with self.lock:
+            if self._file is None:
+                self._open()
+            self._file.write(line)
+            self._file.flush()
+            self._good_size = self._file.tell()
+            self.record_count += 1
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self.sync()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.sync_interval, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def append_many(self, records: List[Dict]) -> None:
+        """
+        Write several records and force them to disk with a single fsync.
+
+        Used for group commit: the records are durable when this returns.
+        """
+        lines = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records).encode()
+        with self.lock:
+            if self._file is None:
+                self._open()
+            self._file.write(lines)
+            self._file.flush()
+            self._good_size = self._file.tell()
+            self.record_count += len(records)
+            self._pending += len(records)
+            self.sync()
+
+    def sync(self) -> None:
+        """Force every written record to disk."""
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._file is not None and self._pending:
+                os.fsync(self._file.fileno())
+            self._pending = 0
+
+    def replay(self) -> Iterator[Dict]:
+        """
+        Yield the records currently in the journal, oldest first.
+
+        Stops at the first line that is not a complete JSON record, and
+        remembers where it ends, so the next append starts there.
+        """
+        self.record_count = 0
+        good_size = 0
+        try:
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    good_size += len(line)
+                    self.record_count += 1
+                    yield record
+        except FileNotFoundError:
+            pass
+        with self.lock:
+            if self._file is None:
+                self._good_size = good_size
+
+    def reset(self) -> None:
+        """Discard every record, e.g. after they were compacted into a snapshot."""
+        with self.lock:
+            self.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.record_count = 0
+            self._good_size = 0
+
+    def close(self) -> None:
+        with self.lock:
+            self.sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def write_snapshot(path: str, lines: Iterator[str] | Iterator[bytes], binary: bool = False) -> None:
+    """
+    Atomically replace `path` with the given lines (bytes if `binary`).
+
+    The new content is written to a temporary file, fsync'ed and renamed over
+    the old one, so readers see either the old or the new snapshot in full.
+    """
+    ensure_data_directory()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') if binary else open(tmp_path, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -1,20 +1,28 @@
-from services.user_service import load_users
-from services.product_service import load_products
+from services import metrics
+from services.inventory import start_reaper
+from services.session import sessions
+from services.startup import load_store, start_catalog_watcher, install_reload_signal
+from services.storage import configure_from_env
 from views.auth_view import display_start_menu, handle_user_choice
 from views.dashboard_view import dashboard
 
 def main():
-    load_users()
-    load_products()
+    configure_from_env()
+    metrics.configure_from_env()
+    load_store()
+    start_reaper()
+    start_catalog_watcher()
+    install_reload_signal()
 
     print("Welcome to the E-Commerce App! 💳")
 
+    session = sessions.create()
     while True:
         display_start_menu()
         user_choice = input(
             "Do you wish to Sign In or Sign Up? Enter [1-3]\n[To exit, enter 'quit'/'exit']: ").strip().lower()
-        if handle_user_choice(user_choice) and current_user:
-            dashboard()
+        if handle_user_choice(user_choice, session) and session.user:
+            dashboard(session)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,238 @@
+import atexit
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from ..services.journal import write_snapshot
+
+# Set to a file path to collect metrics and write them there (see configure_from_env)
+METRICS_PATH_ENV = 'ECOMMERCE_METRICS_PATH'
+# How often the exporter rewrites the metrics file, in seconds
+EXPORT_INTERVAL = 15.0
+# Upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+# When disabled, counters and timers return straight away without recording
+# anything, so instrumented code costs one flag check per call.
+enabled: bool = False
+
+_registry: Dict[str, 'Counter | Histogram'] = {}
+_registry_lock = threading.Lock()
+
+
+class Counter:
+    """A number that only goes up, e.g. requests served."""
+
+    __slots__ = ('name', 'description', 'value', '_lock')
+
+    def __init__(self, name: str, description: str = ''):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        if not enabled:
+            return
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    """
+    Observed values (latencies in seconds) counted in buckets, with their count and sum.
+
+    A value is counted in the first bucket whose upper bound it does not
+    exceed; values above the last bound are only in the count and sum.
+    """
+
+    __slots__ = ('name', 'description', 'bounds', 'counts', 'count', 'sum', '_lock')
+
+    def __init__(self, name: str, description: str = '', bounds: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        if not enabled:
+            return
+        position = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            if position < len(self.counts):
+                self.counts[position] += 1
+            self.count += 1
+            self.sum += value
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """Return (upper bound, number of values not above it) for every bucket."""
+        with self._lock:
+            total, buckets = 0, []
+            for bound, count in zip(self.bounds, self.counts):
+                total += count
+                buckets.append((bound, total))
+            return buckets
+
+
+def _register(metric_type, name: str, description: str):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = metric_type(name, description)
+        elif not isinstance(metric, metric_type):
+            raise ValueError(f"Metric '{name}' is already registered as a {type(metric).__name__}")
+        return metric
+
+
+def counter(name: str, description: str = '') -> Counter:
+    """Return the counter called `name`, creating it the first time."""
+    return _register(Counter, name, description)
+
+
+def histogram(name: str, description: str = '') -> Histogram:
+    """Return the histogram called `name`, creating it the first time."""
+    return _register(Histogram, name, description)
+
+
+class timer:
+    """
+    Time a block into a histogram, e.g. `with timer(load_seconds): ...`.
+
+    The time is recorded whether or not the block raises.
+    """
+
+    __slots__ = ('histogram', '_began')
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self._began = 0.0
+
+    def __enter__(self) -> 'timer':
+        if enabled:
+            self._began = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if enabled and self._began:
+            self.histogram.observe(time.perf_counter() - self._began)
+
+
+def timed(name: str, description: str = '') -> Callable:
+    """
+    Decorator recording how long each call of a function takes in the histogram `name`.
+
+    Not for generator functions, which return before doing their work.
+    """
+    histogram_ = histogram(name, description)
+
+    def decorate(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            began = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram_.observe(time.perf_counter() - began)
+        return wrapper
+    return decorate
+
+
+def _metrics() -> List['Counter | Histogram']:
+    with _registry_lock:
+        return sorted(_registry.values(), key=lambda metric: metric.name)
+
+
+def to_prometheus() -> str:
+    """Return every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics():
+        if metric.description:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+        if isinstance(metric, Counter):
+            lines.append(f"# TYPE {metric.name} counter")
+            lines.append(f"{metric.name} {metric.value}")
+            continue
+        lines.append(f"# TYPE {metric.name} histogram")
+        for bound, count in metric.cumulative():
+            lines.append(f'{metric.name}_bucket{{le="{bound}"}} {count}')
+        lines.append(f'{metric.name}_bucket{{le="+Inf"}} {metric.count}')
+        lines.append(f"{metric.name}_sum {metric.sum}")
+        lines.append(f"{metric.name}_count {metric.count}")
+    return '\n'.join(lines) + '\n'
+
+
+def to_json() -> Dict:
+    """Return every metric as {'counters': {name: value}, 'histograms': {name: {...}}}."""
+    counters, histograms = {}, {}
+    for metric in _metrics():
+        if isinstance(metric, Counter):
+            counters[metric.name] = metric.value
+        else:
+            histograms[metric.name] = {'count': metric.count, 'sum': metric.sum,
+                                       'buckets': {str(bound): count for bound, count in metric.cumulative()}}
+    return {'counters': counters, 'histograms': histograms}
+
+
+def write_metrics(path: str) -> None:
+    """
+    Atomically write every metric to `path`.
+
+    The file is JSON if its name ends in .json, Prometheus text otherwise
+    (e.g. for the node exporter's textfile collector).
+    """
+    if path.endswith('.json'):
+        write_snapshot(path, [json.dumps(to_json(), indent=2)])
+    else:
+        write_snapshot(path, [to_prometheus()])
+
+
+def reset() -> None:
+    """Zero every metric."""
+    for metric in _metrics():
+        with metric._lock:
+            if isinstance(metric, Counter):
+                metric.value = 0
+            else:
+                metric.counts = [0] * len(metric.bounds)
+                metric.count = 0
+                metric.sum = 0.0
+
+
+_exporter: threading.Thread | None = None
+_exporter_stop = threading.Event()
+
+
+def _export(path: str, interval: float) -> None:
+    while not _exporter_stop.wait(interval):
+        try:
+            write_metrics(path)
+        except OSError as e:
+            print(f"Could not write the metrics: {e}")
+
+
+def start_exporter(path: str, interval: float = EXPORT_INTERVAL) -> None:
+    """Enable metrics and write them to `path` every `interval` seconds and on exit."""
+    global enabled, _exporter
+    enabled = True
+    if _exporter is not None and _exporter.is_alive():
+        return
+    _exporter_stop.clear()
+    _exporter = threading.Thread(target=_export, args=(path, interval), name='metrics-exporter', daemon=True)
+    _exporter.start()
+    atexit.register(write_metrics, path)
+
+
+def configure_from_env() -> None:
+    """Collect metrics and export them when ECOMMERCE_METRICS_PATH is set (see start_exporter)."""
+    path = os.environ.get(METRICS_PATH_ENV)
+    if path:
+        start_exporter(path)
@@ -0,0 +1,83 @@
+import operator
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Sequence
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; sum_line_totals falls back to pure Python
+    np = None
+
+KOBO_PER_NAIRA = 100
+_ONE_KOBO = Decimal('0.01')
+# Amounts are stored as signed 64-bit integers (e.g. the catalog's price arrays)
+MAX_KOBO = 2 ** 63 - 1
+
+# Carts with at least this many lines are summed with NumPy when it is available
+VECTORIZE_THRESHOLD = 1000
+
+
+def to_kobo(amount) -> int:
+    """
+    Convert an amount in naira to integer kobo.
+
+    Accepts ints, floats, Decimals and strings such as "1234.5". Floats are
+    converted through their shortest repr, so 0.1 becomes exactly 10 kobo.
+    Fractions of a kobo are rounded half up.
+
+    :param amount: Amount in naira
+    :return: Amount in kobo
+    :raises ValueError: If the amount is not a finite number or its kobo do
+                        not fit in a signed 64-bit integer (MAX_KOBO)
+    """
+    if isinstance(amount, int):
+        kobo = amount * KOBO_PER_NAIRA
+    else:
+        try:
+            value = Decimal(str(amount).strip())
+            if not value.is_finite():
+                raise ValueError(f"Invalid amount: {amount!r}")
+            # Checked before rounding, which fails on huge exponents
+            if abs(value) * KOBO_PER_NAIRA > MAX_KOBO + 1:
+                raise ValueError(f"Amount out of range: {amount!r}")
+            kobo = int(value.quantize(_ONE_KOBO, rounding=ROUND_HALF_UP) * KOBO_PER_NAIRA)
+        except InvalidOperation:
+            raise ValueError(f"Invalid amount: {amount!r}") from None
+    if not -MAX_KOBO - 1 <= kobo <= MAX_KOBO:
+        raise ValueError(f"Amount out of range: {amount!r}")
+    return kobo
+
+
+def kobo_to_str(kobo: int) -> str:
+    """
+    Render kobo as a plain naira decimal string, e.g. 123456 -> "1234.56".
+
+    This is the format used when amounts are written to the text data files.
+    """
+    sign = '-' if kobo < 0 else ''
+    naira, kobo_part = divmod(abs(kobo), KOBO_PER_NAIRA)
+    return f"{sign}{naira}.{kobo_part:02d}"
+
+
+def format_kobo(kobo: int) -> str:
+    """
+    Render kobo for display with thousands separators, e.g. 123456 -> "1,234.56".
+    """
+    sign = '-' if kobo < 0 else ''
+    naira, kobo_part = divmod(abs(kobo), KOBO_PER_NAIRA)
+    return f"{sign}{naira:,}.{kobo_part:02d}"
+
+
+def sum_line_totals(prices: Sequence[int], quantities: Sequence[int]) -> int:
+    """
+    Return the sum of price * quantity over cart lines, in kobo.
+
+    Large inputs are summed as a NumPy int64 dot product when NumPy is
+    installed; otherwise, and for small inputs, in pure Python. Both are exact.
+
+    :param prices: Unit prices in kobo
+    :param quantities: Quantities, in the same order as `prices`
+    :return: Total in kobo
+    """
+    if np is not None and len(prices) >= VECTORIZE_THRESHOLD:
+        return int(np.dot(np.asarray(prices, dtype=np.int64), np.asarray(quantities, dtype=np.int64)))
+    return sum(map(operator.mul, prices, quantities))
@@ -0,0 +1,247 @@
+import datetime
+import json
+import os
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from ..services.storage import get_backend
+from ..utils.helpers import ensure_data_directory
+
+ORDERS_PATH = 'data/orders.log'
+SECONDS_PER_DAY = 24 * 60 * 60
+# A transaction number is the millisecond it was issued in, shifted left by
+# this many bits, plus a sequence number within that millisecond
+SEQUENCE_BITS = 16
+
+_EPOCH = datetime.date(1970, 1, 1)
+
+
+def transaction_number(transaction_id: str) -> int:
+    """Return the number in a transaction id such as "TXN117461302755328"."""
+    return int(transaction_id[3:])
+
+
+def _day(created_at: float) -> int:
+    return int(created_at // SECONDS_PER_DAY)
+
+
+def _date(day: int) -> datetime.date:
+    return _EPOCH + datetime.timedelta(days=day)
+
+
+class OrderLog:
+    """
+    Append-only log of orders, one JSON record per line, with in-memory indexes.
+
+    The indexes hold byte offsets into the log rather than the orders
+    themselves: per user id (newest last) and per UTC day, plus the revenue
+    and order count of every day. Orders are kept under the id of the user
+    rather than the username, so they follow an account through renames and
+    never show up for someone who later takes a freed username. Orders
+    logged before accounts had ids belong to no user's history. Listing a page of orders reads only the lines
+    on that page, and revenue by day never touches the file, so queries stay
+    fast however long the log grows.
+
+    Orders must be appended in transaction id order (see next_transaction_id).
+    A torn final line from a crash is ignored on load and overwritten by the
+    next append.
+    """
+
+    def __init__(self, path: str = ORDERS_PATH):
+        self.path = path
+        self.lock = threading.RLock()
+        self.count = 0
+        # Number of the last transaction in the log
+        self.last_number = 0
+        # Highest user id an order in the log belongs to
+        self.last_user_id = 0
+        # product id -> units sold over every order in the log
+        self.units_sold: Dict[int, int] = {}
+        self._by_user: Dict[int, array] = {}
+        self._by_day: Dict[int, array] = {}
+        self._revenue_by_day: Dict[int, int] = {}
+        self._size = 0
+        self._writer = None
+        self._reader = None
+
+    def load(self) -> None:
+        """Rebuild the indexes from the log file."""
+        with self.lock:
+            self.close()
+            self.count = 0
+            self.last_number = 0
+            self.last_user_id = 0
+            self.units_sold.clear()
+            self._by_user.clear()
+            self._by_day.clear()
+            self._revenue_by_day.clear()
+            self._size = 0
+            try:
+                with open(self.path, 'rb') as f:
+                    for line in f:
+                        if not line.endswith(b'\n'):
+                            break
+                        try:
+                            order = json.loads(line)
+                        except ValueError:
+                            break
+                        self._index(order, self._size)
+                        self._size += len(line)
+            except FileNotFoundError:
+                return
+
+    def _index(self, order: Dict, offset: int) -> None:
+        user_id = order.get('user_id')
+        if user_id:
+            self._by_user.setdefault(user_id, array('q')).append(offset)
+            self.last_user_id = max(self.last_user_id, user_id)
+        day = _day(order['created_at'])
+        self._by_day.setdefault(day, array('q')).append(offset)
+        self._revenue_by_day[day] = self._revenue_by_day.get(day, 0) + order['total']
+        for item in order['items']:
+            self.units_sold[item['product_id']] = self.units_sold.get(item['product_id'], 0) + item['quantity']
+        self.last_number = transaction_number(order['transaction_id'])
+        self.count += 1
+
+    def append(self, orders: List[Dict]) -> None:
+        """Write orders to the end of the log with a single fsync and index them."""
+        lines = [json.dumps(order, separators=(',', ':')).encode() + b'\n' for order in orders]
+        with self.lock:
+            if self._writer is None:
+                ensure_data_directory()
+                self._writer = open(self.path, 'ab')
+                self._writer.truncate(self._size)  # Drop a torn line left by a crash
+            self._writer.write(b''.join(lines))
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            for order, line in zip(orders, lines):
+                self._index(order, self._size)
+                self._size += len(line)
+
+    def recover(self, orders: Iterable[Dict]) -> int:
+        """
+        Append the committed orders that are missing from the log, e.g. after a crash before they were copied to it.
+
+        Orders up to the last transaction already in the log are skipped.
+
+        :param orders: Committed orders in transaction id order
+        :return: Number of orders appended
+        """
+        with self.lock:
+            missing = [order for order in orders if transaction_number(order['transaction_id']) > self.last_number]
+            if missing:
+                self.append(missing)
+            return len(missing)
+
+    def __iter__(self) -> Iterator[Dict]:
+        """Read every order in the log, oldest first."""
+        with self.lock:
+            size = self._size
+        try:
+            with open(self.path, 'rb') as f:
+                read = 0
+                for line in f:
+                    read += len(line)
+                    if read > size:
+                        return
+                    yield json.loads(line)
+        except FileNotFoundError:
+            return
+
+    def _read(self, offset: int) -> Dict:
+        if self._reader is None:
+            self._reader = open(self.path, 'rb')
+        self._reader.seek(offset)
+        return json.loads(self._reader.readline())
+
+    def _page(self, offsets: array | None, page: int, page_size: int) -> Tuple[List[Dict], int]:
+        if not offsets:
+            return [], 0
+        page, page_size = max(page, 1), max(page_size, 1)
+        end = len(offsets) - (page - 1) * page_size
+        start = max(end - page_size, 0)
+        return [self._read(offsets[i]) for i in range(end - 1, start - 1, -1)], len(offsets)
+
+    def user_orders(self, user_id: int, page: int = 1, page_size: int = 20) -> Tuple[List[Dict], int]:
+        """Return one page of a user's orders, newest first, and how many they have in total."""
+        with self.lock:
+            return self._page(self._by_user.get(user_id), page, page_size)
+
+    def day_orders(self, date: datetime.date, page: int = 1, page_size: int = 20) -> Tuple[List[Dict], int]:
+        """Return one page of the orders placed on a (UTC) day, newest first, and the day's total count."""
+        with self.lock:
+            return self._page(self._by_day.get((date - _EPOCH).days), page, page_size)
+
+    def revenue_by_day(self, start: datetime.date, end: datetime.date) -> List[Tuple[datetime.date, int, int]]:
+        """Return (day, revenue in kobo, order count) for every day from `start` to `end` inclusive that had orders."""
+        first, last = (start - _EPOCH).days, (end - _EPOCH).days
+        with self.lock:
+            if last - first > len(self._revenue_by_day):
+                days = sorted(day for day in self._revenue_by_day if first <= day <= last)
+            else:
+                days = [day for day in range(first, last + 1) if day in self._revenue_by_day]
+            return [(_date(day), self._revenue_by_day[day], len(self._by_day[day])) for day in days]
+
+    def close(self) -> None:
+        with self.lock:
+            for f in (self._writer, self._reader):
+                if f is not None:
+                    f.close()
+            self._writer = self._reader = None
+
+
+order_log = OrderLog()
+# Cleared while the order log is loaded on a background thread (see
+# startup.load_store); checkouts and order queries wait until it is set
+order_log_ready = threading.Event()
+order_log_ready.set()
+_id_lock = threading.Lock()
+_last_issued = 0
+
+
+def next_transaction_id() -> str:
+    """
+    Return a new transaction id, e.g. "TXN117461302755328".
+
+    Ids are unique and strictly increasing, also across restarts (they
+    continue after the last id in the order log even if the clock went
+    back), and sort in the order the transactions were issued.
+    """
+    global _last_issued
+    with _id_lock:
+        _last_issued = max(_last_issued + 1, order_log.last_number + 1, int(time.time() * 1000) << SEQUENCE_BITS)
+        return f"TXN{_last_issued}"
+
+
+def user_orders(user_id: int, page: int = 1, page_size: int = 20) -> Tuple[List[Dict], int]:
+    """
+    Return one page of a user's orders, newest first.
+
+    :param user_id: Id of the user the orders were placed by (see models.user.User)
+    :param page: 1-based page number
+    :param page_size: Orders per page
+    :return: (orders on the page, total number of orders of the user)
+    """
+    order_log_ready.wait()
+    backend = get_backend()
+    if backend is not None:
+        page, page_size = max(page, 1), max(page_size, 1)
+        return (backend.load_orders(user_id, (page - 1) * page_size, page_size),
+                backend.count_orders(user_id))
+    return order_log.user_orders(user_id, page, page_size)
+
+
+def revenue_by_day(start: datetime.date, end: datetime.date) -> List[Tuple[datetime.date, int, int]]:
+    """
+    Return (day, revenue in kobo, order count) for each UTC day from `start`
+    to `end` inclusive on which orders were placed.
+    """
+    order_log_ready.wait()
+    backend = get_backend()
+    if backend is not None:
+        rows = backend.revenue_by_day((start - _EPOCH).days * SECONDS_PER_DAY,
+                                      ((end - _EPOCH).days + 1) * SECONDS_PER_DAY)
+        return [(_date(day), revenue, count) for day, revenue, count in rows]
+    return order_log.revenue_by_day(start, end)
@@ -1,8 +1,14 @@
+from .base import SlottedModel
+
 products = []
 
-class Product:
+class Product(SlottedModel):
+    """A catalog product; `price` is in kobo."""
+
+    __slots__ = ('id', 'name', 'price', 'stock')
+
     def __init__(self, id, name, price, stock=10):
         self.id = id
         self.name = name
         self.price = price
-        self.stock = stock
\ No newline at end of file
+        self.stock = stock
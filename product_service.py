@@ -1,48 +1,316 @@
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Set, Tuple
+
+from ..models.product import Product
+from ..services import metrics
 from ..utils.helpers import ensure_data_directory
+from ..services.catalog import build_catalog, add_product, all_products, get_product, remove_products, \
+    prepare_catalog, install_catalog, product_count
+from ..services.inventory import all_stripes_locked
+from ..services.orders import order_log
+from ..services.search import build_index, index_products, unindex_products, prepare_index, install_index, \
+    index_lock
+from ..services.storage import get_backend
+from ..services.warehouse_state import sku_registry, stock_ledger
+from ..utils.money import to_kobo
+
+# Stock of a product before any units are received or sold
+DEFAULT_STOCK = 10
+
+# Warehouse files are read this many characters at a time
+READ_CHUNK_SIZE = 1 << 20
+# A progressive load publishes products to the catalog and search index in
+# batches of this many
+PROGRESSIVE_BATCH_SIZE = 10_000
+
+# When enabled, warehouse files that have not changed since they were last
+# parsed are loaded from the SKU registry's snapshot, which holds their items
+# (see warehouse_state.SkuRegistry), instead of being parsed again.
+snapshot_catalog: bool = True
 
+_files_parsed = metrics.counter('ecommerce_warehouse_files_parsed_total', "Warehouse files parsed from text")
+_files_from_snapshot = metrics.counter('ecommerce_warehouse_files_from_snapshot_total',
+                                       "Warehouse files loaded from the catalog snapshot")
+_synced_products = metrics.counter('ecommerce_synced_products_total',
+                                   "Products added, repriced or removed by sync_warehouses")
 
-def load_products() -> None:
+
+def find_warehouse_files() -> List[str]:
     """
-     Load products from all warehouse*.txt files in data directory.
+    Find all warehouse*.txt files in the data directory.
 
-     File format: name1:price1;name2:price2;...
-     Assigns sequential IDs and default stock of 10 to each product.
-     Skips empty files and malformed entries.
-     """
-    global products
-    products = []
+    :return: Paths sorted by file name, so the catalog lists products in a stable order
+    """
     ensure_data_directory()
+    return [
+        os.path.join('data', file)
+        for file in sorted(os.listdir('data'))
+        if file.startswith('warehouse') and file.endswith('.txt')
+    ]
+
+
+def _parse_item(item: str) -> Tuple[str, int] | None:
+    item = item.strip()
+    if not item:
+        return None
+    try:
+        name, price = item.split(':')
+        return name.strip(), to_kobo(price.strip())
+    except ValueError:
+        return None
+
+
+def iter_warehouse_items(file_path: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Tuple[str, int]]:
+    """
+    Stream (name, price in kobo) pairs from a warehouse file.
+
+    The file is read in chunks of `chunk_size` characters, so memory use does
+    not depend on the file size. Malformed entries are skipped.
+
+    :param file_path: Path of a file in the format name1:price1;name2:price2;...
+    :param chunk_size: Number of characters to read at a time
+    :return: Iterator of (name, price) tuples in file order
+    """
+    remainder = ''
+    with open(file_path, 'r') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            items = (remainder + chunk).split(';')
+            # The last piece may be cut off mid-item; keep it for the next chunk
+            remainder = items.pop()
+            for item in items:
+                parsed = _parse_item(item)
+                if parsed is not None:
+                    yield parsed
+    parsed = _parse_item(remainder)
+    if parsed is not None:
+        yield parsed
+
+
+def _parse_warehouse_file(file_path: str) -> List[Tuple[str, int]]:
+    """Parse a whole warehouse file; runs in a worker process when loading in parallel."""
+    try:
+        return list(iter_warehouse_items(file_path))
+    except FileNotFoundError:
+        return []
 
-    # Find all warehouse files
-    warehouse_files = []
-    for file in os.listdir('data'):
-        if file.startswith('warehouse') and file.endswith('.txt'):
-            warehouse_files.append(os.path.join('data', file))
 
-    # Load products from each file
-    product_id = 1
+def iter_products(parallel: bool = False, workers: int | None = None) -> Iterator[Product]:
+    """
+    Stream products from all warehouse files.
+
+    Ids come from the SKU registry (see services.warehouse_state), so an
+    item keeps its id across restarts and edits to the warehouse files.
+    They are the same whether or not the files are parsed in parallel. Stock
+    is the default stock plus the units received less the units sold.
+    With snapshot_catalog, files that have not changed since they were last
+    parsed are not parsed again; their items come from the registry.
+
+    :param parallel: Parse the files concurrently in a process pool
+    :param workers: Maximum number of worker processes (default: CPU count)
+    :return: Iterator of Product objects
+    """
+    warehouse_files = find_warehouse_files()
+    for file_path in list(sku_registry.files):
+        if file_path not in warehouse_files:
+            sku_registry.forget(file_path)
+
+    cached: Set[str] = set()
+    if snapshot_catalog:
+        for file_path in warehouse_files:
+            try:
+                if sku_registry.is_unchanged(file_path):
+                    cached.add(file_path)
+            except FileNotFoundError:
+                continue
+    to_parse = [file_path for file_path in warehouse_files if file_path not in cached]
+    _files_parsed.inc(len(to_parse))
+    _files_from_snapshot.inc(len(cached))
+
+    if parallel and len(to_parse) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # map() yields results in input order, which keeps the ids deterministic
+            parsed_files = pool.map(_parse_warehouse_file, to_parse)
+            yield from _number_products(_read_files(warehouse_files, cached, lambda _: next(parsed_files)))
+    else:
+        yield from _number_products(_read_files(warehouse_files, cached, iter_warehouse_items))
+
+
+def _read_files(warehouse_files: List[str], cached: Set[str], parse: Callable[[str], Iterable[Tuple[str, int]]]
+                ) -> Iterator[Tuple[str, Iterable[Tuple[int, str, int]]]]:
     for file_path in warehouse_files:
+        if file_path in cached:
+            yield file_path, sku_registry.items(file_path)
+        else:
+            yield file_path, sku_registry.assign(file_path, parse(file_path))
+
+
+def _number_products(numbered_files: Iterable[Tuple[str, Iterable[Tuple[int, str, int]]]]) -> Iterator[Product]:
+    # A file that disappears after find_warehouse_files is skipped like before
+    received, sold = stock_ledger.received, order_log.units_sold
+    for file_path, items in numbered_files:
         try:
-            with open(file_path, 'r') as f:
-                content = f.read().strip()
-                if not content:
-                    continue
+            for product_id, name, price in items:
+                stock = DEFAULT_STOCK + received.get(product_id, 0) - sold.get(product_id, 0)
+                yield Product(product_id, name, price, max(stock, 0))
+        except FileNotFoundError:
+            continue
 
-                items = content.split(';')
-                for item in items:
-                    if not item:
-                        continue
-                    try:
-                        name, price = item.split(':')
-                        products.append({
-                            'id': product_id,
-                            'name': name.strip(),
-                            'price': float(price.strip()),
-                            'stock': 10  # Default stock
-                        })
-                        product_id += 1
-                    except ValueError:
+
+def _stock(product_id: int) -> int:
+    return max(DEFAULT_STOCK + stock_ledger.received.get(product_id, 0)
+               - order_log.units_sold.get(product_id, 0), 0)
+
+
+@metrics.timed('ecommerce_load_products_seconds', "Time to load the catalog and build the search index")
+def load_products(parallel: bool = False, workers: int | None = None, progressive: bool = False) -> None:
+    """
+     Load products from all warehouse*.txt files in data directory.
+
+     File format: name1:price1;name2:price2;...
+     Ids and stock are assigned as described in iter_products. The units
+     sold are taken from the order log (see services.orders), which must
+     already be loaded (see checkout_service.recover_orders).
+     Skips empty files and malformed entries. The loaded products replace
+     the catalog contents (see services.catalog) and the search index is
+     rebuilt over them (see services.search).
+     Files are streamed rather than read whole; with `parallel` they are
+     parsed concurrently in a process pool. Files that have not changed since
+     the last load are read from the catalog snapshot instead (see
+     iter_products).
+     With `progressive` the catalog and index are emptied first and products
+     are added to both every PROGRESSIVE_BATCH_SIZE products, so they can be
+     searched and bought while the rest are still loading (e.g. when this
+     runs on a background thread).
+     If a storage backend is configured (see services.storage), products are
+     read from it instead of the warehouse files.
+     """
+    backend = get_backend()
+    if backend is not None:
+        items = backend.load_products()
+    else:
+        sku_registry.load()
+        stock_ledger.load()
+        items = iter_products(parallel, workers)
+    if not progressive:
+        build_catalog(items)
+        build_index(all_products())
+    else:
+        build_catalog(())
+        build_index(())
+        batch: List[Product] = []
+        for product in items:
+            batch.append(product)
+            if len(batch) >= PROGRESSIVE_BATCH_SIZE:
+                _publish(batch)
+                batch = []
+        _publish(batch)
+    if backend is None:
+        sku_registry.save()
+
+
+def _publish(batch: List[Product]) -> None:
+    for product in batch:
+        add_product(product)
+    index_products(batch)
+
+
+# Serializes sync_warehouses, reload_products and catalog_ops.reprice, which
+# all write product prices
+sync_lock = threading.Lock()
+
+
+@metrics.timed('ecommerce_reload_products_seconds', "Time to rebuild and swap in the catalog")
+def reload_products(parallel: bool = False, workers: int | None = None) -> int:
+    """
+    Rebuild the catalog and search index and swap them in while the store keeps serving.
+
+    Everything is re-read (see load_products) into a new catalog and index
+    off to the side. Then, with searches and every inventory stripe briefly
+    locked, products still in the catalog take over their live stock (so
+    reservations and sales in flight are kept), and both are replaced in
+    one step. Sessions see either the old or the new catalog, never a mix.
+    Prices are taken from the source again, which undoes in-memory
+    repricing (see catalog_ops.reprice) in text file mode.
+
+    :param parallel: Parse the warehouse files concurrently (see iter_products)
+    :param workers: Maximum number of worker processes
+    :return: Number of products in the new catalog
+    """
+    backend = get_backend()
+    with sync_lock:
+        if backend is not None:
+            items = backend.load_products()
+        else:
+            sku_registry.load()
+            items = iter_products(parallel, workers)
+        contents = prepare_catalog(items)
+        index = prepare_index(contents)
+        with index_lock, all_stripes_locked():
+            for product in contents:
+                live = get_product(product.id)
+                if live is not None:
+                    product.stock = live.stock
+            install_catalog(contents)
+            install_index(index)
+        if backend is None:
+            sku_registry.save()
+    return product_count()
+
+
+@metrics.timed('ecommerce_sync_warehouses_seconds', "Time to merge warehouse file changes into the catalog")
+def sync_warehouses() -> Tuple[int, int, int]:
+    """
+    Merge changes to the warehouse files into the live catalog without a full reload.
+
+    Only files whose size and modification time changed are read, and of
+    those only the ones whose content hash changed are parsed. New items
+    are added to the catalog and search index, changed prices are updated
+    in place and removed items (also of deleted files) are taken out.
+    Every other product keeps its id, stock and reservations.
+    With a storage backend the warehouse files are not used, so nothing is done.
+
+    :return: (products added, prices changed, products removed)
+    """
+    if get_backend() is not None:
+        return 0, 0, 0
+    with sync_lock:
+        warehouse_files = find_warehouse_files()
+        added: List[Product] = []
+        updated = 0
+        removed_ids: List[int] = []
+        for file_path in list(sku_registry.files):
+            if file_path not in warehouse_files:
+                removed_ids.extend(sku_registry.forget(file_path))
+
+        for file_path in warehouse_files:
+            try:
+                if sku_registry.is_unchanged(file_path):
+                    continue
+                previous_ids = {product_id for _, product_id in sku_registry.skus(file_path)}
+                for product_id, name, price in sku_registry.assign(file_path, iter_warehouse_items(file_path)):
+                    if product_id not in previous_ids:
+                        added.append(Product(product_id, name, price, _stock(product_id)))
                         continue
-        except FileNotFoundError:
-            continue
\ No newline at end of file
+                    previous_ids.discard(product_id)
+                    product = get_product(product_id)
+                    if product is not None and product.price != price:
+                        product.price = price
+                        updated += 1
+            except FileNotFoundError:
+                continue
+            removed_ids.extend(previous_ids)
+
+        # Searches must never find an id the catalog no longer has: take
+        # products out of the index before the catalog, with searches locked
+        with index_lock:
+            unindex_products([product for product in map(get_product, removed_ids) if product is not None])
+            removed = remove_products(removed_ids)
+            _publish(added)
+        sku_registry.save()
+        _synced_products.inc(len(added) + updated + len(removed))
+        return len(added), updated, len(removed)
@@ -1,12 +1,15 @@
 import time
-from typing import List
 
-from ..models.user import current_user
-from ..models.cart import cart
-from ..services.cart_service import view_cart, add_to_cart, update_cart_item, remove_from_cart, clear_cart
-from ..services.product_service import products
+from ..services.cart_service import view_cart, add_to_cart, update_cart_item, remove_from_cart, clear_cart, \
+    checkout_cart, CART_PAGE_SIZE
+from ..services.orders import user_orders
+from ..services.search import search
+from ..services.session import Session
+from ..services.startup import catalog_ready
+from ..utils.money import format_kobo
 
-from ..services.user_service import save_users
+SEARCH_PAGE_SIZE = 20
+ORDERS_PAGE_SIZE = 10
 
 
 def display_purchase_menu():
@@ -18,59 +21,62 @@ def display_purchase_menu():
     print("1. Search Items")
     print("2. Manage Cart")
     print("3. Checkout")
-    print("4. Back to Store Menu")
+    print("4. My Orders")
+    print("5. Back to Store Menu")
 
 
 def search_products():
     """
     Search for products in inventory based on user input.
 
-    Prompts user for search terms and searches through the global products list.
-    Performs case-insensitive partial matching on product names.
-    If multiple search terms are provided, matches products containing ANY of the terms.
+    Prompts user for search terms and looks them up in the product search index
+    (see services.search). Matching is case-insensitive and by word prefix.
+    If multiple search terms are provided, matches products containing ANY of the terms;
+    terms prefixed with '+' are required (e.g. "+red shirt").
+    Results are ranked and shown one page at a time.
 
     Returns:
-        List[Dict]: List of matching product dictionaries. Each product contains:
-                   - 'id': Unique product identifier
-                   - 'name': Product name
-                   - 'price': Product price
-                   - 'stock': Available stock quantity
+        List[Product]: List of matching products on the page the user stopped at.
+                   Each product has:
+                   - id: Unique product identifier
+                   - name: Product name
+                   - price: Product price in kobo
+                   - stock: Available stock quantity
                    Returns empty list if no matches found or invalid input.
 
-    Global Variables:
-        products (List[Dict]): Global inventory list that gets searched
-
     Note:
-        - Performs partial string matching (case-insensitive)
         - Displays formatted search results to console
         - Handles empty input gracefully
-        - Avoids duplicate results when multiple terms match same product
+        - Each matching product appears only once even if several terms match it
     """
     query = input("\nEnter search query: ").strip()
     if not query:
         print("Please enter a search term")
         return []
 
-    search_terms: List[str] = query.split()
-    results = []
-
-    for product in products:
-        for term in search_terms:
-            if term.lower() in product['name'].lower():
-                results.append(product)
+    page: int = 1
+    while True:
+        results, total = search(query, page=page, page_size=SEARCH_PAGE_SIZE)
+        if not catalog_ready.is_set():
+            print("\n(The catalog is still loading; more items may match shortly)")
 
-    if not results:
-        print("\nNo matching items found")
-        return []
+        if not results:
+            print("\nNo matching items found")
+            return []
 
-    print("\n=== Search Results ===")
-    for i, product in enumerate(results, 1):
-        print(f"{i}. {product['name']} - NGN {product['price']:,.2f} ({product['stock']} available)")
+        first: int = (page - 1) * SEARCH_PAGE_SIZE + 1
+        print(f"\n=== Search Results ({first}-{first + len(results) - 1} of {total}) ===")
+        for i, product in enumerate(results, 1):
+            print(f"{i}. {product.name} - NGN {format_kobo(product.price)} ({product.stock} available)")
 
-    return results
+        if first + len(results) - 1 >= total:
+            return results
+        if input("Enter 'n' for the next page, or press Enter to continue: ").strip().lower() != 'n':
+            return results
+        page += 1
 
 
-def handle_search_results(results: list[dict]) -> None:
+def handle_search_results(session: Session, results: list[dict]) -> None:
     """
     Handle user interactions with search results.
 
@@ -80,8 +86,9 @@ def handle_search_results(results: list[dict]) -> None:
     3. Return to the purchase menu
 
     Args:
-        results (list[dict]): List of product dictionaries from search results.
-                            Each product should contain 'id', 'name', 'price', and 'stock' keys.
+        session (Session): Session whose cart the items are added to
+        results (list[Product]): List of products from search results.
+                            Each product should have id, name, price and stock.
 
     Returns:
         None
@@ -103,10 +110,10 @@ def handle_search_results(results: list[dict]) -> None:
                 selection: int = int(input("Enter item number to add: ")) - 1
                 if 0 <= selection < len(results):
                     product = results[selection]
-                    if product['stock'] <= 0:
+                    if product.stock <= 0:
                         print("❌ Item out of stock")
                         continue
-                    add_to_cart(product)
+                    add_to_cart(session, product)
                 else:
                     print("💢 Invalid item number!")
             except ValueError:
@@ -120,81 +127,95 @@ def handle_search_results(results: list[dict]) -> None:
             print("Invalid choice")
 
 
-def handle_cart_management() -> None:
+def handle_cart_management(session: Session) -> None:
     """
     Interactive menu for managing cart items (modify quantity, remove items, clear cart).
 
     Continues until user chooses to exit or cart becomes empty.
+    Large carts are shown one page at a time.
+
+    :param session: Session whose cart is managed
     """
+    cart = session.cart
     print("Handle cart Management")
+    page: int = 1
     while True:
-        total: float = view_cart()
+        total: int = view_cart(session, page)
         if not cart:
             print("Cart is empty! 🛒")
             break
-        if total == 0.0:
+        if total == 0:
             break
 
         print("\n1. Change Quantity")
         print("2. Remove Item")
         print("3. Clear Cart")
         print("4. Back to Purchase Menu")
+        has_more_pages: bool = len(cart) > CART_PAGE_SIZE
+        if has_more_pages:
+            print("n. Next Page / p. Previous Page")
 
-        user_choice: str = input("Enter choice (1-4): ").strip()
+        user_choice: str = input("Enter choice (1-4): ").strip().lower()
 
         if user_choice == "1":
             try:
                 item_id: int = int(input("Enter item number to modify: ")) - 1
                 new_quantity: int = int(input("Enter new quantity: "))
-                update_cart_item(item_id, new_quantity)
+                update_cart_item(session, item_id, new_quantity)
             except ValueError:
                 print("❌ Please enter a valid number")
         elif user_choice == "2":
             try:
                 selected_item_index: int = int(input("Enter item number to remove: ")) - 1
-                remove_from_cart(selected_item_index)
+                remove_from_cart(session, selected_item_index)
             except ValueError:
                 print("❌ Please enter a valid number")
         elif user_choice == "3":
             confirm = input("Are you sure you want to clear the cart? (y/n): ").lower()
             if confirm == 'y':
-                clear_cart()
+                clear_cart(session)
                 break
         elif user_choice == "4":
             break
+        elif has_more_pages and user_choice == "n":
+            page = page + 1 if page * CART_PAGE_SIZE < len(cart) else 1
+        elif has_more_pages and user_choice == "p":
+            page = max(page - 1, 1)
         else:
             print("Invalid choice")
 
 
-def checkout():
+def checkout(session: Session):
     """
     Process checkout for items in cart.
 
     Validates sufficient wallet balance, confirms purchase with user,
     deducts total from balance, and clears cart upon successful purchase.
+
+    :param session: Session of the user checking out
     """
-    global current_user, cart
+    current_user = session.user
 
-    total = view_cart()
+    # The summary is read under the cart lock, but not held over the prompt
+    with session.lock:
+        view_cart(session)
+        total: int = session.cart.recompute_total()
     if total == 0:
         return
 
     print(f"\nOrder Summary:")
-    print(f"Total Amount: NGN {total:,.2f}")
-    print(f"Your Balance: NGN {current_user['balance']:,.2f}")
-    print(f"Balance After Purchase: NGN {current_user['balance'] - total:,.2f}")
+    print(f"Total Amount: NGN {format_kobo(total)}")
+    print(f"Your Balance: NGN {format_kobo(current_user.balance)}")
+    print(f"Balance After Purchase: NGN {format_kobo(current_user.balance - total)}")
 
-    if total > current_user['balance']:
+    if total > current_user.balance:
         print("\nInsufficient funds. Please fund your wallet.")
         return
 
     confirm = input("\nConfirm purchase (y/n): ").strip().lower()
     if confirm == 'y':
         try:
-            transaction_id = f"TXN{int(time.time())}"  # Simple transaction ID to mock real transaction id
-            current_user['balance'] -= total
-            save_users()
-            cart.clear()
+            transaction_id: str = checkout_cart(session)
             print(f"\n✅ Purchase successful! Transaction ID: {transaction_id}")
             print("Thank you for your order. 💳")
         except Exception as e:
@@ -204,28 +225,60 @@ def checkout():
         print("\n❌ Purchase cancelled")
 
 
-def purchase_menu():
+def view_orders(session: Session) -> None:
+    """
+    Show the signed-in user's past orders, newest first, one page at a time.
+
+    :param session: Session of the signed-in user
+    """
+    page: int = 1
+    while True:
+        orders, total = user_orders(session.user.user_id, page=page, page_size=ORDERS_PAGE_SIZE)
+        if not orders:
+            print("\nYou have no orders yet 🧾")
+            return
+
+        first: int = (page - 1) * ORDERS_PAGE_SIZE + 1
+        print(f"\n=== My Orders ({first}-{first + len(orders) - 1} of {total}) ===")
+        for order in orders:
+            placed = time.strftime('%Y-%m-%d %H:%M', time.localtime(order['created_at']))
+            print(f"{order['transaction_id']}  {placed}  NGN {format_kobo(order['total'])}")
+            for item in order['items']:
+                print(f"    {item['name']} x{item['quantity']} - NGN {format_kobo(item['price'] * item['quantity'])}")
+
+        if first + len(orders) - 1 >= total:
+            return
+        if input("Enter 'n' for the next page, or press Enter to go back: ").strip().lower() != 'n':
+            return
+        page += 1
+
+
+def purchase_menu(session: Session):
     """
     Main purchase menu interface.
 
-    Provides options for product search, cart management, checkout, and exit.
+    Provides options for product search, cart management, checkout, order history and exit.
     Continues until user chooses to exit.
+
+    :param session: Session of the signed-in user
     """
     while True:
         display_purchase_menu()
-        purchase_choice: str = input("Enter choice (1-4): ").strip()
+        purchase_choice: str = input("Enter choice (1-5): ").strip()
         if purchase_choice == "1":
             results = search_products()
             if results:
-                handle_search_results(results)
+                handle_search_results(session, results)
         elif purchase_choice == "2":
-            handle_cart_management()
+            handle_cart_management(session)
         elif purchase_choice == "3":
-            if cart:
-                checkout()
+            if session.cart:
+                checkout(session)
             else:
                 print("Your cart is empty! Add items before checkout.")
         elif purchase_choice == "4":
+            view_orders(session)
+        elif purchase_choice == "5":
             break
         else:
-            print("Invalid choice! Please enter 1-4 💢")
+            print("Invalid choice! Please enter 1-5 💢")
@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import List
+
+# Failed sign-ins allowed in a burst per identity, and how fast they come back
+IDENTITY_BURST = 5
+IDENTITY_REFILL_PER_SECOND = 1 / 30
+# Sign-in attempts allowed in a burst per client address, and how fast they come back
+CLIENT_BURST = 20
+CLIENT_REFILL_PER_SECOND = 1.0
+# Buckets kept per limiter (see TokenBucketLimiter)
+MAX_BUCKETS = 100_000
+
+
+class TokenBucketLimiter:
+    """
+    One token bucket per key, e.g. per username or client address.
+
+    Each bucket holds up to `burst` tokens and refills at `refill_per_second`.
+    A bucket that has been idle long enough to be full is the same as one
+    that does not exist, so at most `max_buckets` are kept and each call is
+    O(1). To make room the least recently used bucket is dropped, but only
+    once it is full again: while every bucket is still refilling, new keys
+    are not tracked, so rotating through keys cannot reset throttled ones.
+    """
+
+    def __init__(self, burst: float, refill_per_second: float, max_buckets: int = MAX_BUCKETS):
+        self.burst = burst
+        self.refill_per_second = refill_per_second
+        self.max_buckets = max_buckets
+        # key -> [tokens, time.monotonic() they were counted at], least recently used first
+        self._buckets: 'OrderedDict[str, List[float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _refilled(self, key: str, now: float) -> List[float] | None:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if not self._make_room(now):
+                return None
+            bucket = self._buckets[key] = [self.burst, now]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.refill_per_second)
+            bucket[1] = now
+        return bucket
+
+    def _make_room(self, now: float) -> bool:
+        """Drop least recently used buckets that are full again; return False if there is still no room."""
+        while len(self._buckets) >= self.max_buckets:
+            key, (tokens, counted_at) = next(iter(self._buckets.items()))
+            if tokens + (now - counted_at) * self.refill_per_second < self.burst:
+                return False
+            del self._buckets[key]
+        return True
+
+    def take(self, key: str) -> float:
+        """
+        Take a token for `key`.
+
+        :return: 0.0 if a token was taken (or `key` is not tracked, see above),
+                 otherwise the seconds until one is available (nothing is taken)
+        """
+        with self._lock:
+            bucket = self._refilled(key, time.monotonic())
+            if bucket is None:
+                return 0.0
+            if bucket[0] < 1:
+                return (1 - bucket[0]) / self.refill_per_second
+            bucket[0] -= 1
+            return 0.0
+
+    def wait(self, key: str) -> float:
+        """Return the seconds until `key` has a token, without taking it (0.0 if it has one)."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return 0.0
+            tokens = bucket[0] + (time.monotonic() - bucket[1]) * self.refill_per_second
+            return 0.0 if tokens >= 1 else (1 - tokens) / self.refill_per_second
+
+    def reset(self, key: str) -> None:
+        """Refill `key`'s bucket."""
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+identity_limiter = TokenBucketLimiter(IDENTITY_BURST, IDENTITY_REFILL_PER_SECOND)
+client_limiter = TokenBucketLimiter(CLIENT_BURST, CLIENT_REFILL_PER_SECOND)
+
+
+def sign_in_wait(identity: str, client: str | None = None) -> float:
+    """
+    Check whether a sign-in attempt may go ahead, counting it against the client address if known.
+
+    Called before the password is checked, so throttled attempts cost no
+    password hashing. Every attempt counts against the client, so trying
+    many accounts from one address is slowed down. Only failed attempts
+    count against the identity (see record_sign_in), so knowing a username
+    is not enough to lock its owner out.
+
+    :param identity: Username or email being signed in to
+    :param client: Address the attempt comes from, e.g. the API peer
+    :return: 0.0 if the attempt may go ahead, otherwise the seconds to wait
+    """
+    if client is not None:
+        wait = client_limiter.take(client)
+        if wait:
+            return wait
+    return identity_limiter.wait(identity.strip().lower())
+
+
+def record_sign_in(identity: str, succeeded: bool) -> None:
+    """
+    Count a failed sign-in against the identity, or clear its count after a successful one.
+
+    :param identity: Username or email that was signed in to
+    :param succeeded: Whether the password was right
+    """
+    key = identity.strip().lower()
+    if succeeded:
+        identity_limiter.reset(key)
+    else:
+        identity_limiter.take(key)
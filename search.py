@@ -0,0 +1,297 @@
+import bisect
+import heapq
+import re
+import threading
+from array import array
+from typing import Callable, Dict, Iterable, Iterator, List, Set, Tuple
+
+from ..services import metrics
+from ..services.catalog import get_product, SPARSE_ID_RATIO, SPARSE_ID_SLACK
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# token -> ids of the products whose name contains that token
+_postings: Dict[str, Set[int]] = {}
+# every indexed token in sorted order, used for prefix lookups
+_sorted_tokens: List[str] = []
+
+
+# A product's rank key holds its id in this many low bits (enough for any id
+# the SKU registry has handed out) and its name length, capped at
+# MAX_RANKED_NAME_LENGTH, above them
+RANK_ID_BITS = 53
+MAX_RANKED_NAME_LENGTH = (1 << (63 - RANK_ID_BITS)) - 1
+RANK_ID_MASK = (1 << RANK_ID_BITS) - 1
+
+
+class RankKeys:
+    """
+    Rank key per product id: shorter name first, then lower id, as one integer.
+
+    Searches order results by these without fetching products. Keys are
+    kept in an array indexed by id while ids are dense, as the SKU registry
+    keeps them, and in a dict for ids far beyond that (see
+    catalog.ColumnarCatalog). Keys of removed products are left behind; they
+    are overwritten if the id is indexed again.
+    """
+
+    __slots__ = ('dense', 'sparse')
+
+    def __init__(self):
+        self.dense = array('q')
+        self.sparse: Dict[int, int] = {}
+
+    def set(self, product_id: int, name: str) -> None:
+        key = min(len(name), MAX_RANKED_NAME_LENGTH) << RANK_ID_BITS | product_id
+        if 0 <= product_id < len(self.dense):
+            self.dense[product_id] = key
+        elif 0 <= product_id <= SPARSE_ID_RATIO * len(self.dense) + SPARSE_ID_SLACK:
+            self.dense.extend(array('q', [0]) * (product_id + 1 - len(self.dense)))
+            self.dense[product_id] = key
+        else:
+            self.sparse[product_id] = key
+
+    def get(self, product_id: int) -> int:
+        if 0 <= product_id < len(self.dense):
+            return self.dense[product_id]
+        return self.sparse.get(product_id, product_id)
+
+    def getter(self) -> Callable[[int], int]:
+        """Return the fastest function mapping an indexed id to its key."""
+        return self.get if self.sparse else self.dense.__getitem__
+
+
+# Rank key of every indexed product
+_rank_keys = RankKeys()
+# Guards the three structures above, so products can be indexed while searches run.
+# Hold it to make several changes to the index atomic with respect to searches.
+index_lock = threading.RLock()
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase alphanumeric tokens.
+
+    :param text: Product name or search query
+    :return: List of tokens in the order they appear
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def prepare_index(items: Iterable) -> Tuple[Dict[str, Set[int]], List[str], RankKeys]:
+    """Build a new index over the given products without touching the live one."""
+    postings: Dict[str, Set[int]] = {}
+    rank_keys = RankKeys()
+    for product in items:
+        name = product.name
+        rank_keys.set(product.id, name)
+        for token in tokenize(name):
+            postings.setdefault(token, set()).add(product.id)
+    return postings, sorted(postings), rank_keys
+
+
+def install_index(index: Tuple[Dict[str, Set[int]], List[str], RankKeys]) -> None:
+    """Make a prepared index the live one. Hold index_lock to swap it together with the catalog."""
+    global _postings, _sorted_tokens, _rank_keys
+    with index_lock:
+        _postings, _sorted_tokens, _rank_keys = index
+
+
+def build_index(items: Iterable) -> None:
+    """
+    Rebuild the inverted index over product names.
+
+    Searches keep using the old index until the new one is complete.
+
+    :param items: Products (see models.product.Product)
+    :return: None
+    """
+    install_index(prepare_index(items))
+
+
+def index_product(product) -> None:
+    """
+    Add a single product to the index without a full rebuild.
+
+    :param product: Product (see models.product.Product)
+    :return: None
+    """
+    with index_lock:
+        _rank_keys.set(product.id, product.name)
+        for token in tokenize(product.name):
+            ids = _postings.get(token)
+            if ids is None:
+                _postings[token] = {product.id}
+                bisect.insort(_sorted_tokens, token)
+            else:
+                ids.add(product.id)
+
+
+def index_products(items: Iterable) -> None:
+    """
+    Add a batch of products to the index without a full rebuild.
+
+    New tokens are merged into the sorted token list once for the whole batch.
+
+    :param items: Products (see models.product.Product)
+    :return: None
+    """
+    with index_lock:
+        new_tokens: Set[str] = set()
+        for product in items:
+            _rank_keys.set(product.id, product.name)
+            for token in tokenize(product.name):
+                ids = _postings.get(token)
+                if ids is None:
+                    _postings[token] = {product.id}
+                    new_tokens.add(token)
+                else:
+                    ids.add(product.id)
+        if new_tokens:
+            _sorted_tokens[:] = list(heapq.merge(_sorted_tokens, sorted(new_tokens)))
+
+
+def unindex_products(items: Iterable) -> None:
+    """
+    Remove a batch of products from the index.
+
+    :param items: Products (see models.product.Product) that are in the index
+    :return: None
+    """
+    with index_lock:
+        emptied: Set[str] = set()
+        for product in items:
+            for token in tokenize(product.name):
+                ids = _postings.get(token)
+                if ids is not None:
+                    ids.discard(product.id)
+                    if not ids:
+                        del _postings[token]
+                        emptied.add(token)
+        if emptied:
+            _sorted_tokens[:] = [token for token in _sorted_tokens if token not in emptied]
+
+
+def _prefix_matches(term: str) -> Set[int]:
+    """Return the ids of products having any token that starts with `term`."""
+    start = bisect.bisect_left(_sorted_tokens, term)
+    matches: Set[int] = set()
+    for i in range(start, len(_sorted_tokens)):
+        token = _sorted_tokens[i]
+        if not token.startswith(term):
+            break
+        matches |= _postings[token]
+    return matches
+
+
+@metrics.timed('ecommerce_search_seconds', "Time to run a product search")
+def search(query: str, match_all: bool = False, page: int = 1, page_size: int = 20) -> Tuple[List[Dict], int]:
+    """
+    Search product names using the inverted index.
+
+    Every query term is matched as a prefix of the tokens in a product name,
+    case-insensitively. Terms written with a leading '+' are required; the
+    remaining terms are optional and only improve the ranking, unless
+    `match_all` is set, in which case every term is required. A query without
+    any required term returns products matching ANY of the terms.
+
+    Results are de-duplicated and ranked by number of matched terms, then
+    by number of exact (whole token) matches, then by shorter name, then by id.
+
+    Args:
+        query (str): Raw search query, e.g. "red +shirt"
+        match_all (bool): Require every term to match (AND semantics)
+        page (int): 1-based page number
+        page_size (int): Number of results per page
+
+    Returns:
+        Tuple[List[Dict], int]: The products on the requested page and the
+                                total number of matching products
+    """
+    required: List[str] = []
+    optional: List[str] = []
+    for raw_term in query.split():
+        is_required = match_all or raw_term.startswith('+')
+        for term in tokenize(raw_term):
+            (required if is_required else optional).append(term)
+
+    if not required and not optional:
+        return [], 0
+
+    with index_lock:
+        return _search(required, optional, page, page_size)
+
+
+def _search(required: List[str], optional: List[str], page: int, page_size: int) -> Tuple[List[Dict], int]:
+    matches_by_term: Dict[str, Set[int]] = {}
+    for term in required + optional:
+        if term not in matches_by_term:
+            matches_by_term[term] = _prefix_matches(term)
+
+    if required:
+        # Intersect starting from the smallest set to keep the work minimal
+        required_sets = sorted((matches_by_term[t] for t in required), key=len)
+        candidates = set(required_sets[0])
+        for ids in required_sets[1:]:
+            candidates &= ids
+            if not candidates:
+                return [], 0
+    else:
+        candidates = set()
+        for ids in matches_by_term.values():
+            candidates |= ids
+
+    total = len(candidates)
+    if page < 1 or page_size < 1 or total == 0:
+        return [], total
+
+    # Rank by the number of matched terms, then of exact matches: split the
+    # candidates into tiers of equal counts with set operations, and order
+    # only the tiers the page reaches by their rank keys. Every candidate
+    # matches the required terms, so only the optional ones tell tiers apart.
+    wanted = page * page_size
+    key = _rank_keys.getter()
+    ranked: List[int] = []
+    optional_sets = [ids for term, ids in matches_by_term.items() if term not in required]
+    exact_sets = [_postings.get(term, set()) for term in matches_by_term]
+    for matched in _tiers(optional_sets, candidates):
+        for tier in _tiers(exact_sets, matched):
+            ranked += _smallest_keys(map(key, tier), wanted - len(ranked))
+            if len(ranked) >= wanted:
+                break
+        if len(ranked) >= wanted:
+            break
+    page_ids = [ranked_key & RANK_ID_MASK for ranked_key in ranked[(page - 1) * page_size:]]
+    return [get_product(product_id) for product_id in page_ids], total
+
+
+def _tiers(sets: List[Set[int]], ids: Set[int]) -> Iterator[Set[int]]:
+    """
+    Yield the `ids` in all of `sets`, then those in all but one, and so on down to those in none.
+
+    The first tier usually fills a page, so the others are only worked out if asked for.
+    """
+    top = ids
+    for other in sorted(sets, key=len):
+        top = top & other
+    yield top
+    if not sets:
+        return
+    # at_least[n]: the ids in at least n of the sets seen so far
+    at_least = [ids]
+    for other in sets:
+        at_least.append(set())
+        for count in range(len(at_least) - 1, 0, -1):
+            at_least[count] |= at_least[count - 1] & other
+    for count in range(len(sets) - 1, -1, -1):
+        yield at_least[count] - at_least[count + 1]
+
+
+def _smallest_keys(keys: Iterable[int], count: int) -> List[int]:
+    """Return the `count` smallest keys in increasing order."""
+    keys = list(keys)
+    if len(keys) <= count:
+        keys.sort()
+        return keys
+    heapq.heapify(keys)
+    return [heapq.heappop(keys) for _ in range(count)]
@@ -0,0 +1,151 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+from ..models.cart import Cart
+from ..models.user import User
+from ..services import inventory
+
+# Sessions idle for longer than this many seconds are evicted
+SESSION_TTL = 30 * 60
+# At most this many sessions are kept; the least recently used is evicted first
+MAX_SESSIONS = 100_000
+# After the user re-enters their password, sensitive account actions skip the
+# password prompt for this many seconds
+VERIFIED_TTL = 5 * 60
+
+
+class Session:
+    """
+    State of one shopper: the signed-in user and their cart.
+
+    Stock for the cart is reserved in the inventory under the session token,
+    so it must be taken and returned through reserve/release. Reservations
+    that are not renewed expire and go back on sale; checkout takes such
+    units from stock again if they are still available.
+
+    Hold `lock` while changing the cart or checking it out: the API runs a
+    shopper's requests on different threads, and checkout must not clear
+    lines that were added after it read the cart.
+    """
+
+    __slots__ = ('token', 'user', 'cart', 'last_seen', 'verified_until', 'lock')
+
+    def __init__(self, token: str, user: User | None = None):
+        self.token = token
+        self.user: User | None = user
+        self.cart = Cart()
+        self.last_seen = time.monotonic()
+        # time.monotonic() until which the user counts as recently verified
+        self.verified_until = 0.0
+        self.lock = threading.RLock()
+
+    def mark_verified(self, ttl: float = VERIFIED_TTL) -> None:
+        """Record that the user just confirmed their password."""
+        self.verified_until = time.monotonic() + ttl
+
+    def recently_verified(self) -> bool:
+        return time.monotonic() < self.verified_until
+
+    @property
+    def reservations(self) -> Dict[int, int]:
+        """Product id -> units currently reserved for this session."""
+        return inventory.held(self.token)
+
+    def reserve(self, product_id: int, quantity: int) -> bool:
+        """Take `quantity` units out of stock for this session's cart."""
+        return inventory.reserve(self.token, product_id, quantity)
+
+    def release(self, product_id: int, quantity: int) -> None:
+        """Return `quantity` previously reserved units to stock."""
+        inventory.release(self.token, product_id, quantity)
+
+    def release_all(self) -> None:
+        """Return every reserved unit to stock."""
+        inventory.release_all(self.token)
+
+    def commit_reservations(self) -> bool:
+        """
+        Mark the stock for every cart line as sold, e.g. at checkout.
+
+        :return: False if some of it expired and is no longer in stock,
+                 in which case nothing is sold
+        """
+        wanted: Dict[int, int] = {item.product_id: item.quantity for item in self.cart}
+        return inventory.commit(self.token, wanted)
+
+    def sign_out(self) -> None:
+        """Forget the user and empty the cart, returning its stock, once no checkout is in flight."""
+        with self.lock:
+            self.release_all()
+            self.cart.clear()
+            self.user = None
+            self.verified_until = 0.0
+
+
+class SessionStore:
+    """
+    In-memory sessions keyed by token, in least-recently-used order.
+
+    Sessions idle for longer than `ttl` seconds, or beyond the `max_sessions`
+    most recently used ones, are evicted and their reserved stock released.
+    Eviction only looks at the oldest entries, so each call is O(1) amortized.
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL, max_sessions: int = MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: 'OrderedDict[str, Session]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def create(self, user: User | None = None) -> Session:
+        session = Session(secrets.token_urlsafe(32), user)
+        with self._lock:
+            self._sessions[session.token] = session
+            evicted = self._evict(time.monotonic())
+        _sign_out(evicted)
+        return session
+
+    def get(self, token: str) -> Session | None:
+        """Return the live session for `token` and mark it as used, or None."""
+        now = time.monotonic()
+        with self._lock:
+            evicted = self._evict(now)
+            session = self._sessions.get(token)
+            if session is not None:
+                session.last_seen = now
+                self._sessions.move_to_end(token)
+        _sign_out(evicted)
+        return session
+
+    def remove(self, token: str) -> None:
+        with self._lock:
+            session = self._sessions.pop(token, None)
+        if session is not None:
+            session.sign_out()
+
+    def _evict(self, now: float) -> List[Session]:
+        """Drop expired and surplus sessions and return them, to be signed out once the store is unlocked."""
+        evicted = []
+        while self._sessions:
+            token, oldest = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - oldest.last_seen <= self.ttl:
+                break
+            del self._sessions[token]
+            evicted.append(oldest)
+        return evicted
+
+
+def _sign_out(evicted: List[Session]) -> None:
+    # Signing out waits for a checkout in flight (see Session.lock), which
+    # must not hold up every other session lookup
+    for session in evicted:
+        session.sign_out()
+
+
+sessions = SessionStore()
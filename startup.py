@@ -0,0 +1,124 @@
+import os
+import signal
+import threading
+
+from ..services import user_service
+from ..services.checkout_service import recover_orders
+from ..services.orders import order_log_ready
+from ..services.product_service import load_products, reload_products, sync_warehouses
+from ..services.storage import get_backend
+
+# Set to a non-empty value other than 0 to start lazily (see load_store)
+LAZY_STARTUP_ENV = 'ECOMMERCE_LAZY_STARTUP'
+
+# How often the catalog watcher looks for changed warehouse files, in seconds
+CATALOG_WATCH_INTERVAL = 10.0
+
+# Set once the whole catalog is loaded
+catalog_ready = threading.Event()
+
+_watcher: threading.Thread | None = None
+_watcher_stop = threading.Event()
+
+
+def load_store(lazy: bool | None = None) -> None:
+    """
+    Load the users, orders and products the app starts with.
+
+    Normally everything is loaded before returning. A lazy start does not
+    wait for the users or the catalog: users are looked up by key when they
+    sign in and kept in a bounded cache (user_service.lazy_users with a
+    storage backend, user_service.binary_accounts otherwise), and the catalog
+    is loaded progressively on a background thread, so products appear in
+    searches as they are loaded. catalog_ready is set once it is complete.
+    The same thread first indexes the order log, as the stock of every
+    product depends on it; checkouts and order queries wait for that (see
+    orders.order_log_ready).
+
+    :param lazy: Start lazily (default: whether ECOMMERCE_LAZY_STARTUP is set)
+    :return: None
+    """
+    if lazy is None:
+        lazy = os.environ.get(LAZY_STARTUP_ENV, '') not in ('', '0')
+    catalog_ready.clear()
+    if not lazy:
+        user_service.load_users()
+        recover_orders()
+        load_products()
+        catalog_ready.set()
+        return
+
+    if get_backend() is not None:
+        user_service.lazy_users = True
+    else:
+        user_service.binary_accounts = True
+    user_service.load_users()
+    order_log_ready.clear()
+    threading.Thread(target=_load_catalog, name='catalog-loader', daemon=True).start()
+
+
+def _load_catalog() -> None:
+    try:
+        try:
+            recover_orders()
+        finally:
+            order_log_ready.set()
+        load_products(progressive=True)
+    finally:
+        catalog_ready.set()
+
+
+def _watch(interval: float) -> None:
+    catalog_ready.wait()
+    while not _watcher_stop.wait(interval):
+        try:
+            sync_warehouses()
+        except OSError as e:
+            print(f"Could not sync the warehouse files: {e}")
+
+
+def start_catalog_watcher(interval: float = CATALOG_WATCH_INTERVAL) -> None:
+    """
+    Merge changes to the warehouse files into the live catalog every `interval` seconds.
+
+    Runs on a background thread, starting once the catalog is loaded. Each
+    check only stats the files; see product_service.sync_warehouses.
+    """
+    global _watcher
+    if _watcher is not None and _watcher.is_alive():
+        return
+    _watcher_stop.clear()
+    _watcher = threading.Thread(target=_watch, args=(interval,), name='catalog-watcher', daemon=True)
+    _watcher.start()
+
+
+def stop_catalog_watcher() -> None:
+    global _watcher
+    _watcher_stop.set()
+    if _watcher is not None:
+        _watcher.join()
+        _watcher = None
+
+
+def _reload() -> None:
+    catalog_ready.wait()
+    try:
+        reload_products()
+    except OSError as e:
+        print(f"Could not reload the catalog: {e}")
+
+
+def install_reload_signal() -> bool:
+    """
+    Rebuild and swap in the whole catalog (see product_service.reload_products) on SIGHUP.
+
+    Call from the main thread. The reload runs on a background thread, so
+    the store keeps serving meanwhile.
+
+    :return: False if the platform has no SIGHUP
+    """
+    if not hasattr(signal, 'SIGHUP'):
+        return False
+    signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(
+        target=_reload, name='catalog-reload', daemon=True).start())
+    return True
@@ -0,0 +1,367 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Tuple
+
+from ..models.product import Product
+from ..models.user import User
+from ..utils.helpers import ensure_data_directory
+
+# Set to a database path to use SQLite instead of the text files in data/
+SQLITE_PATH_ENV = 'ECOMMERCE_SQLITE_PATH'
+
+
+class StorageBackend(ABC):
+    """
+    Interface for the persistence layer behind user_service and product_service.
+
+    When no backend is configured the services use the text files in data/
+    (accounts.txt, accounts.journal and warehouse*.txt) directly.
+    """
+
+    @abstractmethod
+    def load_users(self) -> List[User]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_user(self, identity: str) -> User | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_users(self, users: Iterable[User]) -> None:
+        """Store users in bulk, overwriting any with the same username and keeping the others."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_user(self, user: User, previous_username: str | None = None) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_user(self, username: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_products(self) -> List[Product]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_products(self, products: Iterable[Product]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_prices(self, prices: Iterable[Tuple[int, int]]) -> None:
+        """Set the price of products, given as (product id, price in kobo), leaving everything else."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_stock(self, units: Iterable[Tuple[int, int]]) -> None:
+        """
+        Add units to (or, if negative, remove them from) the stored stock of products, given as (product id, units).
+
+        Applied as deltas, because stock in memory has the units held in carts
+        taken off while the stored stock does not (see save_checkouts).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def last_user_id(self) -> int:
+        """Return the highest user id of any stored user or order, so deleted users' ids are not reused."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_order(self, order: Dict) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_orders(self, orders: Iterable[Dict]) -> None:
+        """Store orders in bulk, replacing any with the same transaction id."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_orders(self, user_id: int, offset: int = 0, limit: int = -1) -> List[Dict]:
+        """Return a user's orders newest first, skipping `offset` and returning at most `limit` (-1: all)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_orders(self, user_id: int) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def revenue_by_day(self, start: float, end: float) -> List[Tuple[int, int, int]]:
+        """
+        Return (UTC day number, revenue in kobo, order count) for each day with
+        orders created at or after `start` and before `end` (Unix timestamps).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_checkouts(self, checkouts: List[Tuple[User, Dict]]) -> None:
+        """
+        Commit a batch of checkouts in one transaction.
+
+        Each checkout is the paying user (with the balance already debited)
+        and its order; the order's quantities are taken off product stock.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    SQLite storage in WAL mode.
+
+    Usernames and emails are unique case-insensitively and indexed, as are
+    product names and the owner of each order, so single records can be read
+    and written without loading everything. Orders are owned by user id, not
+    username (see models.user.User). Balances, prices and order totals are
+    stored in kobo. Databases from before user ids get them when opened.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT NOT NULL COLLATE NOCASE PRIMARY KEY,
+            email TEXT NOT NULL COLLATE NOCASE UNIQUE,
+            password_hash TEXT NOT NULL,
+            balance INTEGER NOT NULL DEFAULT 0,
+            user_id INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            stock INTEGER NOT NULL DEFAULT 10
+        );
+        CREATE INDEX IF NOT EXISTS products_name ON products (name COLLATE NOCASE);
+        CREATE TABLE IF NOT EXISTS orders (
+            transaction_id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            items TEXT NOT NULL,
+            user_id INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS orders_created_at ON orders (created_at);
+    """
+    # Tables of databases from before user ids get the column: users are
+    # numbered in the order they were added, and each order gets the id of
+    # the user who had its username
+    UPGRADES = {
+        'users': """
+            ALTER TABLE users ADD COLUMN user_id INTEGER NOT NULL DEFAULT 0;
+            UPDATE users SET user_id = rowid;
+        """,
+        'orders': """
+            ALTER TABLE orders ADD COLUMN user_id INTEGER NOT NULL DEFAULT 0;
+            UPDATE orders SET user_id = COALESCE((SELECT users.user_id FROM users
+                                                  WHERE users.username = orders.username), 0);
+            DROP INDEX IF EXISTS orders_username;
+        """,
+    }
+    # Created after the upgrades, as they index the new columns
+    INDEXES = """
+        CREATE UNIQUE INDEX IF NOT EXISTS users_user_id ON users (user_id);
+        CREATE INDEX IF NOT EXISTS orders_user_id ON orders (user_id, created_at);
+    """
+
+    # Statements are kept as constants so sqlite3's statement cache reuses them
+    SELECT_USERS = "SELECT username, email, password_hash, balance, user_id FROM users"
+    SELECT_USER = ("SELECT username, email, password_hash, balance, user_id FROM users "
+                   "WHERE username = ? OR email = ? LIMIT 1")
+    UPSERT_USER = ("INSERT INTO users (username, email, password_hash, balance, user_id) VALUES (?, ?, ?, ?, ?) "
+                   "ON CONFLICT (username) DO UPDATE SET email = excluded.email, "
+                   "password_hash = excluded.password_hash, balance = excluded.balance, user_id = excluded.user_id")
+    RENAME_USER = ("UPDATE users SET username = ?, email = ?, password_hash = ?, balance = ?, user_id = ? "
+                   "WHERE username = ?")
+    LAST_USER_ID = ("SELECT MAX((SELECT COALESCE(MAX(user_id), 0) FROM users), "
+                    "(SELECT COALESCE(MAX(user_id), 0) FROM orders))")
+    DELETE_USER = "DELETE FROM users WHERE username = ?"
+    SELECT_PRODUCTS = "SELECT id, name, price, stock FROM products ORDER BY id"
+    UPSERT_PRODUCT = ("INSERT INTO products (id, name, price, stock) VALUES (?, ?, ?, ?) "
+                      "ON CONFLICT (id) DO UPDATE SET name = excluded.name, "
+                      "price = excluded.price, stock = excluded.stock")
+    INSERT_ORDER = ("INSERT INTO orders (transaction_id, username, total, created_at, items, user_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?)")
+    REPLACE_ORDER = ("INSERT OR REPLACE INTO orders (transaction_id, username, total, created_at, items, user_id) "
+                     "VALUES (?, ?, ?, ?, ?, ?)")
+    UPDATE_BALANCE = "UPDATE users SET balance = ? WHERE username = ?"
+    TAKE_STOCK = "UPDATE products SET stock = MAX(stock - ?, 0) WHERE id = ?"
+    ADD_STOCK = "UPDATE products SET stock = MAX(stock + ?, 0) WHERE id = ?"
+    UPDATE_PRICE = "UPDATE products SET price = ? WHERE id = ?"
+    SELECT_ORDERS = ("SELECT transaction_id, username, total, created_at, items, user_id FROM orders "
+                     "WHERE user_id = ? ORDER BY created_at DESC LIMIT ? OFFSET ?")
+    COUNT_ORDERS = "SELECT COUNT(*) FROM orders WHERE user_id = ?"
+    REVENUE_BY_DAY = ("SELECT CAST(created_at / 86400 AS INTEGER) AS day, SUM(total), COUNT(*) FROM orders "
+                      "WHERE created_at >= ? AND created_at < ? GROUP BY day ORDER BY day")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, cached_statements=64)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        for table, upgrade in self.UPGRADES.items():
+            if not any(column[1] == 'user_id' for column in self._conn.execute(f"PRAGMA table_info({table})")):
+                self._conn.executescript(f"BEGIN; {upgrade} COMMIT;")
+        self._conn.executescript(self.INDEXES)
+
+    @staticmethod
+    def _user_row(user: User) -> tuple:
+        return user.username, user.email, user.password_hash, user.balance, user.user_id
+
+    @staticmethod
+    def _order_row(order: Dict) -> tuple:
+        return (order['transaction_id'], order['username'], order['total'], order['created_at'],
+                json.dumps(order['items']), order.get('user_id', 0))
+
+    def load_users(self) -> List[User]:
+        with self._lock:
+            return [User(*row) for row in self._conn.execute(self.SELECT_USERS)]
+
+    def get_user(self, identity: str) -> User | None:
+        with self._lock:
+            row = self._conn.execute(self.SELECT_USER, (identity, identity)).fetchone()
+        return User(*row) if row else None
+
+    def save_users(self, users: Iterable[User]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(self.UPSERT_USER, (self._user_row(user) for user in users))
+
+    def save_user(self, user: User, previous_username: str | None = None) -> None:
+        with self._lock, self._conn:
+            if previous_username and previous_username != user.username:
+                self._conn.execute(self.RENAME_USER, self._user_row(user) + (previous_username,))
+            else:
+                self._conn.execute(self.UPSERT_USER, self._user_row(user))
+
+    def delete_user(self, username: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(self.DELETE_USER, (username,))
+
+    def load_products(self) -> List[Product]:
+        with self._lock:
+            return [Product(*row) for row in self._conn.execute(self.SELECT_PRODUCTS)]
+
+    def save_products(self, products: Iterable[Product]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(self.UPSERT_PRODUCT, (
+                (product.id, product.name, product.price, product.stock) for product in products
+            ))
+
+    def save_prices(self, prices: Iterable[Tuple[int, int]]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(self.UPDATE_PRICE, ((price, product_id) for product_id, price in prices))
+
+    def add_stock(self, units: Iterable[Tuple[int, int]]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(self.ADD_STOCK, (
+                (quantity, product_id) for product_id, quantity in units if quantity
+            ))
+
+    def last_user_id(self) -> int:
+        with self._lock:
+            return self._conn.execute(self.LAST_USER_ID).fetchone()[0]
+
+    def save_order(self, order: Dict) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(self.INSERT_ORDER, self._order_row(order))
+
+    def save_orders(self, orders: Iterable[Dict]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(self.REPLACE_ORDER, (self._order_row(order) for order in orders))
+
+    def save_checkouts(self, checkouts: List[Tuple[User, Dict]]) -> None:
+        with self._lock, self._conn:
+            for user, order in checkouts:
+                self._conn.execute(self.UPDATE_BALANCE, (user.balance, user.username))
+                self._conn.executemany(self.TAKE_STOCK, (
+                    (item['quantity'], item['product_id']) for item in order['items']
+                ))
+                self._conn.execute(self.INSERT_ORDER, self._order_row(order))
+
+    def load_orders(self, user_id: int, offset: int = 0, limit: int = -1) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(self.SELECT_ORDERS, (user_id, limit, offset)).fetchall()
+        return [{'transaction_id': row[0], 'username': row[1], 'total': row[2],
+                 'created_at': row[3], 'items': json.loads(row[4]), 'user_id': row[5]} for row in rows]
+
+    def count_orders(self, user_id: int) -> int:
+        with self._lock:
+            return self._conn.execute(self.COUNT_ORDERS, (user_id,)).fetchone()[0]
+
+    def revenue_by_day(self, start: float, end: float) -> List[Tuple[int, int, int]]:
+        with self._lock:
+            return self._conn.execute(self.REVENUE_BY_DAY, (start, end)).fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_backend: StorageBackend | None = None
+
+
+def get_backend() -> StorageBackend | None:
+    """Return the configured backend, or None when the text files are used."""
+    return _backend
+
+
+def set_backend(backend: StorageBackend | None) -> None:
+    """Switch the services to `backend`; None switches back to the text files."""
+    global _backend
+    if _backend is not None and _backend is not backend:
+        _backend.close()
+    _backend = backend
+
+
+def configure_from_env() -> None:
+    """Use SQLite when ECOMMERCE_SQLITE_PATH is set, the text files otherwise."""
+    path = os.environ.get(SQLITE_PATH_ENV)
+    if path:
+        set_backend(SQLiteStorage(path))
+
+
+def migrate_text_to_sqlite(db_path: str) -> SQLiteStorage:
+    """
+    Copy the users, orders and products from the text files in data/ into a SQLite database.
+
+    Committed checkouts missing from the order log are recovered first, so
+    the orders are complete and product stock accounts for the units sold.
+    Existing rows with the same username, transaction id or product id are
+    overwritten.
+
+    :param db_path: Path of the database to create or update
+    :return: The SQLite backend, not yet activated (see set_backend)
+    """
+    from ..models.user import users
+    from ..services.catalog import all_products, product_count
+    from ..services.checkout_service import recover_orders
+    from ..services.orders import order_log
+    from ..services.user_service import load_users
+    from ..services.product_service import load_products
+
+    global _backend
+    previous, _backend = _backend, None
+    try:
+        load_users()
+        recover_orders()
+        load_products()
+    finally:
+        _backend = previous
+
+    ensure_data_directory()
+    sqlite_storage = SQLiteStorage(db_path)
+    sqlite_storage.save_users(users)
+    sqlite_storage.save_orders(order_log)
+    sqlite_storage.save_products(all_products())
+    print(f"Migrated {len(users)} users, {order_log.count} orders and {product_count()} products to {db_path}")
+    return sqlite_storage
+
+
+if __name__ == "__main__":
+    migrate_text_to_sqlite(sys.argv[1] if len(sys.argv) > 1 else 'data/store.db').close()
@@ -0,0 +1,151 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from ..benchmarks import generate_users, generate_warehouses
+from ..models.user import User
+from ..services import catalog, user_service
+from ..services.cart_service import add_to_cart, checkout_cart
+from ..services.journal import Journal
+from ..services.orders import order_log, user_orders, ORDERS_PATH
+from ..services.session import Session
+from ..services.startup import load_store, catalog_ready
+from ..services.warehouse_state import stock_ledger
+
+
+def _close_files() -> None:
+    user_service.accounts_journal.close()
+    stock_ledger.journal.close()
+    order_log.close()
+    if user_service.account_file is not None:
+        user_service.account_file.close()
+        user_service.account_file = None
+
+
+class RecoveryTest(unittest.TestCase):
+    """Restarts after crashes and mode switches, each in a fresh data directory."""
+
+    def setUp(self):
+        self._previous_directory = os.getcwd()
+        _close_files()
+        self._directory = tempfile.TemporaryDirectory(prefix='ecommerce-test-')
+        os.chdir(self._directory.name)
+        generate_users(3)
+        generate_warehouses(20)
+        self._output = contextlib.redirect_stdout(io.StringIO())
+        self._output.__enter__()
+
+    def tearDown(self):
+        self._output.__exit__(None, None, None)
+        _close_files()
+        user_service.binary_accounts = False
+        os.chdir(self._previous_directory)
+        self._directory.cleanup()
+
+    def _restart(self, binary: bool = False) -> None:
+        """Start the store again from the files, as after a crash (nothing is flushed or compacted)."""
+        _close_files()
+        user_service.binary_accounts = binary
+        load_store(lazy=binary)
+        catalog_ready.wait()
+
+    def _buy(self, user: User, product_id: int, quantity: int) -> str:
+        session = Session(f"test-{product_id}", user)
+        self.assertTrue(add_to_cart(session, catalog.get_product(product_id), quantity))
+        return checkout_cart(session)
+
+    def test_torn_journal_tail_is_ignored_and_overwritten(self):
+        path = 'data/test.journal'
+        journal = Journal(path)
+        journal.append({'n': 1})
+        journal.append({'n': 2})
+        journal.close()
+        with open(path, 'ab') as f:
+            f.write(b'{"n": 3')
+
+        journal = Journal(path)
+        self.assertEqual([record['n'] for record in journal.replay()], [1, 2])
+        journal.append({'n': 4})
+        journal.close()
+        self.assertEqual([record['n'] for record in Journal(path).replay()], [1, 2, 4])
+
+    def test_torn_order_log_tail_is_ignored_and_overwritten(self):
+        self._restart()
+        user = user_service.find_user('user0')
+        self._buy(user, 1, 1)
+        order_log.close()
+        with open(ORDERS_PATH, 'a') as f:
+            f.write('{"transaction_id": "TXN')
+
+        self._restart()
+        self.assertEqual(order_log.count, 1)
+        self._buy(user_service.find_user('user0'), 2, 1)
+        self._restart()
+        self.assertEqual(order_log.count, 2)
+        self.assertEqual(user_orders(user.user_id)[1], 2)
+
+    def test_checkout_is_recovered_when_the_order_log_append_was_lost(self):
+        self._restart()
+        user = user_service.find_user('user0')
+        balance, stock = user.balance, catalog.get_product(1).stock
+        price = catalog.get_product(1).price
+        self._buy(user, 1, 2)
+        # Crash after the checkout reached the accounts journal but before its order reached the log
+        order_log.close()
+        with open(ORDERS_PATH, 'w'):
+            pass
+
+        self._restart()
+        user = user_service.find_user('user0')
+        self.assertEqual(user.balance, balance - 2 * price)
+        self.assertEqual(order_log.count, 1)
+        self.assertEqual(user_orders(user.user_id)[1], 1)
+        self.assertEqual(catalog.get_product(1).stock, stock - 2)
+
+    def test_switching_between_binary_and_text_accounts_keeps_changes(self):
+        self._restart(binary=True)
+        user = user_service.find_user('user0')
+        self._buy(user, 1, 1)
+        balance = user.balance
+        user_service.rename_user(user, 'renamed')
+        user_service.save_user(user, 'user0')
+        # Compaction in binary mode only checkpoints accounts.bin
+        user_service.save_users()
+
+        self._restart()
+        user = user_service.find_user('renamed')
+        self.assertIsNotNone(user)
+        self.assertIsNone(user_service.find_user('user0'))
+        self.assertEqual(user.balance, balance)
+        self.assertEqual(user_orders(user.user_id)[1], 1)
+        user.balance += 1
+        user_service.save_user(user)
+
+        self._restart(binary=True)
+        self.assertEqual(user_service.find_user('renamed').balance, balance + 1)
+
+    def test_account_too_wide_for_binary_records_is_not_journaled(self):
+        self._restart(binary=True)
+        user = User('wide', 'a' * 130 + '@example.com', 'hash')
+        records = user_service.accounts_journal.record_count
+        with self.assertRaises(ValueError):
+            user_service.save_user(user)
+        self.assertEqual(user_service.accounts_journal.record_count, records)
+
+    def test_journaled_account_too_wide_for_binary_records_is_skipped_on_replay(self):
+        self._restart(binary=True)
+        # As journaled by a build that did not check field widths
+        user_service.accounts_journal.append(
+            {'op': 'put', 'key': 'wide', 'user': User('wide', 'a' * 130 + '@example.com', 'hash', 0, 90).to_dict()})
+        user_service.accounts_journal.append(
+            {'op': 'put', 'key': 'narrow', 'user': User('narrow', 'narrow@example.com', 'hash', 0, 91).to_dict()})
+
+        self._restart(binary=True)
+        self.assertIsNone(user_service.find_user('wide'))
+        self.assertIsNotNone(user_service.find_user('narrow'))
+
+
+if __name__ == '__main__':
+    unittest.main()
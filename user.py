@@ -1,9 +1,24 @@
+from .base import SlottedModel
+
 users = []
-current_user = None
 
-class User:
-    def __init__(self, username, email, password_hash, balance=0):
+class User(SlottedModel):
+    """
+    A user account; `balance` is in kobo.
+
+    `user_id` is handed out when the account is registered (0 until then,
+    see services.user_service.register_user) and never changes, so orders
+    are kept under it rather than under the username, which can change.
+
+    Users can be weakly referenced, so the user directory can find accounts
+    that were evicted from its cache but are still in use.
+    """
+
+    __slots__ = ('username', 'email', 'password_hash', 'balance', 'user_id', '__weakref__')
+
+    def __init__(self, username, email, password_hash, balance=0, user_id=0):
         self.username = username
         self.email = email
         self.password_hash = password_hash
         self.balance = balance
+        self.user_id = user_id
@@ -1,46 +1,626 @@
+import atexit
 import os
-from ..models.user import users
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Tuple
+
+from ..models.user import users, User
+from ..services import metrics
+from ..services.account_store import AccountFile, check_fields
+from ..services.journal import Journal, write_snapshot
+from ..services.orders import order_log
+from ..services.storage import get_backend
+from ..utils.credentials import verify_password, needs_rehash, hash_password, burn_verify_time
 from ..utils.helpers import ensure_data_directory
+from ..utils.money import to_kobo, kobo_to_str
+
+ACCOUNTS_PATH = 'data/accounts.txt'
+ACCOUNTS_JOURNAL_PATH = 'data/accounts.journal'
+ACCOUNTS_BINARY_PATH = 'data/accounts.bin'
+# Number of journal records after which save_user compacts them into accounts.txt
+COMPACT_THRESHOLD = 10000
+
+# When enabled, save_user appends to the journal instead of rewriting accounts.txt
+journal_enabled: bool = True
+accounts_journal = Journal(ACCOUNTS_JOURNAL_PATH)
+atexit.register(accounts_journal.close)
+
+# When enabled, accounts live in data/accounts.bin (see services.account_store)
+# instead of accounts.txt, and the directory runs in cached mode (below).
+binary_accounts: bool = False
+account_file: AccountFile | None = None
+
+# When enabled and a storage backend is configured, the directory runs in
+# cached mode on top of the backend.
+lazy_users: bool = False
+
+# In cached mode load_users loads nothing. Accounts are fetched by key when
+# first looked up and the USER_CACHE_SIZE most recently used are kept in the
+# indexes below; `users` stays empty.
+USER_CACHE_SIZE = 10_000
+# With a storage backend, changes saved in cached mode are written back at most
+# this many seconds later, or when the user is evicted
+WRITE_BACK_DELAY = 1.0
+
+# Case-normalized lookup indexes over `users` (or the cache, in cached mode).
+# They share the User objects with the list and are only ever changed together
+# with it, under _directory_lock.
+users_by_username: Dict[str, User] = {}
+users_by_email: Dict[str, User] = {}
+# id() of each User in `users` -> its position there, so removing one is O(1)
+_user_positions: Dict[int, int] = {}
+_directory_lock = threading.RLock()
+# Highest user id handed out or loaded so far (see register_user)
+_last_user_id = 0
 
+# Cached mode: username key -> User, least recently used first
+_cache: 'OrderedDict[str, User]' = OrderedDict()
+# Cached mode: every account object still referenced anywhere (e.g. by a
+# session), evicted or not, so a lookup never creates a second copy of it
+_live_by_username: 'weakref.WeakValueDictionary[str, User]' = weakref.WeakValueDictionary()
+_live_by_email: 'weakref.WeakValueDictionary[str, User]' = weakref.WeakValueDictionary()
+# Cached mode with a backend: id(user) -> (user, username the backend has it under)
+_dirty: Dict[int, Tuple[User, str]] = {}
+_write_back_timer: threading.Timer | None = None
 
+_cache_hits = metrics.counter('ecommerce_user_cache_hits_total', "Users found in the cache in cached mode")
+_cache_misses = metrics.counter('ecommerce_user_cache_misses_total', "Users fetched from storage in cached mode")
+_failed_sign_ins = metrics.counter('ecommerce_failed_sign_ins_total', "Sign-ins with an unknown user or wrong password")
+
+
+@metrics.timed('ecommerce_load_users_seconds', "Time to load the user accounts")
 def load_users() -> None:
     """
     Load user accounts from data/accounts.txt file.
 
-    Reads CSV format: username,email,password_hash,balance
-    Skips empty lines and malformed entries. Creates empty users list
-    if file doesn't exist.
+    Reads CSV format: username,email,password_hash,balance,user_id
+    Skips empty lines, malformed entries and entries whose username or email
+    is already taken. Creates empty users list if file doesn't exist.
+    Lines written before accounts had ids (without the user_id column) get
+    ids in file order, and the file is rewritten to keep them.
+    Then replays data/accounts.journal on top, so changes saved with
+    save_user since the last compaction are restored.
+    If a storage backend is configured (see services.storage), users are
+    read from it instead.
+    Rebuilds the username and email indexes.
+    In binary accounts mode the journal is applied to data/accounts.bin
+    instead (which is created from accounts.txt the first time). Back in
+    text mode, accounts are read from accounts.bin while it exists, as
+    accounts.txt is not kept up to date meanwhile, and it is converted back.
+    In cached mode (see lazy_users) no account is read until it is looked up.
     """
-    global users
-    users = []
+    global _last_user_id
+    backend = get_backend()
+    with _directory_lock:
+        flush_users()
+        users.clear()
+        users_by_username.clear()
+        users_by_email.clear()
+        _user_positions.clear()
+        _cache.clear()
+        _live_by_username.clear()
+        _live_by_email.clear()
+        _last_user_id = 0
+        if backend is not None:
+            _last_user_id = backend.last_user_id()
+            if not lazy_users:
+                for user in backend.load_users():
+                    register_user(user)
+            return
+        if binary_accounts:
+            _open_account_file()
+            _last_user_id = account_file.last_user_id
+            return
+        # Once binary accounts mode has run, accounts.bin holds the latest
+        # state and accounts.txt is stale (see _import_account_file)
+        if os.path.exists(ACCOUNTS_BINARY_PATH):
+            accounts = _read_account_file()
+        else:
+            accounts = list(_read_accounts())
+        # Accounts from before ids existed are numbered after every stored id
+        _last_user_id = max([_last_user_id] + [user.user_id for user in accounts])
+        unnumbered = any(not user.user_id for user in accounts)
+        for user in accounts:
+            register_user(user)
+        for record in accounts_journal.replay():
+            _apply_journal_record(record)
+        if os.path.exists(ACCOUNTS_BINARY_PATH):
+            _import_account_file()
+        elif unnumbered:
+            save_users()
+
+
+def _read_accounts() -> Iterator[User]:
     try:
-        with open('data/accounts.txt', 'r') as f:
+        with open(ACCOUNTS_PATH, 'r') as f:
             for line in f:
                 line = line.strip()
                 if not line:
                     continue
                 try:
-                    username, email, password_hash, balance = line.split(',')
+                    fields = line.split(',')
+                    if len(fields) == 4:
+                        fields.append('0')
+                    username, email, password_hash, balance, user_id = fields
                     if not username.strip() or not email.strip() or not password_hash.strip():
                         continue
-                    balance_float = float(balance.strip())
-                    if balance_float < 0:
+                    balance_kobo = to_kobo(balance.strip())
+                    if balance_kobo < 0:
                         continue
-                    users.append({
-                        'username': username.strip(),
-                        'email': email.strip(),
-                        'password_hash': password_hash.strip(),
-                        'balance': float(balance.strip())
-                    })
+                    yield User(
+                        username.strip(),
+                        email.strip(),
+                        password_hash.strip(),
+                        balance_kobo,
+                        int(user_id)
+                    )
                 except ValueError:
                     continue
     except (FileNotFoundError, PermissionError) as e:
         print(f"Could not load users: {e}")
 
 
-def save_users():
+def _read_account_file() -> List[User]:
+    global account_file, _last_user_id
+    if account_file is not None:
+        account_file.close()
+        account_file = None
+    binary = AccountFile(ACCOUNTS_BINARY_PATH)
+    try:
+        _last_user_id = binary.last_user_id
+        return list(binary)
+    finally:
+        binary.close()
+
+
+def _account_lines() -> Iterator[str]:
+    for user in users:
+        yield f"{user.username},{user.email},{user.password_hash},{kobo_to_str(user.balance)},{user.user_id}\n"
+
+
+def _import_account_file() -> None:
+    """
+    Write the accounts loaded from data/accounts.bin to accounts.txt and delete accounts.bin.
+
+    accounts.txt is left behind while binary accounts mode runs, so this
+    hands the accounts back to text mode. accounts.bin goes before the
+    journal is reset: a crash in between leaves accounts.txt plus a journal
+    that replays onto it.
+    """
+    with _directory_lock, accounts_journal.lock:
+        write_snapshot(ACCOUNTS_PATH, _account_lines())
+        os.remove(ACCOUNTS_BINARY_PATH)
+        accounts_journal.reset()
+
+
+def _open_account_file() -> None:
+    global account_file
+    if account_file is not None:
+        account_file.close()
+    converting = not os.path.exists(ACCOUNTS_BINARY_PATH) and os.path.exists(ACCOUNTS_PATH)
     ensure_data_directory()
-    with open('data/accounts.txt', 'w') as f:
-        for user in users:
-            line = f"{user['username']},{user['email']},{user['password_hash']},{user['balance']}\n"
-            f.write(line)
+    account_file = AccountFile(ACCOUNTS_BINARY_PATH)
+    if converting:
+        usernames, emails, accounts = set(), set(), []
+        for user in _read_accounts():
+            if _normalize(user.username) not in usernames and _normalize(user.email) not in emails:
+                usernames.add(_normalize(user.username))
+                emails.add(_normalize(user.email))
+                accounts.append(user)
+        last_user_id = max((user.user_id for user in accounts), default=0)
+        for user in accounts:
+            if not user.user_id:
+                last_user_id += 1
+                user.user_id = last_user_id
+        account_file.replace_all(accounts)
+    orders = []
+    for record in accounts_journal.replay():
+        if record['op'] == 'delete':
+            account_file.delete(record['key'])
+        else:
+            try:
+                account_file.put(User.from_dict(record['user']), record['key'])
+            except ValueError as e:
+                print(f"Skipping the journaled account '{record['key']}': {e}")
+        if record['op'] == 'checkout':
+            orders.append(record['order'])
+    account_file.flush()
+    # The reset drops the checkout records recover_orders would repair the
+    # order log from, so repair it now
+    if orders:
+        order_log.load()
+        order_log.recover(orders)
+    accounts_journal.reset()
+
+
+def write_account_record(user: User) -> None:
+    """
+    In binary accounts mode, rewrite the user's record in data/accounts.bin.
+
+    For callers that journal a change themselves (see services.checkout_service).
+    """
+    if account_file is not None and binary_accounts:
+        account_file.put(user)
+
+
+def _apply_journal_record(record: Dict) -> None:
+    user = find_user(record['key'])
+    if record['op'] == 'delete':
+        if user is not None:
+            remove_user(user)
+        return
+
+    # 'put' and 'checkout' records both carry the user's full state
+    data: Dict = record['user']
+    # The snapshot may already include a rename that is still in the journal
+    if user is None:
+        user = find_user(data['username'])
+    if user is None:
+        register_user(User.from_dict(data))
+        return
+    rename_user(user, data['username'])
+    change_user_email(user, data['email'])
+    user.password_hash = data['password_hash']
+    user.balance = data['balance']
+
+
+@metrics.timed('ecommerce_save_users_seconds', "Time to write every user account")
+def save_users():
+    """
+    Write every user to data/accounts.txt and empty the journal.
+
+    The file is replaced atomically, so a crash leaves either the old or
+    the new snapshot. This is also how the journal gets compacted.
+    """
+    backend = get_backend()
+    if backend is not None:
+        if _cached_mode():
+            flush_users()
+        else:
+            backend.save_users(users)
+        return
+    # The journal lock keeps checkouts (see services.checkout_service) from
+    # appending a record between the snapshot and the reset, which would lose it
+    with _directory_lock, accounts_journal.lock:
+        if binary_accounts and account_file is not None:
+            # Records are already up to date; checkpoint them instead of rewriting
+            account_file.flush()
+            accounts_journal.reset()
+            return
+        write_snapshot(ACCOUNTS_PATH, _account_lines())
+        accounts_journal.reset()
+
+
+@metrics.timed('ecommerce_save_user_seconds', "Time to persist a change to one user account")
+def save_user(user: User, previous_username: str | None = None) -> None:
+    """
+    Persist the changes made to a single user.
+
+    In journal mode this appends one record to data/accounts.journal, so the
+    cost does not depend on the number of users. The journal is compacted into
+    data/accounts.txt once it holds COMPACT_THRESHOLD records. Otherwise it
+    falls back to save_users. In binary accounts mode the user's record in
+    data/accounts.bin is also rewritten in place, and compaction only flushes
+    that file.
+
+    :param user: The new or changed User
+    :param previous_username: The username before a rename, if it changed
+    :return: None
+    :raises ValueError: If the username, email or password hash is too long
+                        for data/accounts.bin (nothing is saved then)
+    """
+    backend = get_backend()
+    if backend is not None:
+        if _cached_mode():
+            _mark_dirty(user, previous_username)
+        else:
+            backend.save_user(user, previous_username)
+        return
+    if not journal_enabled:
+        if binary_accounts and account_file is not None:
+            account_file.put(user, previous_username)
+        save_users()
+        return
+    # The journal may be replayed into data/accounts.bin, so a user that does
+    # not fit there must not be journaled
+    check_fields(user)
+    accounts_journal.append({
+        'op': 'put',
+        'key': previous_username or user.username,
+        'user': user.to_dict()
+    })
+    if binary_accounts and account_file is not None:
+        account_file.put(user, previous_username)
+    if accounts_journal.record_count >= COMPACT_THRESHOLD:
+        save_users()
+
+
+def save_user_deletion(username: str) -> None:
+    """
+    Persist the removal of a user (see remove_user).
+
+    :param username: Username of the deleted user
+    :return: None
+    """
+    backend = get_backend()
+    if backend is not None:
+        backend.delete_user(username)
+        return
+    if not journal_enabled:
+        if binary_accounts and account_file is not None:
+            account_file.delete(username)
+        save_users()
+        return
+    accounts_journal.append({'op': 'delete', 'key': username})
+    if binary_accounts and account_file is not None:
+        account_file.delete(username)
+    if accounts_journal.record_count >= COMPACT_THRESHOLD:
+        save_users()
+
+
+def _mark_dirty(user: User, previous_username: str | None) -> None:
+    global _write_back_timer
+    with _directory_lock:
+        # A user renamed twice before write-back is still stored under the first name
+        _dirty.setdefault(id(user), (user, previous_username or user.username))
+        if _write_back_timer is None:
+            _write_back_timer = threading.Timer(WRITE_BACK_DELAY, flush_users)
+            _write_back_timer.daemon = True
+            _write_back_timer.start()
+
+
+def _write_back(user: User) -> None:
+    entry = _dirty.pop(id(user), None)
+    if entry is not None:
+        stored_username = entry[1]
+        get_backend().save_user(user, stored_username if stored_username != user.username else None)
+
+
+def flush_users() -> None:
+    """Write every change saved in cached mode to the storage backend."""
+    global _write_back_timer
+    with _directory_lock:
+        if _write_back_timer is not None:
+            _write_back_timer.cancel()
+            _write_back_timer = None
+        for user, _ in list(_dirty.values()):
+            _write_back(user)
+
+
+atexit.register(flush_users)
+
+
+def _normalize(identity: str) -> str:
+    return identity.strip().lower()
+
+
+def _cached_mode() -> bool:
+    if get_backend() is not None:
+        return lazy_users
+    return binary_accounts and account_file is not None
+
+
+def find_user(identity: str) -> User | None:
+    """
+    Find a user by username or email, case-insensitively.
+
+    In cached mode the account is fetched from data/accounts.bin or the
+    storage backend if it is not in the cache.
+
+    :param identity: Username or email address
+    :return: The User, or None if no user matches
+    """
+    key = _normalize(identity)
+    user = users_by_username.get(key) or users_by_email.get(key)
+    if _cached_mode():
+        if user is None:
+            _cache_misses.inc()
+            return _load_account(key)
+        _cache_hits.inc()
+        with _directory_lock:
+            username_key = _normalize(user.username)
+            if username_key in _cache:
+                _cache.move_to_end(username_key)
+    return user
+
+
+def _fetch(key: str) -> User | None:
+    backend = get_backend()
+    if backend is not None:
+        return backend.get_user(key)
+    return account_file.find(key)
+
+
+def _load_account(key: str) -> User | None:
+    """Fetch an account by username or email key and add it to the cache."""
+    with _directory_lock:
+        user = (users_by_username.get(key) or users_by_email.get(key)
+                or _live_by_username.get(key) or _live_by_email.get(key))
+        if user is None:
+            user = _fetch(key)
+        if user is not None:
+            _remember(user)
+        return user
+
+
+def _remember(user: User) -> None:
+    """Put a user at the most recently used end of the cache, evicting the least recently used."""
+    username_key = _normalize(user.username)
+    email_key = _normalize(user.email)
+    _cache[username_key] = user
+    _cache.move_to_end(username_key)
+    users_by_username[username_key] = user
+    users_by_email[email_key] = user
+    _live_by_username[username_key] = user
+    _live_by_email[email_key] = user
+    while len(_cache) > USER_CACHE_SIZE:
+        evicted_key, evicted = _cache.popitem(last=False)
+        users_by_username.pop(evicted_key, None)
+        users_by_email.pop(_normalize(evicted.email), None)
+        if id(evicted) in _dirty:
+            _write_back(evicted)
+
+
+def _username_owner(key: str) -> User | None:
+    user = users_by_username.get(key)
+    if user is None and _cached_mode():
+        user = _load_account(key)
+        if user is not None and _normalize(user.username) != key:
+            return None
+    return user
+
+
+def _email_owner(key: str) -> User | None:
+    user = users_by_email.get(key)
+    if user is None and _cached_mode():
+        user = _load_account(key)
+        if user is not None and _normalize(user.email) != key:
+            return None
+    return user
+
+
+@metrics.timed('ecommerce_authenticate_seconds', "Time to check a sign-in, including password hashing")
+def authenticate(identity: str, password: str) -> User | None:
+    """
+    Check a user's password (see utils.credentials).
+
+    A hash made with an older scheme or weaker work factors is replaced
+    with a current one and saved.
+
+    :param identity: Username or email
+    :param password: Password as entered
+    :return: The User, or None if there is no such user or the password is wrong
+    """
+    user = find_user(identity)
+    if user is None:
+        burn_verify_time(password)
+        _failed_sign_ins.inc()
+        return None
+    password_hash = user.password_hash
+    if not verify_password(password, password_hash):
+        _failed_sign_ins.inc()
+        return None
+    if needs_rehash(password_hash):
+        new_hash = hash_password(password)
+        with _directory_lock:
+            # Keep a password changed in the meantime
+            if user.password_hash == password_hash:
+                user.password_hash = new_hash
+                save_user(user)
+    return user
+
+
+def username_taken(username: str) -> bool:
+    return _username_owner(_normalize(username)) is not None
+
+
+def email_taken(email: str) -> bool:
+    return _email_owner(_normalize(email)) is not None
+
+
+def register_user(user: User) -> bool:
+    """
+    Add a new user to the directory.
+
+    A user without an id gets the next one: above every id stored or
+    loaded, and every id an order in the order log belongs to, so an id is
+    never handed out twice even when its account was deleted.
+
+    :param user: The new User
+    :return: True if added, False if the username or email is already taken
+    """
+    global _last_user_id
+    username_key = _normalize(user.username)
+    email_key = _normalize(user.email)
+    with _directory_lock:
+        if _username_owner(username_key) is not None or _email_owner(email_key) is not None:
+            return False
+        if not user.user_id:
+            user.user_id = max(_last_user_id, order_log.last_user_id) + 1
+        _last_user_id = max(_last_user_id, user.user_id)
+        if _cached_mode():
+            _remember(user)
+            return True
+        _user_positions[id(user)] = len(users)
+        users.append(user)
+        users_by_username[username_key] = user
+        users_by_email[email_key] = user
+    return True
+
+
+def rename_user(user: User, new_username: str) -> bool:
+    """
+    Change a user's username and re-index it.
+
+    :param user: User currently in the directory
+    :param new_username: The new username
+    :return: True if renamed, False if the new username belongs to another user
+    """
+    new_key = _normalize(new_username)
+    with _directory_lock:
+        owner = _username_owner(new_key)
+        if owner is not None and owner is not user:
+            return False
+        old_key = _normalize(user.username)
+        users_by_username.pop(old_key, None)
+        user.username = new_username
+        users_by_username[new_key] = user
+        if _cached_mode():
+            _cache.pop(old_key, None)
+            _live_by_username.pop(old_key, None)
+            _remember(user)
+    return True
+
+
+def change_user_email(user: User, new_email: str) -> bool:
+    """
+    Change a user's email address and re-index it.
+
+    :param user: User currently in the directory
+    :param new_email: The new email address
+    :return: True if changed, False if the new email belongs to another user
+    """
+    new_key = _normalize(new_email)
+    with _directory_lock:
+        owner = _email_owner(new_key)
+        if owner is not None and owner is not user:
+            return False
+        old_key = _normalize(user.email)
+        users_by_email.pop(old_key, None)
+        user.email = new_email
+        users_by_email[new_key] = user
+        if _cached_mode():
+            _live_by_email.pop(old_key, None)
+            _remember(user)
+    return True
+
+
+def remove_user(user: User) -> None:
+    """
+    Remove a user from the directory and its indexes.
+
+    The last user in `users` takes the removed user's place there.
+
+    :param user: User currently in the directory
+    :return: None
+    """
+    username_key = _normalize(user.username)
+    email_key = _normalize(user.email)
+    with _directory_lock:
+        if _cached_mode():
+            _cache.pop(username_key, None)
+            _live_by_username.pop(username_key, None)
+            _live_by_email.pop(email_key, None)
+            # Store a pending rename, so the deletion finds the account by its current name
+            if id(user) in _dirty:
+                _write_back(user)
+        else:
+            # Move the last user into the removed one's place instead of shifting the rest
+            position = _user_positions.pop(id(user))
+            last = users.pop()
+            if last is not user:
+                users[position] = last
+                _user_positions[id(last)] = position
+        users_by_username.pop(username_key, None)
+        users_by_email.pop(email_key, None)
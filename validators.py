@@ -2,9 +2,16 @@ import re
 
 EMAIL_VALIDATE_PATTERN = r"^\S+@\S+\.\S+$"
 PASSWORD_VALIDATE_PATTERN = r"^(?=.*?[A-Z])(?=.*?[a-z])(?=.*?[0-9])(?=.*?[#?!@$%^&*-]).{16,}$"
+# Longest username and email in UTF-8 bytes, the widths of their fields in
+# data/accounts.bin (see services.account_store)
+MAX_USERNAME_BYTES = 64
+MAX_EMAIL_BYTES = 128
+
+def validate_username_length(username: str) -> bool:
+    return len(username.encode()) <= MAX_USERNAME_BYTES
 
 def validate_email(mail: str) -> bool:
-    return bool(re.match(EMAIL_VALIDATE_PATTERN, mail))
+    return len(mail.encode()) <= MAX_EMAIL_BYTES and bool(re.match(EMAIL_VALIDATE_PATTERN, mail))
 
 def validate_password(password: str) -> bool:
     return bool(re.match(PASSWORD_VALIDATE_PATTERN, password))
\ No newline at end of file
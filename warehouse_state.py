@@ -0,0 +1,367 @@
+import atexit
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from ..services.journal import Journal, write_snapshot
+
+# SKU registry as written by earlier versions, imported when there is no snapshot
+WAREHOUSE_STATE_PATH = 'data/warehouse_state.json'
+STOCK_PATH = 'data/stock.txt'
+STOCK_JOURNAL_PATH = 'data/stock.journal'
+# Number of stock journal records after which they are compacted into stock.txt
+STOCK_COMPACT_THRESHOLD = 10000
+CATALOG_SNAPSHOT_PATH = 'data/catalog.bin'
+# Snapshot header: magic, number of files, number of retired ids, next id,
+# CRC-32 of everything after the header
+SNAPSHOT_HEADER = struct.Struct('<8sIIqI')
+SNAPSHOT_MAGIC = b'ECCATS02'
+# Per file: path length, number of items, names length (UTF-8 bytes),
+# mtime in ns, size, content digest
+SNAPSHOT_SEGMENT = struct.Struct('<IIQqq16s')
+# Separates names in the snapshot; it cannot occur in a name, as it separates items
+NAME_SEPARATOR = ';'
+
+
+def file_signature(file_path: str) -> Tuple[int, int]:
+    """Return (mtime in ns, size) of a file, which changes whenever the file is rewritten."""
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def file_digest(file_path: str) -> str:
+    """Return a BLAKE2b digest of a file's content."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SkuRegistry:
+    """
+    Product ids of the items in each warehouse file, kept across restarts in a binary snapshot.
+
+    For every file it records the signature and digest it had when last
+    parsed, and the id, name and price of each item in file order. When a
+    file is parsed again its items keep the ids of the items with the same
+    name (duplicates in order), so adding, removing or reordering warehouse
+    files never moves an id to a different product. New items are numbered
+    sequentially from next_id, which keeps ids dense (see
+    catalog.ColumnarCatalog). The ids of removed items are kept per name,
+    so an item that is removed and added back gets its old id again.
+    Ids recorded by earlier versions are kept.
+
+    The same snapshot lets files that have not changed be loaded without
+    parsing them (see items). It is read in one go and kept as read: ids and
+    prices are raw 64-bit integers and names one string per file, so a
+    file's items are decoded with a few bulk operations when they are asked
+    for. Files parsed since are held decoded until the next save(). Stock is
+    not stored, as it comes from the stock ledger and the order log.
+
+    Layout: SNAPSHOT_HEADER, then for each file SNAPSHOT_SEGMENT followed by
+    the UTF-8 path, the ids and prices (little-endian) and the names, then
+    the retired ids and the length and text of their names. A registry
+    written as JSON by earlier versions is imported if there is no snapshot.
+    """
+
+    def __init__(self, path: str = CATALOG_SNAPSHOT_PATH, legacy_path: str = WAREHOUSE_STATE_PATH):
+        self.path = path
+        self.legacy_path = legacy_path
+        # file path -> {'mtime_ns', 'size', 'digest'} and either the 'offset',
+        # 'count' and 'names_length' of its items in the snapshot, or the
+        # 'ids', 'names' and 'prices' of a file parsed since (prices are None
+        # for files imported from JSON until they are parsed again)
+        self.files: Dict[str, Dict] = {}
+        # name -> ids of items with that name that are no longer in any file
+        self.retired: Dict[str, List[int]] = {}
+        self.next_id = 1
+        # Ids at or above next_id recorded by earlier versions, which derived ids from names
+        self._taken: Set[int] = set()
+        self._data = b''
+        self.dirty = False
+
+    def load(self) -> None:
+        """Read the snapshot; if it is missing, unreadable or corrupt, import the JSON registry instead."""
+        self.files, self.retired, self.next_id, self._data = {}, {}, 1, b''
+        self._taken = set()
+        self.dirty = False
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            magic, file_count, retired_count, next_id, checksum = SNAPSHOT_HEADER.unpack_from(data)
+        except (FileNotFoundError, struct.error):
+            self._import_legacy()
+            return
+        if magic != SNAPSHOT_MAGIC or zlib.crc32(memoryview(data)[SNAPSHOT_HEADER.size:]) != checksum:
+            self._import_legacy()
+            return
+        offset = SNAPSHOT_HEADER.size
+        for _ in range(file_count):
+            path_length, count, names_length, mtime_ns, size, digest = SNAPSHOT_SEGMENT.unpack_from(data, offset)
+            offset += SNAPSHOT_SEGMENT.size
+            file_path = data[offset:offset + path_length].decode()
+            offset += path_length
+            self.files[file_path] = {'mtime_ns': mtime_ns, 'size': size, 'digest': digest.hex(),
+                                     'offset': offset, 'count': count, 'names_length': names_length}
+            offset += 16 * count + names_length
+        retired_ids = _int64_array(data[offset:offset + 8 * retired_count])
+        offset += 8 * retired_count
+        names_length, = struct.unpack_from('<Q', data, offset)
+        offset += 8
+        retired_names = _split_names(data[offset:offset + names_length], retired_count)
+        for name, product_id in zip(retired_names, retired_ids):
+            self.retired.setdefault(name, []).append(product_id)
+        self.next_id = next_id
+        self._data = data
+        self._find_taken()
+
+    def _import_legacy(self) -> None:
+        try:
+            with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            files = state['files']
+            self.retired = state.get('retired', {})
+            self.next_id = state.get('next_id', 1)
+        except (FileNotFoundError, ValueError, KeyError):
+            return
+        for file_path, entry in files.items():
+            # No prices were recorded, so the file counts as changed and is parsed again
+            self.files[file_path] = {'mtime_ns': -1, 'size': entry['size'], 'digest': bytes(16).hex(),
+                                     'ids': array('q', (product_id for _, product_id in entry['skus'])),
+                                     'names': [name for name, _ in entry['skus']], 'prices': None}
+        self._find_taken()
+        self.dirty = True
+
+    def _find_taken(self) -> None:
+        groups = [self._ids(entry) for entry in self.files.values()] + list(self.retired.values())
+        self._taken = {product_id for ids in groups if ids and max(ids) >= self.next_id
+                       for product_id in ids if product_id >= self.next_id}
+
+    def save(self) -> None:
+        """Write the snapshot if the registry changed since it was loaded or saved."""
+        if not self.dirty:
+            return
+        body, layout = [], []
+        for file_path, entry in self.files.items():
+            ids, names, prices = self._columns(entry)
+            if prices is None:
+                prices = array('q', bytes(8 * len(ids)))
+            encoded_path, encoded_names = file_path.encode(), NAME_SEPARATOR.join(names).encode()
+            body += [SNAPSHOT_SEGMENT.pack(len(encoded_path), len(ids), len(encoded_names),
+                                           entry['mtime_ns'], entry['size'], bytes.fromhex(entry['digest'])),
+                     encoded_path, _int64_bytes(ids), _int64_bytes(prices), encoded_names]
+            layout.append((entry, len(encoded_path), len(ids), len(encoded_names)))
+        retired = [(name, product_id) for name, ids in self.retired.items() for product_id in ids]
+        encoded_names = NAME_SEPARATOR.join(name for name, _ in retired).encode()
+        body += [_int64_bytes(array('q', (product_id for _, product_id in retired))),
+                 struct.pack('<Q', len(encoded_names)), encoded_names]
+        checksum = 0
+        for part in body:
+            checksum = zlib.crc32(part, checksum)
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(self.files), len(retired), self.next_id, checksum)
+        write_snapshot(self.path, [header] + body, binary=True)
+        # Hold the registry as written, so the items of files parsed since are released
+        self._data = b''.join([header] + body)
+        offset = SNAPSHOT_HEADER.size
+        for entry, path_length, count, names_length in layout:
+            offset += SNAPSHOT_SEGMENT.size + path_length
+            for key in ('ids', 'names', 'prices'):
+                entry.pop(key, None)
+            entry.update(offset=offset, count=count, names_length=names_length)
+            offset += 16 * count + names_length
+        self.dirty = False
+
+    def _ids(self, entry: Dict) -> array:
+        if 'ids' in entry:
+            return entry['ids']
+        return _int64_array(self._data[entry['offset']:entry['offset'] + 8 * entry['count']])
+
+    def _columns(self, entry: Dict) -> Tuple[array, List[str], array | None]:
+        if 'ids' in entry:
+            return entry['ids'], entry['names'], entry['prices']
+        offset, count = entry['offset'], entry['count']
+        ids = self._ids(entry)
+        prices = _int64_array(self._data[offset + 8 * count:offset + 16 * count])
+        offset += 16 * count
+        return ids, _split_names(self._data[offset:offset + entry['names_length']], count), prices
+
+    def _new_id(self, name: str) -> int:
+        ids = self.retired.get(name)
+        if ids:
+            product_id = ids.pop()
+            if not ids:
+                del self.retired[name]
+            return product_id
+        while self.next_id in self._taken:
+            self.next_id += 1
+        product_id = self.next_id
+        self.next_id += 1
+        return product_id
+
+    def _retire(self, skus: Iterable[Tuple[str, int]]) -> None:
+        for name, product_id in skus:
+            self.retired.setdefault(name, []).append(product_id)
+
+    def is_unchanged(self, file_path: str) -> bool:
+        """
+        Return True if a file has the content it had when last parsed.
+
+        Compares the signature first and only hashes the file if that differs,
+        recording the new signature when just the modification time changed.
+        """
+        entry = self.files.get(file_path)
+        if entry is None:
+            return False
+        mtime_ns, size = file_signature(file_path)
+        if entry['mtime_ns'] == mtime_ns and entry['size'] == size:
+            return True
+        if entry['size'] != size or entry['digest'] != file_digest(file_path):
+            return False
+        entry['mtime_ns'] = mtime_ns
+        self.dirty = True
+        return True
+
+    def items(self, file_path: str) -> Iterator[Tuple[int, str, int]]:
+        """Return the (id, name, price) items of a file as last parsed, e.g. when is_unchanged says it still has them."""
+        return zip(*self._columns(self.files[file_path]))
+
+    def skus(self, file_path: str) -> List[Tuple[str, int]]:
+        """Return the (name, id) pairs recorded for a file, in file order."""
+        entry = self.files.get(file_path)
+        if entry is None:
+            return []
+        ids, names, _ = self._columns(entry)
+        return list(zip(names, ids))
+
+    def assign(self, file_path: str, items: Iterable[Tuple[str, int]]) -> Iterator[Tuple[int, str, int]]:
+        """
+        Number the (name, price) items of a file as they are parsed, and record them once all are through.
+
+        Items are numbered one at a time, so a file never has to be held in
+        memory whole. The file's signature is taken before the first item,
+        so a change made while it is read is picked up next time.
+
+        :param file_path: Warehouse file the items are parsed from
+        :param items: (name, price) pairs in file order
+        :return: Iterator of (id, name, price)
+        :raises FileNotFoundError: If the file does not exist
+        """
+        mtime_ns, size = file_signature(file_path)
+        # Ids this file had, per name
+        previous: Dict[str, List[int]] = {}
+        for name, product_id in self.skus(file_path):
+            previous.setdefault(name, []).append(product_id)
+        for ids in previous.values():
+            ids.reverse()
+        ids, names, prices = array('q'), [], array('q')
+        for name, price in items:
+            known = previous.get(name)
+            product_id = known.pop() if known else self._new_id(name)
+            ids.append(product_id)
+            names.append(name)
+            prices.append(price)
+            yield product_id, name, price
+        self._retire((name, product_id) for name, known in previous.items() for product_id in known)
+        self.files[file_path] = {'mtime_ns': mtime_ns, 'size': size, 'digest': file_digest(file_path),
+                                 'ids': ids, 'names': names, 'prices': prices}
+        self.dirty = True
+
+    def forget(self, file_path: str) -> List[int]:
+        """Drop a file that no longer exists and return the ids of its items."""
+        skus = self.skus(file_path)
+        if self.files.pop(file_path, None) is None:
+            return []
+        self.dirty = True
+        self._retire(skus)
+        return [product_id for _, product_id in skus]
+
+
+def _int64_array(data: bytes) -> array:
+    values = array('q')
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def _int64_bytes(values: array) -> bytes:
+    if sys.byteorder != 'little':
+        values = array('q', values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _split_names(data: bytes, count: int) -> List[str]:
+    return data.decode().split(NAME_SEPARATOR) if count else []
+
+
+class StockLedger:
+    """
+    Units of stock received per product id beyond the default stock, kept across restarts.
+
+    Units sold are in the order log (see services.orders), so the stock of a
+    product is its default stock plus the units received less the units sold.
+    Changes are appended to a journal, which is compacted into a snapshot of
+    "id,units" lines once it holds STOCK_COMPACT_THRESHOLD records.
+    """
+
+    def __init__(self, path: str = STOCK_PATH, journal_path: str = STOCK_JOURNAL_PATH):
+        self.path = path
+        self.journal = Journal(journal_path)
+        self.received: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        with self._lock:
+            self.received.clear()
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            product_id, units = line.split(',')
+                            self.received[int(product_id)] = int(units)
+                        except ValueError:
+                            continue
+            except FileNotFoundError:
+                pass
+            for record in self.journal.replay():
+                self._apply(record['units'])
+
+    def _apply(self, units: Dict) -> None:
+        for product_id, quantity in units.items():
+            product_id = int(product_id)
+            total = self.received.get(product_id, 0) + quantity
+            if total:
+                self.received[product_id] = total
+            else:
+                self.received.pop(product_id, None)
+
+    def record(self, units: Dict[int, int]) -> None:
+        """
+        Persist units added to (or, if negative, removed from) the stock of products.
+
+        :param units: Product id -> units actually added
+        """
+        units = {product_id: quantity for product_id, quantity in units.items() if quantity}
+        if not units:
+            return
+        with self._lock:
+            self.journal.append({'op': 'receive', 'units': units})
+            self._apply(units)
+            if self.journal.record_count >= STOCK_COMPACT_THRESHOLD:
+                with self.journal.lock:
+                    write_snapshot(self.path, (f"{product_id},{quantity}\n"
+                                               for product_id, quantity in self.received.items()))
+                    self.journal.reset()
+
+
+sku_registry = SkuRegistry()
+stock_ledger = StockLedger()
+atexit.register(stock_ledger.journal.close)